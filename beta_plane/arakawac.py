@@ -2,19 +2,161 @@
 """The Arakawa-C Grid"""
 
 import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+
+def resolve_dtype(dtype):
+    """Returns the (state, tendency) dtypes selected by the `dtype` option of
+    a grid: a floating point dtype for both, or 'mixed' for a float64 state
+    with float32 tendencies and scratch arrays."""
+    if isinstance(dtype, str) and dtype == 'mixed':
+        return np.dtype(np.float64), np.dtype(np.float32)
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        raise ValueError("dtype must be a floating point type or 'mixed', not %r" % dtype)
+    return dtype, dtype
+
+
+def equatorial_stretching(a):
+    """Returns a mapping for the `ygrid` option of ArakawaCGrid with rows
+    finest at y=0 and about cosh(a) times taller at the edges of the domain."""
+    return lambda s: np.sinh(a*s) / np.sinh(a)
+
+
+def _along(axis, index):
+    # index of a field along its x (axis=-2) or y (axis=-1) dimension
+    return (Ellipsis, index) if axis == -1 else (Ellipsis, index, slice(None))
+
+
+class PackedState(NDArrayOperatorsMixin):
+    """Several staggered fields stored in one contiguous buffer.
+
+    `vector` is the flat buffer holding every field, boundary (ghost)
+    cells included.  `padded` gives a view of each field with its
+    boundaries and `fields` a view without them.  Indexing and iterating
+    work on the unpadded fields, so
+
+        u, v, phi = grid.state
+
+    unpacks without copying.  Arithmetic is element-wise on `vector`, and
+    `np.zeros_like(state)` returns a new PackedState of the same layout.
+
+    Only the trailing `spatial_ndim` axes of each field have boundaries,
+    any leading (e.g. ensemble) axes are kept whole.
+    """
+    def __init__(self, shapes, vector=None, spatial_ndim=None, dtype=np.float64):
+        self.shapes = tuple(tuple(s) for s in shapes)
+        self.spatial_ndim = spatial_ndim
+        sizes = [int(np.prod(s)) for s in self.shapes]
+        if vector is None:
+            vector = np.zeros(sum(sizes), dtype=dtype)
+        self.vector = vector
+
+        offsets = np.cumsum([0] + sizes)
+        self.padded = tuple(vector[start:end].reshape(shape) for start, end, shape
+                                in zip(offsets[:-1], offsets[1:], self.shapes))
+        self.fields = tuple(field[(Ellipsis,) + (slice(1,-1),)*(spatial_ndim or field.ndim)]
+                                for field in self.padded)
+
+    def _wrap(self, vector):
+        return PackedState(self.shapes, vector, self.spatial_ndim)
+
+    def copy(self):
+        return self._wrap(self.vector.copy())
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(value, PackedState) and key == slice(None):
+            self.vector[:] = value.vector
+        elif isinstance(key, slice):
+            fields = self.fields[key]
+            if np.isscalar(value):
+                value = [value]*len(fields)
+            for field, val in zip(fields, value):
+                field[...] = val
+        else:
+            self.fields[key][...] = value
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [x.vector if isinstance(x, PackedState) else x for x in inputs]
+        out = kwargs.get('out')
+        if out is not None:
+            kwargs['out'] = tuple(x.vector if isinstance(x, PackedState) else x for x in out)
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if out is not None:
+            return out[0] if len(out) == 1 else out
+        if isinstance(result, tuple):
+            return tuple(self._wrap(r) for r in result)
+        return self._wrap(result)
+
+    def __array_function__(self, func, types, args, kwargs):
+        if func in (np.zeros_like, np.ones_like, np.empty_like, np.full_like, np.copy):
+            return self._wrap(func(self.vector, *args[1:], **kwargs))
+        return NotImplemented
+
+
+class Workspace(object):
+    """A pool of preallocated scratch arrays.
+
+    Calling the workspace with a name and a shape returns an array that is
+    allocated on first request and reused on every subsequent request, so
+    operators given `out=workspace(name, shape)` run without allocating.
+
+    `cached` keeps fields derived from the state, e.g. velocities
+    interpolated to other points, so they are computed once per state.
+    """
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self._arrays = {}
+        self._cached = {}
+        self._cache_key = None
+
+    def __call__(self, name, shape, dtype=None):
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        key = (name, tuple(shape), dtype)
+        arr = self._arrays.get(key)
+        if arr is None:
+            arr = self._arrays[key] = np.empty(shape, dtype=dtype)
+        return arr
+
+    def cached(self, key, name, shape, compute):
+        """Returns the derived field `name`, calling `compute(out)` to fill a
+        reserved array only if it has not been computed since `key` last
+        changed.  The field is returned as a read-only view."""
+        if key != self._cache_key:
+            self._cached.clear()
+            self._cache_key = key
+        field = self._cached.get(name)
+        if field is None:
+            field = compute(out=self('cached ' + name, shape)).view()
+            field.flags.writeable = False
+            self._cached[name] = field
+        return field
+
 
 class Arakawa1D(object):
-    def __init__(self, nx, Lx):
+    def __init__(self, nx, Lx, dtype=np.float64):
         super(Arakawa1D, self).__init__()
         self.nx = nx
         self.Lx = Lx
+        self.ensemble_shape = ()
+        self.dtype, self.tendency_dtype = resolve_dtype(dtype)
 
         # Arakawa-C grid
         # +-------+    * (nx)   phi points at grid centres
         # u  phi  u    * (nx+1) u points on vertical edges  (u[0] and u[nx] are boundary values)
         # +-------+
-        self._u = np.zeros((nx+3), dtype=np.float)
-        self._phi = np.zeros((nx+2), dtype=np.float)
+        self._packed = PackedState([(nx+3,), (nx+2,)], dtype=self.dtype)
+        self._u, self._phi = self._packed.padded
+        self.workspace = Workspace(self.tendency_dtype)
 
         self.dx = dx = float(Lx) / nx
 
@@ -24,7 +166,7 @@ class Arakawa1D(object):
 
         self.shape = self.phi.shape
         self._shape = self._phi.shape
-        self.true_slice = [slice(1,-1)]*len(self.shape)  # slice of state arrays w/out BCs
+        self.true_slice = (Ellipsis, slice(1,-1))  # slice of state arrays w/out BCs
 
     # define u, v and h properties to return state without the boundaries
     @property
@@ -37,50 +179,63 @@ class Arakawa1D(object):
 
     @property
     def state(self):
-        return np.array([self.u, self.phi])
+        return self._packed
 
     @state.setter
     def state(self, value):
-        u, phi = value
-        self.u[:] = u
-        self.phi[:] = phi
+        self._packed[:] = value
+
+    @property
+    def state_vector(self):
+        """Flat view of the packed u, phi buffer, including boundaries."""
+        return self._packed.vector
 
     # Define finite-difference methods on the grid
-    def diffx(self, psi):
+    # Each operator takes an optional `out` array to write the result into.
+    def diffx(self, psi, out=None):
         """Calculate ∂/∂x[psi] over a single grid square.
 
         i.e. d/dx(psi)[i,j] = (psi[i+1/2, j] - psi[i-1/2, j]) / dx
 
         The derivative is returned at x points at the midpoint between
         x points of the input array."""
-        return (psi[1:] - psi[:-1]) / self.dx
+        out = np.subtract(psi[..., 1:], psi[..., :-1], out=out)
+        out /= self.dx
+        return out
 
-    def diff2x(self, psi):
+    def diff2x(self, psi, out=None):
         """Calculate ∂2/∂x2[psi] over a single grid square.
 
         i.e. d2/dx2(psi)[i,j] = (psi[i+1, j] - psi[i, j] + psi[i-1, j]) / dx^2
 
         The derivative is returned at the same x points as the
         x points of the input array, with dimension (nx-2)."""
-        return (psi[:-2] - 2*psi[1:-1] + psi[2:]) / self.dx**2
+        out = np.multiply(2, psi[..., 1:-1], out=out)
+        np.subtract(psi[..., :-2], out, out=out)
+        out += psi[..., 2:]
+        out /= self.dx**2
+        return out
 
     del2 = diff2x
 
-    def x_average(self, psi):
+    def x_average(self, psi, out=None):
         """Average adjacent values in the x dimension.
         If psi has shape (nx), returns an array of shape (nx-1)."""
-        return 0.5*(psi[:-1] + psi[1:])
+        out = np.add(psi[..., :-1], psi[..., 1:], out=out)
+        out *= 0.5
+        return out
 
-    def advect(self, field):
+    def advect(self, field, out=None):
         """Calculates the conservation of the advected tracer by the fluid flow.
 
         ∂[q]/∂t + ∇ . (uq) = 0
 
         Returns the divergence term i.e. ∇.(uq)
         """
-        q_at_u = self.x_average(field)  # (nx+1)
+        q_at_u = self.x_average(field, out=self.workspace('advect_qu', field.shape[:-1] + self.u.shape))  # (nx+1)
+        q_at_u *= self.u
 
-        return self.diffx(q_at_u * self.u)  # (nx)
+        return self.diffx(q_at_u, out=out)  # (nx)
 
     def _apply_boundary_conditions(self):
         # left and right-hand boundary values the same for u
@@ -99,18 +254,62 @@ class Arakawa1D(object):
 
     def apply_boundary_conditions_to(self, field):
         # periodic boundary in the x-direction
-        field[0] = field[-2]
-        field[-1] = field[1]
+        field[..., 0] = field[..., -2]
+        field[..., -1] = field[..., 1]
 
 
 class ArakawaCGrid(object):
-    def __init__(self, nx, ny, Lx, Ly):
+    """A doubly staggered grid in x and y.
+
+    Given an `ensemble_size`, every field gets a leading axis of that length
+    and each member is an independent model sharing the grid.  Operators
+    and boundary conditions act on all members at once.
+
+    `dtype` sets the precision of the state, e.g. np.float32 to halve the
+    bytes per cell.  With dtype='mixed' the state stays float64 while the
+    tendencies and all scratch arrays are float32.
+
+    The rows are evenly spaced unless `ygrid` gives the latitudes of the
+    ny+1 v points from -Ly/2 to Ly/2, either as an array or as a function
+    mapping evenly spaced s in [-1, 1] to stretched positions in [-1, 1]
+    (see `equatorial_stretching`).  phi and u points are then midway
+    between v points and the y operators use the local grid spacing.
+
+    With `order`=4 the derivatives, Laplacian and averages use fourth order
+    stencils, reaching two points either side rather than one.  Where the
+    stencil would reach past the end of an array, i.e. next to the boundary
+    cells, the points are computed with third order one-sided stencils
+    (second order for the Laplacian).  The wider stencils need a halo of
+    `halo` cells around each tile of a row block or domain decomposition.
+
+    A land-sea `mask` of (nx, ny) booleans, True for the wet cells, shapes
+    the coastlines of the domain.  A u or v point is wet between two wet
+    cells: the boundary conditions keep the flow through every other face
+    at zero, and the Laplacian of a field on cell centres has no flux
+    through them.  The ghost cells of the mask follow the boundary
+    conditions of a tracer, e.g. a periodic domain has a coast where land
+    at one end meets sea at the other.
+    """
+    def __init__(self, nx, ny, Lx, Ly, ensemble_size=None, dtype=np.float64, ygrid=None,
+                 order=2, mask=None):
         super(ArakawaCGrid, self).__init__()
         self.nx = nx
         self.ny = ny
         self.Lx = Lx
         self.Ly = Ly
-        self.true_slice = [slice(1,-1)]*2  # slice of state arrays w/out BCs
+        self.ensemble_size = ensemble_size
+        self.ensemble_shape = () if ensemble_size is None else (ensemble_size,)
+        self.dtype, self.tendency_dtype = resolve_dtype(dtype)
+        self.true_slice = (Ellipsis,) + (slice(1,-1),)*2  # slice of state arrays w/out BCs
+
+        if order not in (2, 4):
+            raise ValueError('order must be 2 or 4, not %r' % (order,))
+        if order == 4 and ygrid is not None:
+            raise ValueError('the fourth order stencils need evenly spaced rows')
+        self.order = order
+        # cells around a tile needed to compute its tendencies: nested wide
+        # stencils read up to three cells away
+        self.halo = 1 if order == 2 else 3
 
         # Arakawa-C grid
         # +-- v --+
@@ -118,9 +317,12 @@ class ArakawaCGrid(object):
         # u  phi  u    * (nx+1, ny) u points on vertical edges  (u[0] and u[nx] are boundary values)
         # |       |    * (nx, ny+1) v points on horizontal edges
         # +-- v --+
-        self._u = np.zeros((nx+3, ny+2), dtype=np.float)
-        self._v = np.zeros((nx+2, ny+3), dtype=np.float)
-        self._phi = np.zeros((nx+2, ny+2), dtype=np.float)
+        # u, v and phi share one contiguous buffer, boundaries included
+        ens = self.ensemble_shape
+        self._packed = PackedState([ens + (nx+3, ny+2), ens + (nx+2, ny+3), ens + (nx+2, ny+2)],
+                                   spatial_ndim=2, dtype=self.dtype)
+        self._u, self._v, self._phi = self._packed.padded
+        self.workspace = Workspace(self.tendency_dtype)   # scratch arrays for the operators
 
         self.dx = dx = float(Lx) / nx
         self.dy = dy = float(Ly) / ny
@@ -129,8 +331,12 @@ class ArakawaCGrid(object):
         self.ux = (-Lx/2 + np.arange(nx+1)*dx)[:, np.newaxis]
         self.vx = (-Lx/2 + dx/2.0 + np.arange(nx)*dx)[:, np.newaxis]
 
-        self.vy = (-Ly/2 + np.arange(ny+1)*dy)[np.newaxis, :]
-        self.uy = (-Ly/2 + dy/2.0 + np.arange(ny)*dy)[np.newaxis, :]
+        self.stretched = ygrid is not None
+        if self.stretched:
+            self._init_stretched_y(ygrid)
+        else:
+            self.vy = (-Ly/2 + np.arange(ny+1)*dy)[np.newaxis, :]
+            self.uy = (-Ly/2 + dy/2.0 + np.arange(ny)*dy)[np.newaxis, :]
 
         self.phix = self.vx
         self.phiy = self.uy
@@ -138,124 +344,390 @@ class ArakawaCGrid(object):
         self.shape = self.phi.shape
         self._shape = self._phi.shape
 
+        self.mask = None
+        if mask is not None:
+            self._init_mask(mask)
+
+    def _init_mask(self, mask):
+        # wet u and v points, and the flat indices of the others in the packed state
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != (self.nx, self.ny):
+            raise ValueError('mask must be %dx%d, not %r' % (self.nx, self.ny, mask.shape))
+        if self.order != 2:
+            raise ValueError('the land-sea mask needs the second order stencils')
+        self.mask = mask
+
+        wet = np.pad(mask, 1, mode='edge').astype(self.tendency_dtype)
+        if hasattr(self, 'apply_boundary_conditions_to'):
+            self.apply_boundary_conditions_to(wet)
+        self._wet_u = wet[:-1, 1:-1] * wet[1:, 1:-1]    # (nx+1, ny)
+        self._wet_v = wet[1:-1, :-1] * wet[1:-1, 1:]    # (nx, ny+1)
+
+        index = PackedState(self._packed.shapes, np.arange(self.state_vector.size), spatial_ndim=2)
+        coast = []
+        for idx, wet_face in zip(index.padded, (self._wet_u, self._wet_v)):
+            idx = idx[..., 1:-1, 1:-1]
+            coast.append(idx[..., np.broadcast_to(wet_face == 0, idx.shape[-2:])].ravel())
+        self._coast = np.concatenate(coast)
+        self._land = index.padded[2][..., 1:-1, 1:-1][..., ~mask].ravel()
+
+    def _mask_view(self, tile):
+        # the land-sea mask of the cells of tile, for a view of the grid on it
+        if self.mask is None:
+            return {}
+        (i0, i1), (j0, j1) = tile
+        return dict(mask=self.mask[i0:i1, j0:j1], _wet_u=self._wet_u[i0:i1+1, j0:j1],
+                    _wet_v=self._wet_v[i0:i1, j0:j1+1])
+
+    def _apply_coastlines(self):
+        # no flow through the faces of land cells, applied before the
+        # boundary conditions copy them into the ghost cells
+        if self.mask is not None:
+            self.state_vector[self._coast] = 0
+
+    def _init_stretched_y(self, ygrid):
+        # positions and metric terms of a non-uniform grid in y
+        ny, Ly = self.ny, self.Ly
+        if callable(ygrid):
+            yv = Ly/2 * np.asarray(ygrid(np.linspace(-1, 1, ny+1)), dtype=np.float64)
+        else:
+            yv = np.asarray(ygrid, dtype=np.float64)
+        if yv.shape != (ny+1,) or np.any(np.diff(yv) <= 0):
+            raise ValueError('ygrid must give %d increasing v point latitudes' % (ny+1))
+        if not np.allclose(yv[[0, -1]], [-Ly/2, Ly/2]):
+            raise ValueError('ygrid must span y = -Ly/2 to Ly/2')
+
+        # boundary cells are mirrored into the boundary (ghost) cells
+        yv = np.concatenate([[2*yv[0] - yv[1]], yv, [2*yv[-1] - yv[-2]]])  # (ny+3) padded v points
+        yphi = 0.5*(yv[1:] + yv[:-1])                                       # (ny+2) padded phi points
+        self.vy = yv[np.newaxis, 1:-1]
+        self.uy = yphi[np.newaxis, 1:-1]
+
+        dtype = self.tendency_dtype
+        self._dy_phi = np.diff(yv).astype(dtype)     # (ny+2) height of each padded cell
+        self._dy_v = np.diff(yphi).astype(dtype)     # (ny+1) distance between phi points, at v points
+        # weights interpolating from the phi points below and above each v point
+        self._wy_below = ((yphi[1:] - yv[1:-1]) / np.diff(yphi)).astype(dtype)
+        self._wy_above = ((yv[1:-1] - yphi[:-1]) / np.diff(yphi)).astype(dtype)
+
+    def _y_metric_view(self, j0, j1):
+        # the metric terms of rows j0:j1, for a view of the grid on those rows
+        if not self.stretched:
+            return {}
+        return dict(_dy_phi=self._dy_phi[j0:j1+2], _dy_v=self._dy_v[j0:j1+1],
+                    _wy_below=self._wy_below[j0:j1+1], _wy_above=self._wy_above[j0:j1+1])
+
+    def _y_spacing(self, n):
+        # spacing of the points either side of each of `n` points in y,
+        # identified by their number: phi rows (ny, or ny+2 with the boundary
+        # cells) lie between v rows and v rows (ny+1, or ny-1 without the
+        # boundaries) between phi rows
+        ny = self.ny
+        if n == ny:
+            return self._dy_phi[1:-1]
+        elif n == ny+2:
+            return self._dy_phi
+        elif n == ny+1:
+            return self._dy_v
+        elif n == ny-1:
+            return self._dy_v[1:-1]
+        raise ValueError('no y points of a %d row grid have length %d' % (ny, n))
+
+    def ensemble_parameter(self, value):
+        """Shape a model parameter so it broadcasts against the fields.
+        A scalar is shared by all members, a sequence gives one value per
+        ensemble member."""
+        value = np.asarray(value, dtype=np.float64)
+        if value.ndim == 0:
+            return float(value)
+        return value.reshape(self.ensemble_shape + (1, 1)).astype(self.tendency_dtype)
+
     # define u, v and h properties to return state without the boundaries
     @property
     def u(self):
-        return self._u[1:-1, 1:-1]
+        return self._u[..., 1:-1, 1:-1]
 
     @property
     def v(self):
-        return self._v[1:-1, 1:-1]
+        return self._v[..., 1:-1, 1:-1]
 
     @property
     def phi(self):
-        return self._phi[1:-1, 1:-1]
+        return self._phi[..., 1:-1, 1:-1]
 
     @property
     def state(self):
-        return np.array([self.u, self.v, self.phi])
+        return self._packed
 
     @state.setter
     def state(self, value):
-        u, v, phi = value
-        self.u[:] = u
-        self.v[:] = v
-        self.phi[:] = phi
+        self._packed[:] = value
+        self.state_changed()
+
+    @property
+    def state_vector(self):
+        """Flat view of the packed u, v, phi buffer, including boundaries."""
+        return self._packed.vector
+
+    def _set_state_buffer(self, vector):
+        """Move the packed state into `vector`, e.g. a shared memory buffer."""
+        vector[:] = self._packed.vector
+        self._packed = self._packed._wrap(vector)
+        self._u, self._v, self._phi = self._packed.padded
+        self.state_changed()
+
+    # Fields derived from the state are cached in the workspace until the
+    # timestep counter `tc` advances or `state_changed` is called
+    _state_changes = 0
+
+    def derived(self, name, shape, compute):
+        """Returns the derived field `name` of the current state, computing
+        it with `compute(out)` at most once.  The array is read-only and is
+        overwritten once the state changes.  The tendencies of a step, the
+        semi-Lagrangian departure points and the diagnostics such as `uvath`
+        (which return copies) share these fields, computed once the boundary
+        conditions (which count as a state change) have been applied."""
+        key = (getattr(self, 'tc', 0), self._state_changes)
+        return self.workspace.cached(key, name, shape, compute)
+
+    def state_changed(self):
+        """Discard the cached derived fields.  Applying the boundary
+        conditions, as every step does first, calls it; otherwise it is
+        needed after writing into the state, e.g. `model.u[:] = ...`, before
+        the tendencies or diagnostics such as `uvath` are computed again."""
+        self._state_changes += 1
 
     # Define finite-difference methods on the grid
-    def diffx(self, psi):
+    # Each operator takes an optional `out` array to write the result into,
+    # typically one taken from `self.workspace`.  Without it a new array
+    # is returned.
+    def diffx(self, psi, out=None):
         """Calculate ∂/∂x[psi] over a single grid square.
 
         i.e. d/dx(psi)[i,j] = (psi[i+1/2, j] - psi[i-1/2, j]) / dx
 
         The derivative is returned at x points at the midpoint between
         x points of the input array."""
-        return (psi[1:,:] - psi[:-1,:]) / self.dx
+        if self.order == 4:
+            return self._diff4(psi, -2, self.dx, out)
+        out = np.subtract(psi[..., 1:, :], psi[..., :-1, :], out=out)
+        out /= self.dx
+        return out
 
-    def diffy(self, psi):
+    def diffy(self, psi, out=None):
         """Calculate ∂/∂y[psi] over a single grid square.
 
         i.e. d/dy(psi)[i,j] = (psi[i, j+1/2] - psi[i, j-1/2]) / dy
 
         The derivative is returned at y points at the midpoint between
         y points of the input array."""
-        return (psi[:, 1:] - psi[:,:-1]) / self.dy
-
-    def del2(self, psi):
-        """Returns the Laplacian of psi."""
-        return self.diff2x(psi)[:, 1:-1] + self.diff2y(psi)[1:-1, :]
-
-    def diff2x(self, psi):
+        if self.order == 4:
+            return self._diff4(psi, -1, self.dy, out)
+        out = np.subtract(psi[..., :, 1:], psi[..., :, :-1], out=out)
+        if self.stretched:
+            out /= self._y_spacing(out.shape[-1])
+        else:
+            out /= self.dy
+        return out
+
+    def del2(self, psi, out=None):
+        """Returns the Laplacian of psi.
+
+        On a grid with a land-sea `mask` the Laplacian of a padded field on
+        cell centres is the divergence of its gradient on the wet faces."""
+        if self.mask is not None and psi.shape[-2:] == (self.nx+2, self.ny+2):
+            return self._masked_del2(psi, out)
+        out = self.diff2x(psi[..., :, 1:-1], out=out)
+        out += self.diff2y(psi[..., 1:-1, :], out=self.workspace('del2', out.shape))
+        return out
+
+    def _masked_del2(self, psi, out):
+        ens, nx, ny = psi.shape[:-2], self.nx, self.ny
+        grad = self.diffx(psi[..., :, 1:-1], out=self.workspace('del2 x', ens + (nx+1, ny)))
+        grad *= self._wet_u
+        out = self.diffx(grad, out=out)
+        grad = self.diffy(psi[..., 1:-1, :], out=self.workspace('del2 y', ens + (nx, ny+1)))
+        grad *= self._wet_v
+        out += self.diffy(grad, out=self.workspace('del2', out.shape))
+        return out
+
+    def diff2x(self, psi, out=None):
         """Calculate ∂2/∂x2[psi] over a single grid square.
 
         i.e. d2/dx2(psi)[i,j] = (psi[i+1, j] - psi[i, j] + psi[i-1, j]) / dx^2
 
         The derivative is returned at the same x points as the
         x points of the input array, with dimension (nx-2, ny)."""
-        return (psi[:-2, :] - 2*psi[1:-1, :] + psi[2:, :]) / self.dx**2
-
-    def diff2y(self, psi):
+        out = np.multiply(2, psi[..., 1:-1, :], out=out)
+        np.subtract(psi[..., :-2, :], out, out=out)
+        out += psi[..., 2:, :]
+        out /= self.dx**2
+        if self.order == 4:
+            self._diff2_4(psi, -2, self.dx, out)
+        return out
+
+    def diff2y(self, psi, out=None):
         """Calculate ∂2/∂y2[psi] over a single grid square.
 
         i.e. d2/dy2(psi)[i,j] = (psi[i, j+1] - psi[i, j] + psi[i, j-1]) / dy^2
 
         The derivative is returned at the same y points as the
         y points of the input array, with dimension (nx, ny-2)."""
-        return (psi[:, :-2] - 2*psi[:, 1:-1] + psi[:, 2:]) / self.dy**2
-
-    def centre_average(self, psi):
+        if self.stretched:
+            # difference of the gradients either side of each point
+            grad = self.diffy(psi, out=self.workspace('diff2y', psi.shape[:-1] + (psi.shape[-1]-1,)))
+            return self.diffy(grad, out=out)
+        out = np.multiply(2, psi[..., :, 1:-1], out=out)
+        np.subtract(psi[..., :, :-2], out, out=out)
+        out += psi[..., :, 2:]
+        out /= self.dy**2
+        if self.order == 4:
+            self._diff2_4(psi, -1, self.dy, out)
+        return out
+
+    def centre_average(self, psi, out=None):
         """Returns the four-point average at the centres between grid points.
         If psi has shape (nx, ny), returns an array of shape (nx-1, ny-1)."""
-        return 0.25*(psi[:-1,:-1] + psi[:-1,1:] + psi[1:, :-1] + psi[1:,1:])
-
-    def y_average(self, psi):
+        if self.order == 4 or self.stretched and psi.shape[-1]-1 in (self.ny+1, self.ny-1):
+            # an average in x then in y: v points are not midway between
+            # phi points on a stretched grid, the fourth order average is
+            # not a four-point one
+            xbar = self.x_average(psi, out=self.workspace('centre_average',
+                                                           psi.shape[:-2] + (psi.shape[-2]-1, psi.shape[-1])))
+            return self.y_average(xbar, out=out)
+        out = np.add(psi[..., :-1, :-1], psi[..., :-1, 1:], out=out)
+        out += psi[..., 1:, :-1]
+        out += psi[..., 1:, 1:]
+        out *= 0.25
+        return out
+
+    def y_average(self, psi, out=None):
         """Average adjacent values in the y dimension.
-        If psi has shape (nx, ny), returns an array of shape (nx, ny-1)."""
-        return 0.5*(psi[:,:-1] + psi[:,1:])
-
-    def x_average(self, psi):
+        If psi has shape (nx, ny), returns an array of shape (nx, ny-1).
+        On a stretched grid, values at phi points are interpolated linearly
+        to the v points between them."""
+        n = psi.shape[-1] - 1
+        if self.stretched and n in (self.ny+1, self.ny-1):
+            edges = slice(None) if n == self.ny+1 else slice(1, -1)
+            out = np.multiply(psi[..., :, :-1], self._wy_below[edges], out=out)
+            out += np.multiply(psi[..., :, 1:], self._wy_above[edges],
+                               out=self.workspace('y_average', out.shape))
+            return out
+        if self.order == 4:
+            return self._average4(psi, -1, out)
+        out = np.add(psi[..., :, :-1], psi[..., :, 1:], out=out)
+        out *= 0.5
+        return out
+
+    def x_average(self, psi, out=None):
         """Average adjacent values in the x dimension.
         If psi has shape (nx, ny), returns an array of shape (nx-1, ny)."""
-        return 0.5*(psi[:-1,:] + psi[1:,:])
-
-    def divergence(self):
+        if self.order == 4:
+            return self._average4(psi, -2, out)
+        out = np.add(psi[..., :-1, :], psi[..., 1:, :], out=out)
+        out *= 0.5
+        return out
+
+    # Fourth order staggered stencils along `axis`, of the same shapes as
+    # the second order operators.  At the first and last points the stencil
+    # is shifted inwards to stay within psi.
+    def _diff4(self, psi, axis, h, out):
+        f = lambda index: psi[_along(axis, index)]
+        out = np.subtract(f(slice(1, None)), f(slice(None, -1)), out=out)
+        out *= 27
+        inner = out[_along(axis, slice(1, -1))]
+        inner -= f(slice(3, None))
+        inner += f(slice(None, -3))
+        out[_along(axis, 0)] = 21*f(1) - 23*f(0) + 3*f(2) - f(3)
+        out[_along(axis, -1)] = 23*f(-1) - 21*f(-2) - 3*f(-3) + f(-4)
+        out /= 24*h
+        return out
+
+    def _average4(self, psi, axis, out):
+        f = lambda index: psi[_along(axis, index)]
+        out = np.add(f(slice(1, None)), f(slice(None, -1)), out=out)
+        out *= 9
+        inner = out[_along(axis, slice(1, -1))]
+        inner -= f(slice(3, None))
+        inner -= f(slice(None, -3))
+        out /= 16
+        out[_along(axis, 0)] = (3*f(0) + 6*f(1) - f(2)) / 8
+        out[_along(axis, -1)] = (3*f(-1) + 6*f(-2) - f(-3)) / 8
+        return out
+
+    def _diff2_4(self, psi, axis, h, out):
+        # overwrites all but the end points of the three point Laplacian `out`
+        f = lambda index: psi[_along(axis, index)]
+        inner = out[_along(axis, slice(1, -1))]
+        np.add(f(slice(1, -3)), f(slice(3, -1)), out=inner)
+        inner *= 16
+        inner -= np.multiply(30, f(slice(2, -2)), out=self.workspace('diff2_4', inner.shape))
+        inner -= f(slice(None, -4))
+        inner -= f(slice(4, None))
+        inner /= 12*h**2
+        return out
+
+    def divergence(self, out=None):
         """Returns the horizontal divergence at h points."""
-        return self.diffx(self.u) + self.diffy(self.v)
+        out = self.diffx(self.u, out=out)
+        out += self.diffy(self.v, out=self.workspace('divergence', out.shape))
+        return out
 
     def vorticity(self):
         """Returns the vorticity at grid corners."""
-        return self.diffy(self.u)[1:-1, :] - self.diffx(self.v)[:, 1:-1]
+        return self.diffy(self.u)[..., 1:-1, :] - self.diffx(self.v)[..., :, 1:-1]
 
     def uvath(self):
-        """Calculate the value of u at h points (cell centres)."""
-        ubar = self.x_average(self.u)  # (nx, ny)
-        vbar = self.y_average(self.v)  # (nx, ny)
-        return ubar, vbar
+        """Calculate the value of u at h points (cell centres).
+        Returns copies of the fields cached for the current state (see
+        `derived`), which the caller may keep and modify."""
+        return tuple(field.copy() for field in self._uvath())
 
     def uvatuv(self):
-        """Calculate the value of u at v and v at u."""
-        ubar = self.centre_average(self._u)[1:-1, :]  # (nx, ny+1)
-        vbar = self.centre_average(self._v)[:, 1:-1]  # (nx+1, ny)
+        """Calculate the value of u at v and v at u.
+        Returns copies of the fields cached for the current state."""
+        return tuple(field.copy() for field in self._uvatuv())
+
+    def _uvath(self):
+        # uvath cached for the step, shared by the tracers and diagnostics
+        ens, nx, ny = self.ensemble_shape, self.nx, self.ny
+        ubar = self.derived('u_at_h', ens + (nx, ny), lambda out: self.x_average(self.u, out=out))
+        vbar = self.derived('v_at_h', ens + (nx, ny), lambda out: self.y_average(self.v, out=out))
+        return ubar, vbar
+
+    def _uvatuv(self):
+        # uvatuv cached for the tendencies of a step, see `derived`
+        ens, nx, ny = self.ensemble_shape, self.nx, self.ny
+        ubar = self.derived('u_at_v', ens + (nx, ny+1),
+                            lambda out: self.centre_average(self._u[..., 1:-1, :], out=out))  # (nx, ny+1)
+        vbar = self.derived('v_at_u', ens + (nx+1, ny),
+                            lambda out: self.centre_average(self._v[..., :, 1:-1], out=out))  # (nx+1, ny)
         return ubar, vbar
 
     def _fix_boundary_corners(self, field):
         # fix corners to be average of neighbours
-        field[0, 0] =  0.5*(field[1, 0] + field[0, 1])
-        field[-1, 0] = 0.5*(field[-2, 0] + field[-1, 1])
-        field[0, -1] = 0.5*(field[1, -1] + field[0, -2])
-        field[-1, -1] = 0.5*(field[-1, -2] + field[-2, -1])
+        field[..., 0, 0] =  0.5*(field[..., 1, 0] + field[..., 0, 1])
+        field[..., -1, 0] = 0.5*(field[..., -2, 0] + field[..., -1, 1])
+        field[..., 0, -1] = 0.5*(field[..., 1, -1] + field[..., 0, -2])
+        field[..., -1, -1] = 0.5*(field[..., -1, -2] + field[..., -2, -1])
 
-    def advect(self, field):
+    def advect(self, field, out=None):
         """Calculates the conservation of the advected tracer by the fluid flow.
 
         ∂[q]/∂t + ∇ . (uq) = 0
 
         Returns the divergence term i.e. ∇.(uq)
         """
-        q_at_u = self.x_average(field)[:, 1:-1]  # (nx+1, ny)
-        q_at_v = self.y_average(field)[1:-1, :]  # (nx, ny+1)
+        work = self.workspace
+        lead = field.shape[:-2]   # ensemble and/or tracer axes
+        q_at_u = self.x_average(field[..., :, 1:-1], out=work('advect_qu', lead + self.u.shape[-2:]))  # (nx+1, ny)
+        q_at_v = self.y_average(field[..., 1:-1, :], out=work('advect_qv', lead + self.v.shape[-2:]))  # (nx, ny+1)
+        q_at_u *= self.u
+        q_at_v *= self.v
 
-        return self.diffx(q_at_u * self.u) + self.diffy(q_at_v * self.v)  # (nx, ny)
+        out = self.diffx(q_at_u, out=out)
+        out += self.diffy(q_at_v, out=work('advect_div', out.shape))
+        return out  # (nx, ny)
 
 
     # def apply_boundary_conditions(self):
@@ -270,79 +742,352 @@ class ArakawaCGrid(object):
 
 
 
-class PeriodicBoundaries:
+class _Linear(object):
+    # A weighted sum of cells of a flat buffer.  Stands in for the value of a
+    # cell while boundary rules are compiled by `compile_boundary_map`.
+    __slots__ = ('terms',)
+
+    def __init__(self, terms):
+        self.terms = terms
+
+    def __add__(self, other):
+        if isinstance(other, _Linear):
+            terms = dict(self.terms)
+            for i, w in other.terms.items():
+                terms[i] = terms.get(i, 0.0) + w
+            return _Linear(terms)
+        if other == 0:
+            return self
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __mul__(self, other):
+        return _Linear({i: w*other for i, w in self.terms.items()})
+
+    __rmul__ = __mul__
+
+
+def compile_boundary_map(shapes, rules, spatial_ndim=2, band=4):
+    """Compile boundary rules into a gather/scatter index map.
+
+    `rules(*fields)` sets the boundary cells of padded fields of the given
+    `shapes`, laid out as in a PackedState, by a sequence of assignments
+    where each value is a copy of another cell, zero, or the mean of two
+    cells.  The rules are run once on symbolic cells to resolve the chains
+    of assignments, giving flat indices `dst`, `src` (2, m) and `weight`
+    such that applying the rules is the same as
+
+        vector[dst] = weight * (vector[src[0]] + vector[src[1]])
+
+    Only the cells within `band` of an edge are tracked, the rules may not
+    read any further inside the domain.
+    """
+    n = sum(int(np.prod(s)) for s in shapes)
+    index = PackedState(shapes, np.arange(n), spatial_ndim)
+    cells = PackedState(shapes, np.full(n, None, dtype=object), spatial_ndim)
+
+    edges = []
+    for idx, cell in zip(index.padded, cells.padded):
+        edge = np.zeros(idx.shape[-spatial_ndim:], dtype=bool)
+        for axis in range(spatial_ndim):
+            edge[(slice(None),)*axis + (slice(None, band),)] = True
+            edge[(slice(None),)*axis + (slice(-band, None),)] = True
+        edge = np.broadcast_to(edge, idx.shape)
+        symbols = np.empty(edge.sum(), dtype=object)
+        symbols[:] = [_Linear({i: 1.0}) for i in idx[edge]]
+        cell[edge] = symbols
+        edges.append(idx[edge])
+
+    rules(*cells.padded)
+
+    dst, src, weight = [], [], []
+    for i in np.concatenate(edges):
+        cell = cells.vector[i]
+        if isinstance(cell, _Linear):
+            terms = sorted((j, w) for j, w in cell.terms.items() if w != 0)
+        elif cell is not None and cell == 0:
+            terms = []
+        else:
+            raise ValueError('boundary rules read beyond %d cells of the edge' % band)
+
+        if terms == [(i, 1.0)]:
+            continue    # not a boundary cell
+        elif not terms:
+            a, b, w = i, i, 0.0
+        elif len(terms) == 1 and terms[0][1] == 1.0:
+            a, b, w = terms[0][0], terms[0][0], 0.5
+        elif len(terms) == 2 and terms[0][1] == terms[1][1]:
+            a, b, w = terms[0][0], terms[1][0], terms[0][1]
+        else:
+            raise ValueError('boundary value %r is not a copy, zero or the mean of two cells'
+                             % dict(terms))
+        dst.append(i)
+        src.append((a, b))
+        weight.append(w)
+
+    return (np.array(dst, dtype=np.intp), np.array(src, dtype=np.intp).reshape(-1, 2).T.copy(),
+            np.array(weight))
+
+
+class IndexMapBoundaries(object):
+    """Base of the boundary condition mixins for the ArakawaCGrid.
+
+    A mixin describes its boundary conditions with two rule methods
+    written as plain numpy assignments on padded arrays:
+
+        _boundary_rules(u, v, phi)   the packed model state
+        _field_boundary_rules(field) a field on cell centres, e.g. a tracer
+
+    The rules are compiled once per layout into an index map (see
+    `compile_boundary_map`) that is applied with a single take and put.
+    """
+    def apply_boundary_conditions(self):
+        self._apply_coastlines()
+        self._apply_boundary_map(self.state_vector, self._packed.shapes, self._boundary_rules)
+        self.state_changed()
+
+    def apply_boundary_conditions_to(self, field):
+        self._apply_boundary_map(field, (field.shape,), self._field_boundary_rules)
+
+    def apply_boundary_map_to(self, vector):
+        """Apply the coastlines and the index map of the boundary conditions
+        to `vector`, a copy of the packed state, leaving the state itself
+        unchanged, e.g. for diagnostics read between steps.  Conditions
+        that depend on the past states, such as those of
+        `RadiationBoundaries`, are not part of the map."""
+        if self.mask is not None:
+            vector[self._coast] = 0
+        self._apply_boundary_map(vector, self._packed.shapes, self._boundary_rules)
+        return vector
+
+    def boundary_map(self, shapes, rules):
+        """Returns the index map of `rules` on fields of the given `shapes`,
+        compiled on first use."""
+        key = (rules.__name__, shapes)
+        maps = self.__dict__.setdefault('_boundary_maps', {})
+        if key not in maps:
+            maps[key] = compile_boundary_map(shapes, rules)
+        return maps[key]
+
+    def _apply_boundary_map(self, buffer, shapes, rules):
+        key = (rules.__name__, shapes)
+        dst, src, weight = self.boundary_map(shapes, rules)
+
+        values = np.take(buffer, src, mode='clip',
+                         out=self.workspace('boundary %s %r' % key, src.shape, buffer.dtype))
+        values[0] += values[1]
+        values[0] *= weight
+        buffer.put(dst, values[0])
+
+
+class PeriodicBoundaries(IndexMapBoundaries):
     """Peridoic domain in the x-direction.
     This is a mixin class for the ArakawaCGrid to produce a grid with
     periodic boundaries in the x-direction.
     """
-    def apply_boundary_conditions(self):
+    def _boundary_rules(self, _u, _v, _phi):
         # left and right-hand boundary values the same for u
         # u[0] = u[nx]
         # copy u[dx] to u[nx+dx]
         # and u[nx-dx] to u[-dx]
         # to simulate periodic continuity
-        self._u[0, :] = self._u[-3, :]
-        self._u[1, :] = self._u[-2, :]
-        self._u[-1, :] = self._u[2, :]
+        _u[..., 0, :] = _u[..., -3, :]
+        _u[..., 1, :] = _u[..., -2, :]
+        _u[..., -1, :] = _u[..., 2, :]
 
         # other fields are not on boundary
         # so just simulate periodic continuity
-        self._v[0, :] = self._v[-2, :]
-        self._v[-1, :] = self._v[1, :]
-        self._phi[0, :] = self._phi[-2, :]
-        self._phi[-1, :] = self._phi[1, :]
+        _v[..., 0, :] = _v[..., -2, :]
+        _v[..., -1, :] = _v[..., 1, :]
+        _phi[..., 0, :] = _phi[..., -2, :]
+        _phi[..., -1, :] = _phi[..., 1, :]
 
         # top and bottom boundaries: zero derivative
-        fields = self._u, self._v, self._phi
-        for field in fields:
-            field[:, 0] = field[:, 1]
-            field[:, -1] = field[:, -2]
+        for field in _u, _v, _phi:
+            field[..., :, 0] = field[..., :, 1]
+            field[..., :, -1] = field[..., :, -2]
             self._fix_boundary_corners(field)
 
-    def apply_boundary_conditions_to(self, field):
+    def _field_boundary_rules(self, field):
         # periodic boundary in the x-direction
-        field[0, :] = field[-2, :]
-        field[-1, :] = field[1, :]
+        field[..., 0, :] = field[..., -2, :]
+        field[..., -1, :] = field[..., 1, :]
 
         # top and bottom boundaries: zero derivative
-        field[:, 0] = field[:, 1]
-        field[:, -1] = field[:, -2]
+        field[..., :, 0] = field[..., :, 1]
+        field[..., :, -1] = field[..., :, -2]
 
         self._fix_boundary_corners(field)
 
 
-class WallBoundaries:
+class WallBoundaries(IndexMapBoundaries):
     """Add walls to the domain at x=0 and x=Lx.
     This is a mixin class for the ArakawaCGrid to produce a grid with
     walled boundaries in the x-direction.
     """
-    def apply_boundary_conditions(self):
+    def _boundary_rules(self, _u, _v, _phi):
         # No flow through the boundary at x=0
-        self._u[0, :] = 0
-        self._u[1, :] = 0
-        self._u[-1, :] = 0
-        self._u[-2, :] = 0
+        _u[..., 0, :] = 0
+        _u[..., 1, :] = 0
+        _u[..., -1, :] = 0
+        _u[..., -2, :] = 0
 
         # free-slip of other variables: zero-derivative
-        self._v[0, :] = self._v[1, :]
-        self._v[-1, :] = self._v[-2, :]
-        self._phi[0, :] = self._phi[1, :]
-        self._phi[-1, :] = self._phi[-2, :]
+        _v[..., 0, :] = _v[..., 1, :]
+        _v[..., -1, :] = _v[..., -2, :]
+        _phi[..., 0, :] = _phi[..., 1, :]
+        _phi[..., -1, :] = _phi[..., -2, :]
 
-        fields = self._u, self._v, self._phi
         # top and bottom boundaries: zero deriv
-        for field in fields:
-            field[:, 0] = field[:, 1]
-            field[:, -1] = field[:, -2]
+        for field in _u, _v, _phi:
+            field[..., :, 0] = field[..., :, 1]
+            field[..., :, -1] = field[..., :, -2]
             self._fix_boundary_corners(field)
 
-    def apply_boundary_conditions_to(self, field):
+    def _field_boundary_rules(self, field):
         # free slip on left and right boundares: zero derivative
-        field[0, :] = field[1, :]
-        field[-1, :] = field[-2, :]
+        field[..., 0, :] = field[..., 1, :]
+        field[..., -1, :] = field[..., -2, :]
 
         # top and bottom boundaries: zero deriv and damping
-        field[:, 0] = field[:, 1]
-        field[:, -1] = field[:, -2]
+        field[..., :, 0] = field[..., :, 1]
+        field[..., :, -1] = field[..., :, -2]
+
+        self._fix_boundary_corners(field)
+
+
+class DoublyPeriodicBoundaries(IndexMapBoundaries):
+    """Periodic domain in both the x and y-directions.
+    This is a mixin class for the ArakawaCGrid.  The sponge of the shallow
+    water models still damps the top and bottom rows unless `r` = 0.
+    """
+    def _boundary_rules(self, _u, _v, _phi):
+        # u[0] = u[nx] and v[:, 0] = v[:, ny] are the same points
+        _u[..., 0, :] = _u[..., -3, :]
+        _u[..., 1, :] = _u[..., -2, :]
+        _u[..., -1, :] = _u[..., 2, :]
+        for field in _v, _phi:
+            field[..., 0, :] = field[..., -2, :]
+            field[..., -1, :] = field[..., 1, :]
+
+        # rows are copied after the columns, which also fills the corners
+        _v[..., :, 0] = _v[..., :, -3]
+        _v[..., :, 1] = _v[..., :, -2]
+        _v[..., :, -1] = _v[..., :, 2]
+        for field in _u, _phi:
+            field[..., :, 0] = field[..., :, -2]
+            field[..., :, -1] = field[..., :, 1]
+
+    def _field_boundary_rules(self, field):
+        field[..., 0, :] = field[..., -2, :]
+        field[..., -1, :] = field[..., 1, :]
+        field[..., :, 0] = field[..., :, -2]
+        field[..., :, -1] = field[..., :, 1]
+
+
+class ClosedBoundaries(IndexMapBoundaries):
+    """Walls on all four sides of the domain.
+    This is a mixin class for the ArakawaCGrid: there is no flow through
+    any wall and the other variables are free-slip.
+    """
+    def _boundary_rules(self, _u, _v, _phi):
+        # No flow through the walls at x=0, x=Lx
+        _u[..., 0, :] = 0
+        _u[..., 1, :] = 0
+        _u[..., -1, :] = 0
+        _u[..., -2, :] = 0
+        for field in _v, _phi:
+            field[..., 0, :] = field[..., 1, :]
+            field[..., -1, :] = field[..., -2, :]
+
+        # and through the walls at y=0, y=Ly
+        _v[..., :, 0] = 0
+        _v[..., :, 1] = 0
+        _v[..., :, -1] = 0
+        _v[..., :, -2] = 0
+        for field in _u, _phi:
+            field[..., :, 0] = field[..., :, 1]
+            field[..., :, -1] = field[..., :, -2]
+
+        for field in _u, _v, _phi:
+            self._fix_boundary_corners(field)
+
+    def _field_boundary_rules(self, field):
+        # free slip on all walls: zero derivative
+        field[..., 0, :] = field[..., 1, :]
+        field[..., -1, :] = field[..., -2, :]
+        field[..., :, 0] = field[..., :, 1]
+        field[..., :, -1] = field[..., :, -2]
 
         self._fix_boundary_corners(field)
+
+
+class RadiationBoundaries(PeriodicBoundaries):
+    """Periodic domain in the x-direction, open to the north and south.
+    This is a mixin class for the shallow water models: waves leave the
+    domain through the top and bottom boundaries instead of being absorbed
+    by sponges, which are not needed and so left out.
+
+    The normal velocity on the open boundaries follows Flather's condition
+    for an outgoing gravity wave,
+
+        v = ± c/Φ (φ - Φ)
+
+    about a resting state of geopotential Φ (the models give c/Φ and Φ, see
+    `_flather_coefficients`: set `phi_rest` of a nonlinear model whose
+    initial state is not at rest on average), and the ghost rows of u and φ are radiated
+    outwards at the phase speed estimated from the previous step, as
+    Orlanski's condition
+
+        ∂[q]/∂t + c ∂[q]/∂n = 0,   0 <= c dt/dy <= 1
+
+    in its implicit upwind form.  Both depend on the state, so they are
+    applied after the index map of `PeriodicBoundaries`, which sets the
+    periodic columns and the zero-derivative rows of the first step, and
+    are not part of `boundary_map`.  Tracers flow out with a zero-derivative
+    boundary.
+    """
+    sponges = False
+
+    def apply_boundary_conditions(self):
+        # the rows of the last step radiate: applied again within a step,
+        # e.g. after nesting feeds back, they radiate from the same rows
+        tc = getattr(self, 'tc', 0)
+        last_tc, rows, before = self.__dict__.get('_radiation_rows', (None, None, None))
+        previous = before if last_tc == tc else rows
+        self._apply_coastlines()
+        self._apply_boundary_map(self.state_vector, self._packed.shapes, self._boundary_rules)
+        if previous is not None:
+            self._radiate(previous)
+        self._flather()
+        self._radiation_rows = (tc, [rows.copy() for rows in self._open_rows()], previous)
+        self.state_changed()
+
+    def _open_rows(self):
+        # the ghost row and first two rows inside the south and north
+        # boundaries of u and phi, ordered outwards-in
+        return [field[..., :, rows] for field in (self._u, self._phi)
+                for rows in (slice(0, 3), slice(-1, -4, -1))]
+
+    def _radiate(self, previous):
+        for rows, old in zip(self._open_rows(), previous):
+            ghost, inner = rows[..., 0], rows[..., 1]
+            # outward phase speed at the first row inside, in rows per step
+            gradient = old[..., 1] - old[..., 2]
+            mu = np.zeros_like(gradient)
+            np.divide(old[..., 1] - inner, gradient, out=mu, where=gradient != 0)
+            np.clip(mu, 0.0, 1.0, out=mu)
+            ghost[:] = (old[..., 0] + mu*inner) / (1.0 + mu)
+
+    def _flather(self):
+        reference, speed = self._flather_coefficients()
+        _v, _phi = self._v, self._phi
+        # φ on the boundary edges, between the ghost and first rows
+        south = 0.5*(_phi[..., :, 0:1] + _phi[..., :, 1:2])
+        north = 0.5*(_phi[..., :, -1:] + _phi[..., :, -2:-1])
+        _v[..., :, 1:2] = -speed*(south - reference)
+        _v[..., :, -2:-1] = speed*(north - reference)
+        self._apply_coastlines()
+        _v[..., :, 0] = _v[..., :, 1]
+        _v[..., :, -1] = _v[..., :, -2]
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Multi-process domain decomposition of the shallow water models.
+
+The domain is split into x/y tiles, each stepped by its own worker process.
+The packed state of the model and its tracers, and their Adams-Bashforth
+tendency history, are moved into one `multiprocessing.shared_memory` block
+mapped by every worker, so the halo of a tile is read directly from its
+neighbours' cells in shared memory.
+"""
+
+import multiprocessing
+import threading
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from arakawac import Workspace
+from rowblocks import extend_tile, owned_region, split, tile_view, view_on
+from timesteppers import adams_bashforth
+
+
+class DomainDecomposition(object):
+    """Step a shallow water model and its tracers with one worker process
+    per tile of a `tiles` = (nx_tiles, ny_tiles) decomposition.
+
+        run = DomainDecomposition(model, tiles=(4, 2))
+        run.step(1000)
+        run.close()
+
+    Each step the parent applies the model's own boundary conditions
+    (periodic or walled) to the shared state.  The workers then compute the
+    tendencies of the points they own, wait until every tile has read its
+    halo and update their part of the state.  Results are bit-identical to
+    stepping the model serially.
+
+    Workers are forked, so forcings are evaluated in every worker on the
+    whole domain and only the tile's part is kept.  A forcing that reads
+    another object than the model sees that object as it was at the fork.
+    """
+    def __init__(self, model, tiles=(2, 1)):
+        if getattr(model, 'backend', None) == 'sparse':
+            raise ValueError('the sparse backend cannot be split into tiles')
+        if model.multistage:
+            raise ValueError('the tiles are stepped by Adams-Bashforth, not by %s' % type(model).__name__)
+        if getattr(model, 'gravity_waves', 'explicit') != 'explicit':
+            raise ValueError('the semi-implicit solve couples the whole domain, it cannot be split into tiles')
+        self.model = model
+        self.objs = [model]
+        if model._tracer_stack is not None and (model._tracer_stack.semi_lagrangian or model.tracer_steps != 1):
+            raise ValueError('semi-Lagrangian or less frequent tracer steps cannot be split into tiles')
+        if model._tracer_stack is not None:
+            self.objs.append(model._tracer_stack)
+        ntx, nty = tiles
+        # the coast faces and land cells of a masked grid, which have no
+        # tendency (see ShallowWater._dstate)
+        self._dry = None
+        if model.mask is not None:
+            dry = np.zeros(model.state_vector.size, dtype=bool)
+            dry[model._coast] = dry[model._land] = True
+            self._dry = model._packed._wrap(dry)
+
+        self.tiles = [(xs, ys, ix == ntx-1, iy == nty-1)
+                      for ix, xs in enumerate(split(model.nx, ntx))
+                      for iy, ys in enumerate(split(model.ny, nty))]
+
+        # shared block: the states, then a ring of three tendency slots for
+        # each, in the precision of the tendencies like that of the timestepper
+        sizes = [obj.state_vector.size for obj in self.objs]
+        dtype, tendency_dtype = model.state_vector.dtype, np.dtype(model.tendency_dtype)
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=sum(sizes)*(dtype.itemsize + 3*tendency_dtype.itemsize))
+
+        self.slots = []
+        offset = sum(sizes)*dtype.itemsize
+        for k, (obj, n) in enumerate(zip(self.objs, sizes)):
+            state = np.ndarray(n, dtype=dtype, buffer=self._shm.buf, offset=sum(sizes[:k])*dtype.itemsize)
+            ring = np.ndarray((3, n), dtype=tendency_dtype, buffer=self._shm.buf, offset=offset)
+            offset += ring.nbytes
+            obj._set_state_buffer(state)
+            # carry over the tendency history of any serial steps: the
+            # slots are indexed by tc % 3 like the ring of the timestepper
+            ring[:] = 0 if obj._history is None else obj._history
+            self.slots.append([obj._packed._wrap(vector) for vector in ring])
+
+        ctx = multiprocessing.get_context('fork')
+        self._barrier = ctx.Barrier(len(self.tiles) + 1)
+        self._nsteps = ctx.RawValue('l', 0)
+        self._errors = ctx.SimpleQueue()   # the error of a failed worker
+        self._workers = [ctx.Process(target=self._work, args=(tile,), daemon=True)
+                         for tile in self.tiles]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def step(self, nsteps=1):
+        """Advance the model and its tracers `nsteps` timesteps.
+
+        If a worker fails, every worker is stopped, the state is moved back
+        into private memory as it was left, and the worker's error is
+        raised here."""
+        try:
+            self._nsteps.value = nsteps
+            self._barrier.wait()
+            for _ in range(nsteps):
+                self.model.apply_boundary_conditions()
+                for stack in self.objs[1:]:
+                    stack.apply_boundary_conditions()
+                self._barrier.wait()    # workers compute tendencies
+                self._barrier.wait()    # workers update the state
+                self._barrier.wait()
+                for obj in self.objs:
+                    obj._incr_timestep()
+        except BaseException as error:
+            self._fail(error)
+
+    def close(self):
+        """Stop the workers and move the state back into private memory."""
+        if not hasattr(self, 'slots'):
+            return      # already closed, or stopped by an error
+        try:
+            self._nsteps.value = 0
+            self._barrier.wait()
+        except BaseException as error:
+            self._fail(error)
+        for worker in self._workers:
+            worker.join()
+        self._release()
+
+    def _release(self):
+        # move the state and tendency history back into private memory
+        for obj, slots in zip(self.objs, self.slots):
+            obj._set_state_buffer(np.empty_like(obj.state_vector))
+            for fstate, slot in zip(obj.history, slots):
+                fstate[:] = slot.vector
+        del self.slots
+        self._shm.close()
+        self._shm.unlink()
+
+    def _fail(self, error):
+        # stop every process after `error` in the parent, or a broken
+        # barrier, then raise the error of the worker that broke it
+        self._barrier.abort()
+        for worker in self._workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self._release()
+        if isinstance(error, threading.BrokenBarrierError) and not self._errors.empty():
+            tile, worker_error, trace = self._errors.get()
+            (i0, i1), (j0, j1) = tile
+            cause = RuntimeError('in the worker of tile x=%d:%d, y=%d:%d\n%s' % (i0, i1, j0, j1, trace))
+            if worker_error is None:
+                raise cause
+            raise worker_error from cause
+        raise error
+
+    def _work(self, tile):
+        try:
+            self._steps(tile)
+        except threading.BrokenBarrierError:
+            pass    # stopped by the parent or another worker
+        except BaseException as error:
+            trace = traceback.format_exc()
+            try:
+                self._errors.put((tile[:2], error, trace))
+            except Exception:
+                self._errors.put((tile[:2], None, trace))   # the error cannot be pickled
+            self._barrier.abort()
+
+    def _steps(self, tile):
+        workspace = Workspace(self.model.workspace.dtype)
+        while True:
+            self._barrier.wait()
+            nsteps = self._nsteps.value
+            if nsteps == 0:
+                return
+            for _ in range(nsteps):
+                self._barrier.wait()    # boundary conditions applied
+                for obj, slots in zip(self.objs, self.slots):
+                    self._tendency(obj, slots[obj.tc % 3], tile, workspace)
+                self._barrier.wait()    # every tile has read its halo
+                for obj, slots in zip(self.objs, self.slots):
+                    self._update(obj, slots, tile)
+                self._barrier.wait()
+                for obj in self.objs:
+                    obj._incr_timestep()
+
+    def _fields(self, obj, terms):
+        # the tracer stack returns a single field rather than a sequence of them
+        return terms if obj is self.model else (terms,)
+
+    def _tendency(self, obj, fstate, tile, workspace):
+        # write the tendency of the points owned by `tile` into `fstate`
+        xs, ys, last_x, last_y = tile
+        view_tile = extend_tile(self.model, (xs, ys))
+        grid_view = tile_view(self.model, view_tile, workspace)
+        terms = self._fields(obj, view_on(obj, self.model, grid_view, view_tile)._dynamics())
+        forcings = [self._fields(obj, term) for term in obj._forcing_terms()]
+
+        for i, field in enumerate(fstate):
+            region, own = owned_region(self.model, field, (xs, ys), last_x, last_y, view_tile)
+            field[region] = terms[i][own]
+            for forcing in forcings:
+                field[region] += np.broadcast_to(forcing[i], field.shape)[region]
+            if obj is self.model and self._dry is not None:
+                field[region][self._dry[i][region]] = 0
+
+    def _update(self, obj, slots, tile):
+        # Adams-Bashforth step of the points owned by `tile`, computed as
+        # the timestepper steps the whole state
+        xs, ys, last_x, last_y = tile
+        coeffs = obj._row_coefficients()
+        steps = [(obj.tc - n) % 3 for n in range(len(coeffs))]
+        for i, field in enumerate(obj._packed.fields):
+            region, _ = owned_region(self.model, field, (xs, ys), last_x, last_y)
+            adams_bashforth(self._rows(obj, field[region]), coeffs,
+                            [self._rows(obj, slot[i][region]) for slot in slots], steps)
+
+    def _rows(self, obj, region):
+        # a region of a field with a leading axis for the rows of weights of
+        # obj: one row for the model, the tracer axis of the stack
+        return region[np.newaxis] if obj is self.model else region
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""Symbolic right-hand sides on the Arakawa-C grid.
+
+The fields of the grid and the grid operators are written as expressions
+that know where on the grid they are, so the slicing and staggering of
+`_dynamics` is worked out automatically:
+
+    from expressions import u, v, phi, Param, Coefficient, Equations, U, V
+    from expressions import diffx, diffy, del2
+
+    g, H, nu = Param('g'), Param('H'), Param('nu')
+    f_u, f_v = Coefficient('f_u', U), Coefficient('f_v', V)
+    linear = Equations(
+        u=f_u*v.at(U) - g*diffx(phi) + nu*del2(u),
+        v=-f_v*u.at(V) - g*diffy(phi) + nu*del2(v),
+        phi=-H*(diffx(u) + diffy(v)))
+
+Adding or multiplying fields at different points is an error: `.at()`
+interpolates a field to other points.  `Param` reads a scalar or ensemble
+parameter of the model, `Coefficient` one of its `coefficient_fields`.
+
+An `Equations` set is compiled once into a Python function that evaluates
+every expression with the grid operators, writing each intermediate into a
+workspace array that is reused as soon as it is no longer needed and
+computing in place where it can.  Common subexpressions are evaluated once.
+The function only depends on the shape of the grid through nx and ny, so
+the same set works on any grid, row block or tile.  Set it as the
+`equations` of a shallow water model to replace the built-in dynamics.
+"""
+
+import numpy as np
+
+# the position of a field along each axis is 'c' at the cell centres or 'e'
+# on the cell edges, None for a value that is the same everywhere
+U, V, PHI, CORNER = ('e', 'c'), ('c', 'e'), ('c', 'c'), ('e', 'e')
+
+_flip = {'c': 'e', 'e': 'c'}
+_padded = {'c': (-1, 1), 'e': (-1, 2)}   # padded points [lo, n+hi) of a field
+_fields = {'u': U, 'v': V, 'phi': PHI}
+
+
+class Expr(object):
+    """A field on the grid, or an expression of fields, parameters and grid
+    operators.
+
+    `position` is the position along x and y, `region` the points ((x0, x1),
+    (y0, y1)) the expression is known on: [x0, nx+x1) along x, where point 0
+    is the first cell centre or the western edge of the domain, and the
+    same along y.  Both are None along an axis the value does not vary on.
+    """
+    def __init__(self, op, args=(), position=(None, None), region=(None, None), value=None):
+        self.op = op
+        self.args = tuple(args)
+        self.position = position
+        self.region = region
+        self.value = value
+        self.key = (op, value) + tuple(arg.key for arg in self.args)
+
+    def __repr__(self):
+        if not self.args:
+            return '%s(%r)' % (self.op, self.value)
+        return '%s(%s)' % (self.op, ', '.join(map(repr, self.args)))
+
+    def at(self, at):
+        """Interpolate to the points `at`, e.g. U, by averaging in x and/or y."""
+        x, y = [a is not None and a != b for a, b in zip(self.position, at)]
+        if x and y:
+            return centre_average(self)
+        elif x:
+            return x_average(self)
+        elif y:
+            return y_average(self)
+        return self
+
+    @property
+    def full(self):
+        # varies along both axes, so has the shape of a field
+        return None not in self.region
+
+    def __add__(self, other):
+        return _elementwise('add', self, other)
+
+    def __radd__(self, other):
+        return _elementwise('add', other, self)
+
+    def __sub__(self, other):
+        return _elementwise('subtract', self, other)
+
+    def __rsub__(self, other):
+        return _elementwise('subtract', other, self)
+
+    def __mul__(self, other):
+        return _elementwise('multiply', self, other)
+
+    def __rmul__(self, other):
+        return _elementwise('multiply', other, self)
+
+    def __truediv__(self, other):
+        return _elementwise('true_divide', self, other)
+
+    def __rtruediv__(self, other):
+        return _elementwise('true_divide', other, self)
+
+    def __neg__(self):
+        return _elementwise('negative', self)
+
+    def __pos__(self):
+        return self
+
+    def __pow__(self, power):
+        if power == 2:
+            return _elementwise('square', self)
+        return _elementwise('power', self, power)
+
+
+def Field(name):
+    """The state field `name`, 'u', 'v' or 'phi' (or 'h' for the linear
+    models), with its boundary cells."""
+    name = 'phi' if name == 'h' else name
+    at = _fields[name]
+    return Expr('field', position=at, region=tuple(_padded[a] for a in at), value=name)
+
+
+def Param(name):
+    """The model parameter `name`, a scalar or one value per ensemble member."""
+    return Expr('param', value=name)
+
+
+def Coefficient(name, at):
+    """The y-profile `name` of the model's `coefficient_fields` at the
+    latitudes of the points `at`, e.g. Coefficient('f_u', U)."""
+    return Expr('coefficient', position=(None, at[1]), region=(None, (0, 0) if at[1] == 'c' else (0, 1)),
+                value=name)
+
+
+u, v, phi = Field('u'), Field('v'), Field('phi')
+h = phi
+
+
+def _as_expr(value):
+    if isinstance(value, Expr):
+        return value
+    return Expr('const', value=value)
+
+
+def _elementwise(op, *args):
+    args = [_as_expr(a) for a in args]
+    at, region = [], []
+    for axis in range(2):
+        positions = set(a.position[axis] for a in args) - {None}
+        if len(positions) > 1:
+            raise ValueError('cannot %s expressions at %s and %s points, interpolate one with .at()'
+                             % (op, args[0].position, args[1].position))
+        at.append(positions.pop() if positions else None)
+        bounds = [a.region[axis] for a in args if a.region[axis] is not None]
+        region.append((max(b[0] for b in bounds), min(b[1] for b in bounds)) if bounds else None)
+    return Expr(op, args, tuple(at), tuple(region))
+
+
+def _stagger(op, arg, axes):
+    # a grid operator moving `arg` from centres to edges or back along `axes`
+    at, region = list(arg.position), list(arg.region)
+    for axis in axes:
+        if at[axis] is None:
+            raise ValueError('%s of an expression that does not vary along the axis' % op)
+        lo, hi = region[axis]
+        region[axis] = (lo+1, hi) if at[axis] == 'c' else (lo, hi-1)
+        at[axis] = _flip[at[axis]]
+    return Expr(op, (arg,), tuple(at), tuple(region))
+
+
+def diffx(arg):
+    return _stagger('diffx', _as_expr(arg), (0,))
+
+
+def diffy(arg):
+    return _stagger('diffy', _as_expr(arg), (1,))
+
+
+def x_average(arg):
+    return _stagger('x_average', _as_expr(arg), (0,))
+
+
+def y_average(arg):
+    return _stagger('y_average', _as_expr(arg), (1,))
+
+
+def centre_average(arg):
+    return _stagger('centre_average', _as_expr(arg), (0, 1))
+
+
+def del2(arg):
+    if not arg.full:
+        raise ValueError('del2 of an expression that does not vary in x and y')
+    region = tuple((lo+1, hi-1) for lo, hi in arg.region)
+    return Expr('del2', (arg,), arg.position, region)
+
+
+# the axes each grid operator works along
+_grid_ops = {'diffx': (0,), 'x_average': (0,), 'diffy': (1,), 'y_average': (1,),
+             'centre_average': (0, 1), 'del2': (0, 1)}
+
+
+def _index(region, within):
+    # index of the points `region` in an array holding the points `within`
+    index = ['...']
+    for points, outer in zip(region, within):
+        if outer is None:
+            index.append(':')
+        else:
+            start, stop = points[0] - outer[0], points[1] - outer[1]
+            index.append('%s:%s' % (start or '', stop or ''))
+    return '[%s]' % ', '.join(index)
+
+
+def _shape(region):
+    return 'ens + (nx%+d, ny%+d)' % (region[0][1] - region[0][0], region[1][1] - region[1][0])
+
+
+class Equations(object):
+    """The tendencies of u, v and phi (or h) as expressions of the state.
+
+    Calling the set with a grid or model returns the three tendencies, as
+    `_dynamics` does.  The generated function is in `source`.
+    """
+    def __init__(self, **rhs):
+        rhs = {'phi' if name == 'h' else name: _as_expr(expr) for name, expr in rhs.items()}
+        if sorted(rhs) != ['phi', 'u', 'v']:
+            raise ValueError('equations are needed for u, v and phi, not %s' % ', '.join(rhs))
+        for name, expr in rhs.items():
+            at, target = _fields[name], tuple((0, 0) if a == 'c' else (0, 1) for a in _fields[name])
+            if any(a not in (None, b) for a, b in zip(expr.position, at)):
+                raise ValueError('the %s tendency is at %s points, not %s' % (name, expr.position, at))
+            for r, t in zip(expr.region, target):
+                if r is not None and not (r[0] <= t[0] and r[1] >= t[1]):
+                    raise ValueError('the %s tendency is only known on %r' % (name, expr.region))
+        self.rhs = rhs
+        self.source = self._generate()
+        namespace = {'np': np}
+        exec(compile(self.source, '<equations>', 'exec'), namespace)
+        self._evaluate = namespace['evaluate']
+
+    def __call__(self, grid):
+        return self._evaluate(grid)
+
+    def _generate(self):
+        # order the distinct subexpressions so each follows its arguments
+        order, uses = [], {}
+        def visit(expr):
+            uses[expr.key] = uses.get(expr.key, 0) + 1
+            if uses[expr.key] == 1:
+                for arg in expr.args:
+                    visit(arg)
+                order.append(expr)
+        roots = [self.rhs[name] for name in ('u', 'v', 'phi')]
+        targets = [tuple((0, 0) if a == 'c' else (0, 1) for a in _fields[name])
+                   for name in ('u', 'v', 'phi')]
+        for expr in roots:
+            visit(expr)
+        for expr in roots:
+            uses[expr.key] += 1     # results are kept to the end
+
+        # the points each subexpression is computed on: only those needed
+        # by the expressions using it, except along the axes of a grid
+        # operator which is given the whole of its argument, as the stencils
+        # at the ends of an array may differ (see ArakawaCGrid)
+        demand = {}
+        for expr, target in zip(roots, targets):
+            if expr.full:
+                demand.setdefault(expr.key, []).append(target)
+        computed, needs = {}, {}
+        for expr in reversed(order):
+            if not expr.full or not expr.args:
+                computed[expr.key] = expr.region
+            else:
+                regions = demand[expr.key]
+                axes = _grid_ops.get(expr.op, ())
+                computed[expr.key] = tuple(expr.region[axis] if axis in axes else
+                                           (min(r[axis][0] for r in regions), max(r[axis][1] for r in regions))
+                                           for axis in range(2))
+            for arg in expr.args:
+                if arg.full:
+                    need = tuple(arg.region[axis] if axis in _grid_ops.get(expr.op, ()) else
+                                 computed[expr.key][axis] for axis in range(2))
+                    needs[expr.key, arg.key] = need
+                    demand.setdefault(arg.key, []).append(need)
+
+        lines = ['def evaluate(grid):',
+                 '    work, ens, nx, ny = grid.workspace, grid.ensemble_shape, grid.nx, grid.ny']
+        names, slots, free = {}, {}, {}
+        nslots = [0]
+
+        def take(size):
+            # a free workspace slot for an array of `size`
+            if free.get(size):
+                return free[size].pop()
+            nslots[0] += 1
+            return nslots[0] - 1
+
+        def operand(arg, region):
+            src, within = names[arg.key], computed.get(arg.key, arg.region)
+            if any(r is not None and r != e for r, e in zip(within, region)):
+                src += _index(region, within)
+            return src
+
+        for k, expr in enumerate(order):
+            name = names[expr.key] = 't%d' % k
+            region = computed[expr.key]
+            if expr.op == 'field':
+                lines.append('    %s = grid._%s' % (name, expr.value))
+                continue
+            elif expr.op == 'param':
+                lines.append('    %s = grid.%s' % (name, expr.value))
+                continue
+            elif expr.op == 'coefficient':
+                lines.append('    %s = grid.coefficient_fields[%r]' % (name, expr.value))
+                continue
+            elif expr.op == 'const':
+                names[expr.key] = repr(expr.value)
+                continue
+
+            grid_op = expr.op in _grid_ops
+            args = [operand(a, needs.get((expr.key, a.key), region)) for a in expr.args]
+            call = 'grid.%s' % expr.op if grid_op else 'np.%s' % expr.op
+            if not expr.full:
+                # profiles and parameters are small: no need for a workspace array
+                lines.append('    %s = %s(%s)' % (name, call, ', '.join(args)))
+            else:
+                # write in place over an argument that is no longer needed
+                size = tuple(hi - lo for lo, hi in region)
+                reuse = [a for a in expr.args if a.key in slots and uses[a.key] == 1
+                         and computed[a.key] == region] if not grid_op else []
+                if reuse:
+                    slots[expr.key] = slots.pop(reuse[0].key)
+                    out = names[reuse[0].key]
+                else:
+                    slots[expr.key] = take(size)
+                    out = 'work(%r, %s)' % ('expr %d' % slots[expr.key], _shape(region))
+                lines.append('    %s = %s(%s, out=%s)' % (name, call, ', '.join(args), out))
+
+            for arg in expr.args:
+                uses[arg.key] -= 1
+                if uses[arg.key] == 0 and arg.key in slots:
+                    size = tuple(hi - lo for lo, hi in computed[arg.key])
+                    free.setdefault(size, []).append(slots.pop(arg.key))
+
+        results = []
+        for expr, target in zip(roots, targets):
+            if expr.full:
+                results.append(operand(expr, target))
+            else:
+                results.append('np.broadcast_to(%s, %s)' % (names[expr.key], _shape(target)))
+        lines.append('    return %s' % ', '.join(results))
+        return '\n'.join(lines) + '\n'
+
+
+def linear_shallow_water():
+    """The equations of `LinearShallowWater`."""
+    g, H, nu, nu_phi = Param('g'), Param('H'), Param('nu'), Param('nu_phi')
+    f_u, f_v = Coefficient('f_u', U), Coefficient('f_v', V)
+    damp_u, damp_v = Coefficient('damp_u', U), Coefficient('damp_v', V)
+    return Equations(
+        u=f_u*v.at(U) - g*diffx(h) + nu*del2(u) - damp_u*u,
+        v=-(f_v*u.at(V)) - g*diffy(h) + nu*del2(v) - damp_v*v,
+        h=-H*(diffx(u) + diffy(v)) + nu_phi*del2(h) - damp_u*h)
+
+
+def shallow_water():
+    """The equations of the nonlinear `ShallowWater` model."""
+    nu, nu_phi = Param('nu'), Param('nu_phi')
+    f_u, f_v = Coefficient('f_u', U), Coefficient('f_v', V)
+    damp_u, damp_v = Coefficient('damp_u', U), Coefficient('damp_v', V)
+    v_at_u, u_at_v = v.at(U), u.at(V)
+    return Equations(
+        u=(-diffx(phi) + f_u*v_at_u + nu*del2(u)
+           + (-(0.5*diffx(x_average(u)**2)) - diffy(y_average(u))*v_at_u) - damp_u*u),
+        v=(-diffy(phi) - f_v*u_at_v + nu*del2(v)
+           + (-(diffx(x_average(v))*u_at_v) - 0.5*diffy(y_average(v)**2)) - damp_v*v),
+        phi=-diffx(x_average(phi)*u) - diffy(y_average(phi)*v) + nu_phi*del2(phi))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Fused right-hand side kernels for the shallow water models.
+
+Each kernel computes the full tendency of one field in a single loop nest
+over the padded u, v and phi arrays of an ArakawaCGrid, rather than
+composing the grid operators one full-array pass at a time.  The kernels are
+compiled with Numba when it is installed (releasing the GIL, so they can run
+on several threads); `numba` is None otherwise and the kernels are plain
+(slow) Python, useful only for checking.
+
+Every array has a leading ensemble member axis, of length one for a single
+model.  Index conventions follow the grid: u[k, i, j] = _u[k, i+1, j+1] and
+so on.  The Coriolis and sponge coefficients are (members, y) profiles and
+the scalar coefficients are (members, 1) arrays.
+
+`adams_bashforth` fuses the Adams-Bashforth update of a flat state, see
+`timesteppers.adams_bashforth`.
+"""
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def jit(fn):
+    if numba is None:
+        return fn
+    return numba.njit(cache=True, nogil=True)(fn)
+
+
+@jit
+def shallow_water_u(_u, _v, _phi, f, damp, dx, dy, nu, out):
+    """u_rhs = -∂φ/∂x + fv + ν∇²u - u∂u/∂x - v∂u/∂y - r u"""
+    nm, nxu, ny = out.shape
+    for k in range(nm):
+        for i in range(nxu):
+            for j in range(ny):
+                u = _u[k, i+1, j+1]
+                v_at_u = 0.25*(_v[k, i, j+1] + _v[k, i, j+2] + _v[k, i+1, j+1] + _v[k, i+1, j+2])
+                dhdx = (_phi[k, i+1, j+1] - _phi[k, i, j+1]) / dx
+                del2 = ((_u[k, i, j+1] - 2*u + _u[k, i+2, j+1]) / dx**2
+                        + (_u[k, i+1, j] - 2*u + _u[k, i+1, j+2]) / dy**2)
+                ubarx_w = 0.5*(_u[k, i, j+1] + u)
+                ubarx_e = 0.5*(u + _u[k, i+2, j+1])
+                ududx = 0.5*(ubarx_e**2 - ubarx_w**2) / dx
+                ubary_s = 0.5*(_u[k, i+1, j] + u)
+                ubary_n = 0.5*(u + _u[k, i+1, j+2])
+                vdudy = v_at_u*(ubary_n - ubary_s) / dy
+                out[k, i, j] = (-dhdx + f[k, j]*v_at_u + nu[k, 0]*del2
+                                - ududx - vdudy - damp[k, j]*u)
+    return out
+
+
+@jit
+def shallow_water_v(_u, _v, _phi, f, damp, dx, dy, nu, out):
+    """v_rhs = -∂φ/∂y - fu + ν∇²v - u∂v/∂x - v∂v/∂y - r v"""
+    nm, nx, nyv = out.shape
+    for k in range(nm):
+        for i in range(nx):
+            for j in range(nyv):
+                v = _v[k, i+1, j+1]
+                u_at_v = 0.25*(_u[k, i+1, j] + _u[k, i+1, j+1] + _u[k, i+2, j] + _u[k, i+2, j+1])
+                dhdy = (_phi[k, i+1, j+1] - _phi[k, i+1, j]) / dy
+                del2 = ((_v[k, i, j+1] - 2*v + _v[k, i+2, j+1]) / dx**2
+                        + (_v[k, i+1, j] - 2*v + _v[k, i+1, j+2]) / dy**2)
+                vbarx_w = 0.5*(_v[k, i, j+1] + v)
+                vbarx_e = 0.5*(v + _v[k, i+2, j+1])
+                udvdx = u_at_v*(vbarx_e - vbarx_w) / dx
+                vbary_s = 0.5*(_v[k, i+1, j] + v)
+                vbary_n = 0.5*(v + _v[k, i+1, j+2])
+                vdvdy = 0.5*(vbary_n**2 - vbary_s**2) / dy
+                out[k, i, j] = (-dhdy - f[k, j]*u_at_v + nu[k, 0]*del2
+                                - udvdx - vdvdy - damp[k, j]*v)
+    return out
+
+
+@jit
+def shallow_water_phi(_u, _v, _phi, dx, dy, nu_phi, out):
+    """phi_rhs = -∇.(φu) + ν∇²φ"""
+    nm, nx, ny = out.shape
+    for k in range(nm):
+        for i in range(nx):
+            for j in range(ny):
+                phi = _phi[k, i+1, j+1]
+                flux_w = 0.5*(_phi[k, i, j+1] + phi)*_u[k, i+1, j+1]
+                flux_e = 0.5*(phi + _phi[k, i+2, j+1])*_u[k, i+2, j+1]
+                flux_s = 0.5*(_phi[k, i+1, j] + phi)*_v[k, i+1, j+1]
+                flux_n = 0.5*(phi + _phi[k, i+1, j+2])*_v[k, i+1, j+2]
+                del2 = ((_phi[k, i, j+1] - 2*phi + _phi[k, i+2, j+1]) / dx**2
+                        + (_phi[k, i+1, j] - 2*phi + _phi[k, i+1, j+2]) / dy**2)
+                out[k, i, j] = (-(flux_e - flux_w) / dx - (flux_n - flux_s) / dy
+                                + nu_phi[k, 0]*del2)
+    return out
+
+
+@jit
+def linear_u(_u, _v, _h, f, damp, dx, dy, g, nu, out):
+    """u_rhs = fv - g∂h/∂x + ν∇²u - r u"""
+    nm, nxu, ny = out.shape
+    for k in range(nm):
+        for i in range(nxu):
+            for j in range(ny):
+                u = _u[k, i+1, j+1]
+                v_at_u = 0.25*(_v[k, i, j+1] + _v[k, i, j+2] + _v[k, i+1, j+1] + _v[k, i+1, j+2])
+                dhdx = (_h[k, i+1, j+1] - _h[k, i, j+1]) / dx
+                del2 = ((_u[k, i, j+1] - 2*u + _u[k, i+2, j+1]) / dx**2
+                        + (_u[k, i+1, j] - 2*u + _u[k, i+1, j+2]) / dy**2)
+                out[k, i, j] = f[k, j]*v_at_u - g[k, 0]*dhdx + nu[k, 0]*del2 - damp[k, j]*u
+    return out
+
+
+@jit
+def linear_v(_u, _v, _h, f, damp, dx, dy, g, nu, out):
+    """v_rhs = -fu - g∂h/∂y + ν∇²v - r v"""
+    nm, nx, nyv = out.shape
+    for k in range(nm):
+        for i in range(nx):
+            for j in range(nyv):
+                v = _v[k, i+1, j+1]
+                u_at_v = 0.25*(_u[k, i+1, j] + _u[k, i+1, j+1] + _u[k, i+2, j] + _u[k, i+2, j+1])
+                dhdy = (_h[k, i+1, j+1] - _h[k, i+1, j]) / dy
+                del2 = ((_v[k, i, j+1] - 2*v + _v[k, i+2, j+1]) / dx**2
+                        + (_v[k, i+1, j] - 2*v + _v[k, i+1, j+2]) / dy**2)
+                out[k, i, j] = -f[k, j]*u_at_v - g[k, 0]*dhdy + nu[k, 0]*del2 - damp[k, j]*v
+    return out
+
+
+@jit
+def linear_h(_u, _v, _h, damp, dx, dy, H, nu_phi, out):
+    """h_rhs = -H∇.u + ν∇²h - r h"""
+    nm, nx, ny = out.shape
+    for k in range(nm):
+        for i in range(nx):
+            for j in range(ny):
+                h = _h[k, i+1, j+1]
+                div = ((_u[k, i+2, j+1] - _u[k, i+1, j+1]) / dx
+                       + (_v[k, i+1, j+2] - _v[k, i+1, j+1]) / dy)
+                del2 = ((_h[k, i, j+1] - 2*h + _h[k, i+2, j+1]) / dx**2
+                        + (_h[k, i+1, j] - 2*h + _h[k, i+1, j+2]) / dy**2)
+                out[k, i, j] = -H[k, 0]*div + nu_phi[k, 0]*del2 - damp[k, j]*h
+    return out
+
+
+@jit
+def adams_bashforth(state, coeffs, history, slots):
+    """state[r] += Σ_n coeffs[n, r] history[slots[n], r]"""
+    rows, m = state.shape
+    for r in range(rows):
+        for i in range(m):
+            acc = coeffs[0, r]*history[slots[0], r, i]
+            for n in range(1, len(slots)):
+                acc += coeffs[n, r]*history[slots[n], r, i]
+            state[r, i] += acc
+    return state
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Two-way nesting of a refined patch in a shallow water model.
+
+    nest = NestedGrid(model, patch=((0, model.nx), (24, 40)), ratio=3)
+    nest.step(1000)
+
+refines the parent cells `patch` = ((i0, i1), (j0, j1)) by `ratio` in x and
+y.  The child is a model of the same class and parameters on the patch,
+stepped `ratio` times per parent step with dt / ratio.  Each parent step:
+
+1. the parent steps from t to t+dt,
+2. the child subcycles from t to t+dt, its boundary cells set on each
+   substep by interpolating the parent linearly in space and in time
+   between t and t+dt,
+3. the child feeds back: the parent cells within the patch, bar a margin
+   of one cell along the sides driven by the parent, are replaced by the
+   average of the child cells (or edges) they contain.  The margin takes
+   up the difference in mass, so the parent conserves it.
+
+A patch spanning the whole width of a periodic parent (e.g. an equatorial
+band) is periodic itself: only its northern and southern sides are driven
+by the parent, and likewise a patch spanning the whole height keeps the
+parent's own boundary conditions there.
+"""
+
+import numpy as np
+
+from arakawac import DoublyPeriodicBoundaries, PeriodicBoundaries
+from timesteppers import sync_step
+
+
+def _positions(n, start, spacing, centre):
+    # coordinates of the `n` padded points of a field along an axis, at the
+    # cell centres or on the edges of cells `spacing` wide from `start`
+    return start + (np.arange(n) - 1 + (0.5 if centre else 0.0)) * spacing
+
+
+class NestedGrid(object):
+    """Step a shallow water `parent` with a two-way nested child model
+    refining `patch` = ((i0, i1), (j0, j1)) of its cells by `ratio`.
+
+    The child has the parameters of the parent, with the Coriolis parameter
+    of the patch's latitudes and no sponge.  Tracers of the parent are
+    advected by the restricted flow but are not refined.
+    """
+    def __init__(self, parent, patch, ratio=3):
+        if parent.stretched:
+            raise ValueError('nesting needs a parent grid with evenly spaced rows')
+        (i0, i1), (j0, j1) = patch
+        if not (0 <= i0 < i1 <= parent.nx and 0 <= j0 < j1 <= parent.ny):
+            raise ValueError('patch %r is not within the %dx%d grid' % (patch, parent.nx, parent.ny))
+        self.parent, self.patch, self.ratio = parent, patch, ratio
+
+        # the sides (west, east, south, north) whose boundary values come
+        # from the parent: a side on the edge of the parent's domain keeps
+        # the boundary conditions of the model unless it wraps around
+        periodic_x = isinstance(parent, (PeriodicBoundaries, DoublyPeriodicBoundaries))
+        periodic_y = isinstance(parent, DoublyPeriodicBoundaries)
+        full_x, full_y = (i0, i1) == (0, parent.nx), (j0, j1) == (0, parent.ny)
+        self.driven = (not full_x and (i0 > 0 or periodic_x), not full_x and (i1 < parent.nx or periodic_x),
+                       not full_y and (j0 > 0 or periodic_y), not full_y and (j1 < parent.ny or periodic_y))
+
+        self.child = self._make_child()
+        # start the child from the parent, then drive its boundaries
+        cells, sources, weights = self._interpolation(everywhere=True)
+        self.child.state_vector[cells] = self._parent_values(sources, weights)
+        self._cells, self._sources, self._weights = self._interpolation()
+
+    def _make_child(self):
+        p, r = self.parent, self.ratio
+        (i0, i1), (j0, j1) = self.patch
+        y_centre = -p.Ly/2 + 0.5*(j0 + j1)*p.dy
+        kwargs = dict(Lx=(i1-i0)*p.dx, Ly=(j1-j0)*p.dy, f0=p.f0 + np.multiply(p.beta, y_centre),
+                      beta=p.beta, nu=p.nu, nu_phi=p.nu_phi, r=0.0, dt=p.dt / r,
+                      backend=p.backend, ensemble_size=p.ensemble_size, order=p.order,
+                      dtype='mixed' if p.dtype != p.tendency_dtype else p.dtype)
+        if hasattr(p, 'g'):
+            kwargs.update(g=p.g, H=p.H)
+        if p.mask is not None:
+            kwargs.update(mask=p.mask[i0:i1, j0:j1].repeat(r, axis=0).repeat(r, axis=1))
+        for name in ('f0', 'beta', 'nu', 'nu_phi', 'g', 'H'):
+            # one value per member as ensemble_parameter expects
+            if name in kwargs and not np.isscalar(kwargs[name]):
+                kwargs[name] = np.ravel(kwargs[name])
+        child = type(p)((i1-i0)*r, (j1-j0)*r, **kwargs)
+        child.equations = p.equations
+        return child
+
+    def _interpolation(self, everywhere=False):
+        # flat indices of the driven boundary cells of the child (or of all
+        # its cells), and the four parent cells and bilinear weights
+        # interpolating each of them
+        p, c = self.parent, self.child
+        (i0, _), (j0, _) = self.patch
+        west, east, south, north = self.driven
+        centres = [(False, True), (True, False), (True, True)]    # u, v, phi along x, y
+
+        cells, sources, weights = [], [], []
+        c_offset = p_offset = 0
+        for (cx, cy), cfield, pfield in zip(centres, c._packed.padded, p._packed.padded):
+            shape, pshape = cfield.shape[-2:], pfield.shape[-2:]
+            driven = np.full(shape, everywhere)
+            # the ghost cells, and the normal velocity on the boundary
+            if west:
+                driven[:1 if cx else 2] = True
+            if east:
+                driven[-1 if cx else -2:] = True
+            if south:
+                driven[:, :1 if cy else 2] = True
+            if north:
+                driven[:, -1 if cy else -2:] = True
+            ci, cj = np.nonzero(driven)
+
+            # fractional parent indices of the child cells
+            x = _positions(shape[0], -p.Lx/2 + i0*p.dx, p.dx / self.ratio, cx)[ci]
+            y = _positions(shape[1], -p.Ly/2 + j0*p.dy, p.dy / self.ratio, cy)[cj]
+            s = (x + p.Lx/2) / p.dx + 1 - (0.5 if cx else 0.0)
+            t = (y + p.Ly/2) / p.dy + 1 - (0.5 if cy else 0.0)
+            pi = np.clip(np.floor(s).astype(int), 0, pshape[0] - 2)
+            pj = np.clip(np.floor(t).astype(int), 0, pshape[1] - 2)
+            fs, ft = s - pi, t - pj
+
+            members = np.arange(int(np.prod(cfield.shape[:-2])))[:, np.newaxis]
+            csize, psize = np.prod(shape), np.prod(pshape)
+            cells.append((c_offset + members*csize + ci*shape[1] + cj).ravel())
+            corner = [(pi + a)*pshape[1] + pj + b for a in (0, 1) for b in (0, 1)]
+            sources.append((p_offset + members[..., np.newaxis]*psize
+                            + np.stack(corner, axis=-1)).reshape(-1, 4))
+            w = np.stack([(1-fs)*(1-ft), (1-fs)*ft, fs*(1-ft), fs*ft], axis=-1)
+            weights.append(np.broadcast_to(w, (len(members),) + w.shape).reshape(-1, 4))
+            c_offset += cfield.size
+            p_offset += pfield.size
+        return np.concatenate(cells), np.concatenate(sources), np.concatenate(weights)
+
+    def _parent_values(self, sources, weights):
+        self.parent.apply_boundary_conditions()
+        values = self.parent.state_vector[sources] * weights
+        return values.sum(axis=-1)
+
+    def step(self, nsteps=1):
+        """Advance the parent and the child `nsteps` parent timesteps."""
+        parent, child, r = self.parent, self.child, self.ratio
+        for _ in range(nsteps):
+            before = self._parent_values(self._sources, self._weights)
+            parent.step()
+            after = self._parent_values(self._sources, self._weights)
+
+            for k in range(r):
+                child.apply_boundary_conditions()
+                child.state_vector[self._cells] = before + (after - before) * (k / r)
+                child.state_changed()
+                sync_step(child)
+            self.restrict()
+
+    def restrict(self):
+        """Replace the parent cells within the patch by the average of the
+        child cells they contain, except along the driven sides."""
+        p, c, r = self.parent, self.child, self.ratio
+        (i0, i1), (j0, j1) = self.patch
+        nx, ny = i1 - i0, j1 - j0
+        lead = c.ensemble_shape
+        west, east, south, north = [int(d) for d in self.driven]
+
+        phi = c.phi.reshape(lead + (nx, r, ny, r)).mean(axis=(-3, -1))
+        u = c.u[..., ::r, :].reshape(lead + (nx+1, ny, r)).mean(axis=-1)
+        v = c.v[..., :, ::r].reshape(lead + (nx, r, ny+1)).mean(axis=-2)
+
+        xs, ys = slice(west, nx - east), slice(south, ny - north)
+        xe, ye = slice(west, nx + 1 - east), slice(south, ny + 1 - north)
+        region = p.phi[..., i0:i1, j0:j1]
+        before = region.sum(axis=(-2, -1))
+        region[..., xs, ys] = phi[..., xs, ys]
+        # the patch keeps the mass of the parent's own step: what the child
+        # gained or lost through the sides of the restricted cells is taken
+        # from the margin along the driven sides, so the parent conserves mass
+        margin = np.ones((nx, ny), dtype=bool)
+        margin[xs, ys] = False
+        if p.mask is not None:
+            margin &= p.mask[i0:i1, j0:j1]
+        if margin.any():
+            gained = region.sum(axis=(-2, -1)) - before
+            region[..., margin] -= (gained / margin.sum())[..., np.newaxis]
+        p.u[..., i0:i1+1, j0:j1][..., xe, ys] = u[..., xe, ys]
+        p.v[..., i0:i1, j0:j1+1][..., xs, ye] = v[..., xs, ye]
+        p.state_changed()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Lagrangian particles advected by the flow of a shallow water model.
+
+    floats = Particles(model, x, y)
+    for _ in range(1000):
+        model.step()
+        floats.step()
+    floats.trajectories    # (records, 2, nparticles) float32
+
+Every particle is held in one pair of x, y arrays and all are advanced
+together by a Runge-Kutta step over each model step.  The velocities at
+the stages are interpolated bilinearly from the staggered u and v points,
+linearly in time between the start and end of the model step.  A particle
+leaving a periodic domain comes back in on the other side, and one meeting
+any other boundary is reflected back into the domain.
+"""
+
+import numpy as np
+
+from semilagrangian import padded_centres, periodic_axes
+
+
+def _padded_edges(edges):
+    # the positions of the edges, with a mirrored ghost point either side
+    return np.concatenate([[2*edges[0] - edges[1]], edges, [2*edges[-1] - edges[-2]]])
+
+
+class _Bilinear(object):
+    # flat indices and weights interpolating a padded field at positions x, y
+    # given the padded coordinates xs, ys of its points
+    def __init__(self, x, y, xs, ys):
+        self.ny = len(ys)
+        (self.i, fx), (self.j, fy) = [self._locate(p, ps) for p, ps in ((x, xs), (y, ys))]
+        self.weights = ((1 - fx)*(1 - fy), (1 - fx)*fy, fx*(1 - fy), fx*fy)
+
+    @staticmethod
+    def _locate(p, ps):
+        s = np.interp(p, ps, np.arange(len(ps)))
+        i = np.minimum(s.astype(np.intp), len(ps) - 2)
+        return i, s - i
+
+    def __call__(self, field):
+        flat = field.reshape(-1)
+        corner = self.i*self.ny + self.j
+        out = self.weights[0]*flat[corner]
+        out += self.weights[1]*flat[corner + 1]
+        out += self.weights[2]*flat[corner + self.ny]
+        out += self.weights[3]*flat[corner + self.ny + 1]
+        return out
+
+
+class Particles(object):
+    """Particles at positions `x`, `y` in the flow of `model`, one of the
+    ensemble `member`s if it has an ensemble.
+
+    Call `step` after each step of the model to advance the particles over
+    it with the Runge-Kutta `scheme`, 'rk4' or 'rk2' (the midpoint rule).
+    Every `record_every` steps the positions are recorded as float32 in
+    chunks of about `chunk_bytes`, see `trajectories`.
+    """
+    schemes = ('rk4', 'rk2')
+    chunk_bytes = 1 << 26
+
+    def __init__(self, model, x, y, scheme='rk4', record_every=1, member=None):
+        if scheme not in self.schemes:
+            raise ValueError('scheme must be one of %s, not %r' % (', '.join(map(repr, self.schemes)), scheme))
+        if model.ensemble_size is not None and member is None:
+            raise ValueError('choose the member of the ensemble the particles follow')
+        self.model = model
+        self.scheme = scheme
+        self.record_every = record_every
+        self.member = () if member is None else (member,)
+
+        self.x = np.array(x, dtype=np.float64).ravel()
+        self.y = np.array(y, dtype=np.float64).ravel()
+        if self.x.shape != self.y.shape:
+            raise ValueError('x and y give %d and %d particles' % (self.x.size, self.y.size))
+        self.periodic = periodic_axes(model)
+        self._fold(self.x, self.y)
+
+        # padded coordinates of the u and v points
+        x_centres, y_centres = padded_centres(model)
+        self._u_points = _padded_edges(model.ux.ravel()), y_centres
+        self._v_points = x_centres, _padded_edges(model.vy.ravel())
+
+        self._chunks, self._records, self.times = [], 0, []
+        self._velocities = self._current_velocities()
+        self._record()
+
+    def _current_velocities(self):
+        # copies of the padded u and v of the model, with the boundary map
+        # applied to a copy of its state so that the model is left as it is
+        model = self.model
+        state = model.workspace('particles state', model.state_vector.shape, model.state_vector.dtype)
+        state[:] = model.state_vector
+        _u, _v, _ = model._packed._wrap(model.apply_boundary_map_to(state)).padded
+        return _u[self.member].copy(), _v[self.member].copy()
+
+    def _fold(self, x, y):
+        # wrap positions around periodic axes and reflect them off the others
+        for p, periodic, length in zip((x, y), self.periodic, (self.model.Lx, self.model.Ly)):
+            lo, hi = -0.5*length, 0.5*length
+            if periodic:
+                p -= lo
+                np.mod(p, length, out=p)
+                p += lo
+            else:
+                np.copyto(p, 2*hi - p, where=p > hi)
+                np.copyto(p, 2*lo - p, where=p < lo)
+        return x, y
+
+    def velocity(self, x, y, fields=None):
+        """Returns u and v interpolated at positions `x`, `y` from the
+        padded `fields` (u, v), by default the current state of the model."""
+        u, v = fields or self._current_velocities()
+        return _Bilinear(x, y, *self._u_points)(u), _Bilinear(x, y, *self._v_points)(v)
+
+    def _stage(self, x, y, theta, before, after):
+        # the velocity at the fraction theta of the model step
+        x, y = self._fold(x, y)
+        u0, v0 = self.velocity(x, y, before)
+        if theta == 0:
+            return u0, v0
+        u1, v1 = self.velocity(x, y, after)
+        return (1 - theta)*u0 + theta*u1, (1 - theta)*v0 + theta*v1
+
+    def step(self):
+        """Advance the particles over the last step of the model, of its
+        `last_dt`: with an adaptive timestepper `model.dt` is already that
+        of the next step."""
+        if self.model.last_dt is None:
+            raise ValueError('the model has not taken a step')
+        before, after = self._velocities, self._current_velocities()
+        dt, x, y = self.model.last_dt, self.x, self.y
+
+        u1, v1 = self._stage(x, y, 0.0, before, after)
+        if self.scheme == 'rk2':
+            du, dv = self._stage(x + 0.5*dt*u1, y + 0.5*dt*v1, 0.5, before, after)
+        else:
+            u2, v2 = self._stage(x + 0.5*dt*u1, y + 0.5*dt*v1, 0.5, before, after)
+            u3, v3 = self._stage(x + 0.5*dt*u2, y + 0.5*dt*v2, 0.5, before, after)
+            u4, v4 = self._stage(x + dt*u3, y + dt*v3, 1.0, before, after)
+            du = (u1 + 2*(u2 + u3) + u4) / 6
+            dv = (v1 + 2*(v2 + v3) + v4) / 6
+
+        x += dt*du
+        y += dt*dv
+        self._fold(x, y)
+        self._velocities = after
+        if self.model.tc % self.record_every == 0:
+            self._record()
+
+    def _record(self):
+        n = self.x.size
+        per_chunk = max(1, self.chunk_bytes // (8*n))
+        if self._records == len(self._chunks)*per_chunk:
+            self._chunks.append(np.empty((per_chunk, 2, n), dtype=np.float32))
+        chunk = self._chunks[-1][self._records % per_chunk]
+        chunk[0], chunk[1] = self.x, self.y
+        self._records += 1
+        self.times.append(self.model.t)
+
+    @property
+    def trajectories(self):
+        """The recorded positions, a (records, 2, nparticles) float32 array
+        of x and y at `times`."""
+        n = self.x.size
+        if not self._chunks:
+            return np.empty((0, 2, n), dtype=np.float32)
+        return np.concatenate(self._chunks)[:self._records]
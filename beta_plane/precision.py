@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Drift of reduced precision runs of the grid models from float64.
+
+    def make_model(dtype):
+        model = PeriodicShallowWater(256, 257, beta=2e-11, dt=1000., dtype=dtype)
+        model.phi[:] = ...
+        return model
+
+    drift_report(make_model, nsteps=5000, every=500)
+
+steps a float64 run alongside a float32 and a mixed precision run, all with
+the same initial state, and prints the relative RMS difference of each field
+from the float64 run as the runs go on.  Reduced precision is acceptable for
+as long as the drift stays below the tolerance of the experiment.
+"""
+
+import numpy as np
+
+
+def relative_rms(field, reference):
+    """Returns the RMS of `field` - `reference` relative to the RMS of
+    `reference`, or the absolute RMS difference if `reference` is zero."""
+    field = np.asarray(field, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    err = np.sqrt(np.mean((field - reference)**2))
+    scale = np.sqrt(np.mean(reference**2))
+    return err / scale if scale > 0 else err
+
+
+def model_fields(model):
+    """Returns the names of the prognostic fields of `model`, tracers included."""
+    fields = ['u', 'v', 'phi'] if hasattr(model, 'v') else ['u', 'phi']
+    return fields + list(getattr(model, 'tracers', {}))
+
+
+def _field(model, name):
+    if name in getattr(model, 'tracers', {}):
+        return model.tracers[name].state
+    return getattr(model, name)
+
+
+def drift(make_model, nsteps, dtype, every=100):
+    """Step `make_model(dtype)` and `make_model(np.float64)` side by side.
+
+    Returns a list of (step, {field: relative RMS difference}) every
+    `every` steps and at the last step.
+    """
+    reference, model = make_model(np.float64), make_model(dtype)
+    fields = model_fields(reference)
+    rows = []
+    for n in range(1, nsteps+1):
+        reference.step()
+        model.step()
+        if n % every == 0 or n == nsteps:
+            rows.append((n, {name: relative_rms(_field(model, name), _field(reference, name))
+                             for name in fields}))
+    return rows
+
+
+def drift_report(make_model, nsteps, dtypes=(np.float32, 'mixed'), every=100, tolerance=1e-3):
+    """Print the drift of runs in each of `dtypes` from a float64 run, and
+    the first step at which any field drifts beyond `tolerance`.
+
+    Returns a dict of the `drift` rows for each dtype.
+    """
+    report = {}
+    for dtype in dtypes:
+        label = dtype if isinstance(dtype, str) else np.dtype(dtype).name
+        rows = report[label] = drift(make_model, nsteps, dtype, every)
+        fields = list(rows[0][1])
+
+        print('%s drift from float64 (relative RMS)' % label)
+        print('  %8s' % 'step' + ''.join('%12s' % name for name in fields))
+        for n, errs in rows:
+            print('  %8d' % n + ''.join('%12.3e' % errs[name] for name in fields))
+        exceeded = [n for n, errs in rows if max(errs.values()) > tolerance]
+        if exceeded:
+            print('  drift exceeds %.1e by step %d\n' % (tolerance, exceeded[0]))
+        else:
+            print('  drift within %.1e for all %d steps\n' % (tolerance, nsteps))
+    return report
+
+
+if __name__ == '__main__':
+    from shallowwater import PeriodicShallowWater
+
+    nx, ny = 128, 129
+
+    def make_model(dtype):
+        model = PeriodicShallowWater(nx, ny, beta=2.0e-11, nu=1.0e3, dt=1000.0, dtype=dtype)
+        x, y = np.meshgrid(model.phix.ravel(), model.phiy.ravel(), indexing='ij')
+        bump = np.exp(-(x**2 + y**2) / (0.05*model.Lx)**2)
+        model.phi[:] = 100.0 + bump
+        model.add_tracer('q', bump)
+        return model
+
+    drift_report(make_model, nsteps=2000, every=250)
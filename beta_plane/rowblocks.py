@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Multithreaded evaluation of the tendencies on blocks of y-rows.
+
+The domain is split into bands of rows in the y-direction.  Each band is
+presented to the unchanged `_dynamics` code as a smaller grid whose padded
+arrays are views onto the full arrays, with the neighbouring rows acting as
+a one-row halo.  Bands are evaluated concurrently on a thread pool; numpy
+releases the GIL inside its ufuncs (as do the fused kernels) so the bands
+run in parallel on separate cores.
+
+`tile_view` and `owned_region` are also used to split the domain in both x
+and y by `decomposition.DomainDecomposition`.
+
+The fourth order stencils of a grid with `order`=4 need a wider halo: each
+tile is then evaluated on a view extended by `grid.halo` - 1 cells into its
+neighbours, and only the tendencies of its own cells are kept.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from arakawac import Workspace
+
+
+# thread pools shared by every model with the same number of workers, so
+# that building many models starts no more threads; a forked child (see
+# `decomposition`) has none of the threads and starts its own pools
+_pools = {}
+os.register_at_fork(after_in_child=_pools.clear)
+
+
+def thread_pool(workers):
+    """Returns the thread pool of `workers` threads shared across models."""
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = _pools[workers] = ThreadPoolExecutor(workers)
+    return pool
+
+
+def _view(obj, **attrs):
+    # shallow copy of a model, grid or tracer with some attributes replaced
+    view = object.__new__(type(obj))
+    view.__dict__.update(obj.__dict__)
+    view.__dict__.update(attrs)
+    return view
+
+
+def split(n, nblocks):
+    """Split range(n) into `nblocks` contiguous (start, end) pairs."""
+    if not 1 <= nblocks <= n:
+        raise ValueError('cannot split %d points into %d blocks' % (n, nblocks))
+    bounds = np.linspace(0, n, nblocks+1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def extend_tile(grid, tile):
+    """Returns `tile` extended into its neighbours by the cells, beyond the
+    one-cell halo of its view, that its tendencies depend on."""
+    (i0, i1), (j0, j1) = tile
+    e = grid.halo - 1
+    return (max(i0-e, 0), min(i1+e, grid.nx)), (max(j0-e, 0), min(j1+e, grid.ny))
+
+
+def tile_view(grid, tile, workspace):
+    """Returns a view of `grid` restricted to the cells of
+    `tile` = ((i0, i1), (j0, j1)).  Its padded arrays are slices of the full
+    arrays, so the neighbouring cells act as a one-cell halo."""
+    (i0, i1), (j0, j1) = tile
+    attrs = dict(nx=i1-i0, ny=j1-j0,
+                 _u=grid._u[..., i0:i1+3, j0:j1+2],
+                 _v=grid._v[..., i0:i1+2, j0:j1+3],
+                 _phi=grid._phi[..., i0:i1+2, j0:j1+2],
+                 ux=grid.ux[i0:i1+1], vx=grid.vx[i0:i1], phix=grid.phix[i0:i1],
+                 uy=grid.uy[..., j0:j1], vy=grid.vy[..., j0:j1+1], phiy=grid.phiy[..., j0:j1],
+                 workspace=workspace, **grid._y_metric_view(j0, j1))
+    attrs.update(grid._mask_view(tile))
+
+    if hasattr(grid, 'coefficient_fields'):
+        # the tile's rows of the y-profiles (of ny or ny+1 latitudes)
+        attrs['_coefficient_fields'] = {name: c[..., j0:j1 + c.shape[-1] - grid.ny]
+                                  for name, c in grid.coefficient_fields.items()}
+    return _view(grid, **attrs)
+
+
+def view_on(obj, grid, grid_view, tile):
+    """Returns a view of the model or tracer `obj` on `tile`, given the
+    view of its grid on the same tile."""
+    if obj is grid:
+        return grid_view
+    (i0, i1), (j0, j1) = tile
+    return _view(obj, grid=grid_view, _state=obj._state[..., i0:i1+2, j0:j1+2])
+
+
+def owned_region(grid, field, tile, last_x, last_y, view_tile=None):
+    """Returns the slices of the unpadded `field` whose tendencies belong
+    to `tile`, and the matching slices of the tendency computed on
+    `view_tile` (by default the tile itself, see `extend_tile`).
+
+    Fields staggered in x or y have one more point than there are cells,
+    computed by both adjacent tiles: it is only taken from the upper one.
+    """
+    (i0, i1), (j0, j1) = tile
+    (vi0, _), (vj0, _) = view_tile or tile
+    nx = i1 - i0 + (field.shape[-2] - grid.nx if last_x else 0)
+    ny = j1 - j0 + (field.shape[-1] - grid.ny if last_y else 0)
+    return ((Ellipsis, slice(i0, i0+nx), slice(j0, j0+ny)),
+            (Ellipsis, slice(i0-vi0, i0-vi0+nx), slice(j0-vj0, j0-vj0+ny)))
+
+
+class RowBlocks(object):
+    """Evaluate `_dynamics` of a grid model and its tracers on `workers`
+    threads, each computing the tendencies of one band of y-rows."""
+    def __init__(self, grid, workers):
+        self.grid = grid
+        self.workers = workers
+        self.tiles = [((0, grid.nx), rows) for rows in split(grid.ny, workers)]
+        self.workspaces = [Workspace(grid.workspace.dtype) for _ in self.tiles]
+        self.pool = thread_pool(workers)
+
+    def accumulate(self, obj, dstate):
+        """Add `obj._dynamics()` onto the packed tendency `dstate`,
+        evaluating it block by block."""
+        def evaluate(b):
+            tile = self.tiles[b]
+            last = b == len(self.tiles) - 1
+            view_tile = extend_tile(self.grid, tile)
+            grid_view = tile_view(self.grid, view_tile, self.workspaces[b])
+            terms = view_on(obj, self.grid, grid_view, view_tile)._dynamics()
+            single = isinstance(terms, np.ndarray)
+            if single:
+                terms = (terms,)
+
+            fields, block_terms = [], []
+            for field, term in zip(dstate, terms):
+                region, own = owned_region(self.grid, field, tile, True, last, view_tile)
+                fields.append(field[region])
+                block_terms.append(term[own])
+            obj._accumulate(fields, block_terms[0] if single else block_terms)
+
+        for future in [self.pool.submit(evaluate, b) for b in range(len(self.tiles))]:
+            future.result()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Semi-implicit time integration of the gravity waves of the linear model.
+
+    model.gravity_waves = 'semi-implicit'
+
+steps the pressure gradient and divergence terms of `LinearShallowWater`
+
+    ∂[u]/∂t = -g ∇h + E_u,    ∂[h]/∂t = -H ∇.u + E_h
+
+with the trapezoidal rule, weighted by `implicit_weight` θ towards the new
+state, while the rest E (Coriolis, diffusion, the sponge and forcings) is
+stepped by Adams-Bashforth as before.  Eliminating the new u and v leaves
+a Helmholtz problem for the new h,
+
+    (1 - gH (θ dt)^2 ∇²) h = h* - θ dt H ∇.u*
+
+where * marks the state stepped with everything else.  The gravity waves
+no longer limit the timestep, only the slower Rossby waves, inertial
+oscillations and diffusion do: θ = 0.5 keeps their amplitude, a
+larger θ damps them.
+
+The Laplacian is the divergence of the gradient of the grid, so the new
+state is exactly that of the discrete equations.  It is diagonalised in x
+by an FFT on a periodic domain, or a cosine transform between walls, and
+leaves one tridiagonal system in y per wavenumber, factorized once for
+each dt, θ, g and H (see `solver`).  The rows may be stretched; the y
+boundaries must be walls or free-slip, i.e. no gravity-driven flow through
+them, and the grid may not have a land-sea mask or fourth order stencils.
+"""
+
+import numpy as np
+import scipy.fft
+
+from arakawac import (PeriodicBoundaries, WallBoundaries, ClosedBoundaries,
+                      DoublyPeriodicBoundaries, RadiationBoundaries, PackedState)
+
+
+class HelmholtzSolver(object):
+    """Solves (1 - alpha ∇²) h = rhs for h at the cell centres of `grid`,
+    with `alpha` a scalar or one value per ensemble member."""
+    def __init__(self, grid, alpha):
+        if not isinstance(grid, (PeriodicBoundaries, WallBoundaries, ClosedBoundaries)) \
+                or isinstance(grid, (DoublyPeriodicBoundaries, RadiationBoundaries)):
+            raise ValueError('the semi-implicit solver needs walls or free-slip boundaries in y')
+        if grid.mask is not None:
+            raise ValueError('the semi-implicit solver has no land-sea mask')
+        if grid.order != 2:
+            raise ValueError('the semi-implicit solver needs the second order stencils')
+        self.nx, self.ny = nx, ny = grid.nx, grid.ny
+        self.periodic = isinstance(grid, PeriodicBoundaries)
+
+        # eigenvalues of the x part of the Laplacian for each wavenumber
+        if self.periodic:
+            k = np.arange(nx//2 + 1)
+            lam = -4/grid.dx**2 * np.sin(np.pi*k/nx)**2
+        else:
+            k = np.arange(nx)
+            lam = -4/grid.dx**2 * np.sin(0.5*np.pi*k/nx)**2
+
+        # the y part couples each row to the rows below (a) and above (b),
+        # with no flux through the boundaries
+        if grid.stretched:
+            dy_phi, dy_v = grid._dy_phi[1:-1].astype(np.float64), grid._dy_v.astype(np.float64)
+        else:
+            dy_phi, dy_v = np.full(ny, grid.dy), np.full(ny+1, grid.dy)
+        a = 1 / (dy_phi * dy_v[:-1])
+        b = 1 / (dy_phi * dy_v[1:])
+        a[0] = b[-1] = 0.0
+
+        # LU factors of the tridiagonal system of each wavenumber: the
+        # reciprocal pivots and the eliminated upper diagonal
+        alpha = np.asarray(alpha, dtype=np.float64)
+        diag = 1 + alpha*(a + b - lam[:, np.newaxis])      # (..., nk, ny)
+        self._lower = -alpha*a*np.ones(diag.shape[:-2] + (1, ny))
+        upper = -alpha*b*np.ones_like(diag)
+        self._inv_pivot = np.empty_like(diag)
+        self._upper = np.empty_like(diag)
+        pivot = diag[..., 0]
+        for j in range(ny):
+            if j > 0:
+                pivot = diag[..., j] - self._lower[..., j]*self._upper[..., j-1]
+            self._inv_pivot[..., j] = 1 / pivot
+            self._upper[..., j] = upper[..., j] / pivot
+
+    def solve(self, rhs, out=None):
+        """Returns h for the (..., nx, ny) `rhs`."""
+        if self.periodic:
+            hat = scipy.fft.rfft(rhs, axis=-2)
+        else:
+            hat = scipy.fft.dct(rhs, type=2, axis=-2, norm='ortho')
+
+        lower, inv_pivot, upper = self._lower, self._inv_pivot, self._upper
+        hat[..., 0] *= inv_pivot[..., 0]
+        for j in range(1, self.ny):
+            hat[..., j] -= lower[..., j]*hat[..., j-1]
+            hat[..., j] *= inv_pivot[..., j]
+        for j in range(self.ny-2, -1, -1):
+            hat[..., j] -= upper[..., j]*hat[..., j+1]
+
+        if self.periodic:
+            h = scipy.fft.irfft(hat, n=self.nx, axis=-2)
+        else:
+            h = scipy.fft.idct(hat, type=2, axis=-2, norm='ortho')
+        if out is None:
+            return h
+        out[...] = h
+        return out
+
+
+def solver(model):
+    """Returns the HelmholtzSolver of a semi-implicit step of `model`,
+    factorized on first use for each value of dt, implicit_weight, g and H."""
+    tau = model.implicit_weight * model.dt
+    key = tuple(np.asarray(value).tobytes() for value in (tau, model.g, model.H))
+    solvers = model.__dict__.setdefault('_helmholtz_solvers', {})
+    if key not in solvers:
+        solvers[key] = HelmholtzSolver(model, np.multiply(model.g, model.H) * tau**2)
+    return solvers[key]
+
+
+def gravity_tendency(model):
+    """Returns the flat tendency of the pressure gradient and divergence
+    terms of the current state of `model`, in the layout of its packed
+    state.  The result is cached, see `derived`."""
+    def compute(out):
+        out[:] = 0
+        du, dv, dh = PackedState(model._packed.shapes, out, spatial_ndim=2)
+        model.diffx(model._h[..., :, 1:-1], out=du)
+        du *= -model.g
+        model.diffy(model._h[..., 1:-1, :], out=dv)
+        dv *= -model.g
+        model.divergence(out=dh)
+        dh *= -model.H
+        return out
+    return model.derived('gravity_tendency', model.state_vector.shape, compute)
+
+
+def complete_step(model, gravity):
+    """Completes a semi-implicit step of `model` in place, once its state has
+    been stepped by the Adams-Bashforth terms other than the gravity waves,
+    given the flat `gravity_tendency` of the state before the step."""
+    theta, dt = model.implicit_weight, model.dt
+    tau = theta*dt
+    work, dtype = model.workspace, model.dtype
+    ens, nx, ny = model.ensemble_shape, model.nx, model.ny
+
+    explicit = np.multiply(gravity, (1 - theta)*dt, out=work('implicit gravity', gravity.shape, dtype), dtype=dtype)
+    np.add(model.state_vector, explicit, out=model.state_vector)
+    # the Coriolis terms turn flow into the walls: close them again so
+    # that no divergence leaks through the walls into the solve
+    model.apply_boundary_conditions()
+    u, v, h = model.state
+
+    rhs = model.diffx(u, out=work('implicit rhs', ens + (nx, ny), dtype))
+    rhs += model.diffy(v, out=work('implicit div', ens + (nx, ny), dtype))
+    rhs *= -tau*model.H
+    rhs += h
+
+    _h = work('implicit h', ens + (nx+2, ny+2), dtype)
+    solver(model).solve(rhs, out=_h[..., 1:-1, 1:-1])
+    model.apply_boundary_conditions_to(_h)
+    h[...] = _h[..., 1:-1, 1:-1]
+    for field, grad in ((u, model.diffx(_h[..., :, 1:-1], out=work('implicit du', u.shape, dtype))),
+                        (v, model.diffy(_h[..., 1:-1, :], out=work('implicit dv', v.shape, dtype)))):
+        grad *= tau*model.g
+        field -= grad
+    model.apply_boundary_conditions()
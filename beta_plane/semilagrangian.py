@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Semi-Lagrangian advection of tracers.
+
+    model.tracer_advection = 'semi-lagrangian'
+    model.tracer_steps = 10
+
+moves the tracers of a model by interpolating them at the departure points
+of the cell centres instead of stepping the flux-form `grid.advect`:
+
+    q(x, t+dt) = q(x - a, t),   a = dt u(x - a/2, t+dt/2)
+
+The displacement `a` is found by iterating the midpoint rule on the
+C-grid velocities averaged to the cell centres, extrapolated in time to
+the middle of the step.  The departure points of a step are computed once
+and turned into a `Stencil` of flat indices and weights, so every tracer of
+the stack (and every member of an ensemble) is interpolated with a few
+gathers.  The scheme is not bound by the CFL limit of the flow, so the
+tracers may be stepped once every `tracer_steps` model steps, but it does
+not conserve the tracer exactly.
+
+Departure points wrap around a periodic axis and are held inside the
+domain along the others, where the ghost cells follow the boundary
+conditions of a tracer.
+"""
+
+import numpy as np
+
+from arakawac import DoublyPeriodicBoundaries, PeriodicBoundaries
+
+# the points either side of floor(s) used by each interpolation
+_offsets = {'linear': (0, 1), 'cubic': (-1, 0, 1, 2)}
+
+
+def _weights(f, kind, out, tmp):
+    # Lagrange weights of the points at `_offsets[kind]`, at fraction f,
+    # written into the arrays `out` given a scratch array `tmp`
+    offsets = _offsets[kind]
+    for weight, o in zip(out, offsets):
+        others = [p for p in offsets if p != o]
+        np.subtract(f, others[0], out=weight)
+        for p in others[1:]:
+            weight *= np.subtract(f, p, out=tmp)
+        weight *= 1 / np.prod([o - p for p in others])
+    return out
+
+
+def _fractional_index(s, centres):
+    # positions s -> fractional index among the padded centres, in place
+    spacing = np.diff(centres)
+    if np.allclose(spacing, spacing[0]):
+        s -= centres[0]
+        s /= spacing[0]
+        np.clip(s, 0, len(centres) - 1, out=s)
+    else:
+        s[...] = np.interp(s, centres, np.arange(len(centres)))
+    return s
+
+
+def periodic_axes(grid):
+    """Returns whether the boundary conditions of `grid` are periodic
+    along x and y."""
+    return (isinstance(grid, (PeriodicBoundaries, DoublyPeriodicBoundaries)),
+            isinstance(grid, DoublyPeriodicBoundaries))
+
+
+def padded_centres(grid):
+    """Returns the x and y positions of the nx+2 and ny+2 padded cell
+    centres of `grid`, the ghost cells mirroring the cells inside."""
+    centres = []
+    for edges in (grid.ux.ravel(), grid.vy.ravel()):
+        edges = np.concatenate([[2*edges[0] - edges[1]], edges, [2*edges[-1] - edges[-2]]])
+        centres.append(0.5*(edges[1:] + edges[:-1]))
+    return centres
+
+
+class Stencil(object):
+    """Interpolation of the padded cell-centred fields of a grid at a set of
+    points: `indices` into the flattened (members, nx+2, ny+2) field and
+    their `weights`, one of each per stencil point."""
+    def __init__(self, indices, weights, shape, workspace=None):
+        self.indices = indices
+        self.weights = weights
+        self.shape = shape     # of the interpolated values of one field
+        self.workspace = workspace
+
+    def __call__(self, field, out=None):
+        """Returns `field` interpolated at the points of the stencil.  Any
+        axes of `field` before those of the grid's ensemble, e.g. tracers,
+        are interpolated alike."""
+        lead = field.shape[:field.ndim - len(self.shape)]
+        flat = field.reshape(lead + (-1,))
+        if out is None:
+            out = np.empty(lead + self.shape, dtype=field.dtype)
+        values = out.reshape(lead + (-1,))
+        if self.workspace is None:
+            tmp = np.empty_like(values)
+        else:
+            tmp = self.workspace('stencil values', values.shape, values.dtype)
+        for k, (index, weight) in enumerate(zip(self.indices, self.weights)):
+            np.take(flat, index, axis=-1, out=tmp)
+            tmp *= weight
+            if k == 0:
+                values[...] = tmp
+            else:
+                values += tmp
+        return out
+
+
+def stencil(grid, x, y, kind='cubic', name='stencil'):
+    """Returns the `Stencil` interpolating the padded cell-centred fields of
+    `grid` at positions `x`, `y`, each of shape ensemble_shape + (nx, ny),
+    with 'linear' or 'cubic' Lagrange polynomials along each axis.  Its
+    indices and weights are arrays of the grid workspace, filled again by
+    the next stencil of the same `name`."""
+    if kind not in _offsets:
+        raise ValueError('interpolation must be %s, not %r' % (' or '.join(_offsets), kind))
+    nx, ny, ens = grid.nx, grid.ny, grid.ensemble_shape
+    shape = ens + (nx, ny)
+    members = int(np.prod(ens))
+    work = grid.workspace
+
+    along = []
+    for axis, (pos, centres, n, periodic, length) in enumerate(zip(
+            (x, y), padded_centres(grid), (nx, ny), periodic_axes(grid), (grid.Lx, grid.Ly))):
+        s = work('%s s%d' % (name, axis), shape, np.float64)
+        s[...] = pos
+        if periodic:
+            low = 0.5*(centres[0] + centres[1])
+            s -= low
+            np.mod(s, length, out=s)
+            s += low
+        # fractional index among the padded centres, inside the domain
+        _fractional_index(s, centres)
+        if not periodic:
+            np.clip(s, 1, n, out=s)
+        base = work('%s base%d' % (name, axis), shape, np.intp)
+        base[...] = s      # s >= 0, so truncation is the floor
+        s -= base
+        indices = []
+        for k, offset in enumerate(_offsets[kind]):
+            i = work('%s i%d%d' % (name, axis, k), shape, np.intp)
+            if periodic:
+                np.add(base, offset - 1, out=i)
+                np.mod(i, n, out=i)
+                i += 1
+            else:
+                np.add(base, offset, out=i)
+                np.clip(i, 0, n + 1, out=i)
+            indices.append(i)
+        weights = [work('%s w%d%d' % (name, axis, k), shape, np.float64) for k in range(len(indices))]
+        _weights(s, kind, weights, work('%s tmp' % name, shape, np.float64))
+        along.append((indices, weights))
+
+    (ix, wx), (iy, wy) = along
+    first = (np.arange(members)*(nx + 2)*(ny + 2)).reshape(ens + (1, 1))
+    indices, weights = [], []
+    for a, i in zip(wx, ix):
+        for b, j in zip(wy, iy):
+            k = len(indices)
+            index = np.multiply(i, ny + 2, out=work('%s index%d' % (name, k), shape, np.intp))
+            index += j
+            index += first
+            indices.append(index.ravel())
+            weights.append(np.multiply(a, b, out=work('%s weight%d' % (name, k), shape,
+                                                      grid.tendency_dtype)).ravel())
+    return Stencil(indices, weights, shape, work)
+
+
+def departure_points(grid, u, v, dt, iterations=2):
+    """Returns the x, y departure points of the cell centres of `grid` over
+    a step `dt`, given the velocities `u`, `v` at the cell centres in the
+    middle of the step, as arrays of the grid workspace."""
+    work = grid.workspace
+    padded = []
+    for name, c in zip('uv', (u, v)):
+        field = work('departure padded ' + name, c.shape[:-2] + grid._shape[-2:], grid.tendency_dtype)
+        field.fill(0)
+        field[..., 1:-1, 1:-1] = c
+        if hasattr(grid, 'apply_boundary_conditions_to'):
+            grid.apply_boundary_conditions_to(field)
+        padded.append(field)
+    shape = u.shape
+    x, y = grid.phix, grid.phiy
+    xd, yd = [work('departure ' + name, shape, np.float64) for name in 'xy']
+    mid = [work('departure midpoint ' + name, shape, np.float64) for name in 'xy']
+    velocity = work('departure velocity', shape, grid.tendency_dtype)
+
+    def depart(position, c, out):
+        # out = position - dt*c
+        np.multiply(c, -dt, out=out)
+        out += position
+        return out
+
+    depart(x, u, xd)
+    depart(y, v, yd)
+    for _ in range(iterations):
+        for m, p, d in zip(mid, (x, y), (xd, yd)):
+            np.add(p, d, out=m)
+            m *= 0.5
+        midpoint = stencil(grid, mid[0], mid[1], 'linear', name='midpoint')
+        depart(x, midpoint(padded[0], out=velocity), xd)
+        depart(y, midpoint(padded[1], out=velocity), yd)
+    return xd, yd
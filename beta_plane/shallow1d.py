@@ -8,8 +8,8 @@ from shallowwater import Model
 
 class ShallowWater1D(Arakawa1D, Model):
     """The Shallow Water Equations on the Arakawa-C grid."""
-    def __init__(self, nx, Lx=1.0e7, nu=1.0e3, nu_phi=None, dt=1000.0):
-        super(ShallowWater1D, self).__init__(nx, Lx)
+    def __init__(self, nx, Lx=1.0e7, nu=1.0e3, nu_phi=None, dt=1000.0, dtype=np.float64):
+        super(ShallowWater1D, self).__init__(nx, Lx, dtype)
 
         # dissipation and friction
         self.nu = nu                                    # u, v dissipation
@@ -40,16 +40,15 @@ class ShallowWater1D(Arakawa1D, Model):
         u_rhs += self.nu*self.diff2x(self._u)
         #u_rhs += - ududx                     # nonlin u advection terms
 
-        dstate = np.array([u_rhs, phi_rhs])
-        return dstate
+        return u_rhs, phi_rhs
 
     def apply_boundary_conditions(self):
         self._apply_boundary_conditions()
 
 
 class LinearShallowWater1D(ShallowWater1D):
-    def __init__(self, nx, Lx=1.0e7, H=100., nu=1.0e3, nu_phi=None, dt=1000.0):
-        super(LinearShallowWater1D, self).__init__(nx, Lx=Lx, nu=nu, nu_phi=nu_phi, dt=dt)
+    def __init__(self, nx, Lx=1.0e7, H=100., nu=1.0e3, nu_phi=None, dt=1000.0, dtype=np.float64):
+        super(LinearShallowWater1D, self).__init__(nx, Lx=Lx, nu=nu, nu_phi=nu_phi, dt=dt, dtype=dtype)
         self.H = H
 
     def _dynamics(self):
@@ -66,8 +65,7 @@ class LinearShallowWater1D(ShallowWater1D):
         u_rhs  = -dhdx
         u_rhs += self.nu*self.diff2x(self._u)
 
-        dstate = np.array([u_rhs, phi_rhs])
-        return dstate
+        return u_rhs, phi_rhs
 
 
 if __name__ == '__main__':
@@ -17,13 +17,23 @@
 f = f0 + βy
 """
 
+import warnings
+
 import numpy as np
 
-from arakawac import ArakawaCGrid, PeriodicBoundaries, WallBoundaries
+import kernels
+import semiimplicit
+import semilagrangian
+import sparse_operator
+from arakawac import (ArakawaCGrid, PackedState, PeriodicBoundaries, WallBoundaries,
+                      DoublyPeriodicBoundaries, ClosedBoundaries, RadiationBoundaries)
+from rowblocks import RowBlocks
 from timesteppers import AdamsBashforth3, sync_step
 
 class Dynamic(AdamsBashforth3):
     """Common base class for all shallow water models and tracers."""
+    _row_blocks = None   # RowBlocks evaluating _dynamics on threads, if any
+
     def __init__(self):
         super(Dynamic, self).__init__()
         self.forcings = []
@@ -43,12 +53,31 @@ class Dynamic(AdamsBashforth3):
         self.forcings.append(fn)
         return fn
 
-    def _dstate(self):
-        dstate = np.zeros_like(self.state)
-        if self.forcings:
-            for f in self.forcings:
-                dstate += f(self)
-        return self._dynamics() + dstate
+    def _dstate(self, out=None, accumulate=False):
+        # the tendency is accumulated into `out`, a flat array, if given,
+        # which is zeroed first unless `accumulate`
+        if out is None:
+            dstate = np.zeros_like(self._packed, dtype=self.tendency_dtype)
+        else:
+            if not accumulate:
+                out[:] = 0
+            dstate = self._packed._wrap(out)
+        if self._row_blocks is None:
+            self._accumulate(dstate, self._dynamics())
+        else:
+            self._row_blocks.accumulate(self, dstate)
+        for term in self._forcing_terms():
+            self._accumulate(dstate, term)
+        return dstate.vector
+
+    def _forcing_terms(self):
+        # the tendency of each forcing, to be accumulated onto dstate
+        return [f(self) for f in self.forcings]
+
+    def _accumulate(self, dstate, terms):
+        # add each tendency term onto the matching field of the packed dstate
+        for field, term in zip(dstate, terms):
+            field += term
 
     def _dynamics(self):
         # should be implemented by the model
@@ -56,6 +85,11 @@ class Dynamic(AdamsBashforth3):
 
 
 class Model(Dynamic):
+    _tracer_stack = None   # TracerStack holding the tracers, once one is added
+    tracer_advection = 'flux'        # or 'semi-lagrangian', see semilagrangian.py
+    tracer_interpolation = 'cubic'   # or 'linear', of semi-Lagrangian advection
+    tracer_steps = 1                 # model steps per (longer) step of the tracers
+
     def __init__(self):
         super(Model, self).__init__()
         self.tracers  = {}
@@ -72,8 +106,9 @@ class Model(Dynamic):
         Once a tracer has been added to the model it's value can be accessed
         by the from the model.tracers dict, or from model.tracer_name.
         """
-        t = Tracer(name, grid=self, kappa=kappa,
-                            initial_state=initial_state)
+        if self._tracer_stack is None:
+            self._tracer_stack = TracerStack(self)
+        t = self._tracer_stack.add(name, initial_state=initial_state, kappa=kappa)
         self.tracers[name] = t
         if not hasattr(self, name):
             self.__dict__[name] = t
@@ -84,90 +119,338 @@ class Model(Dynamic):
 
     def step(self):  # override the basic timestepping `step` to support tracers
         self.apply_boundary_conditions()
-        for tracer in self.tracers.values():
-            tracer.apply_boundary_conditions()
-
-        sync_step(self, *self.tracers.values())
+        if self._tracer_stack is None or self.tc % self.tracer_steps:
+            sync_step(self)
+        else:
+            self._tracer_stack.apply_boundary_conditions()
+            sync_step(self, self._tracer_stack)
 
 class ShallowWater(ArakawaCGrid, Model):
-    """The Shallow Water Equations on the Arakawa-C grid."""
+    """The Shallow Water Equations on the Arakawa-C grid.
+
+    `backend` selects how the tendencies are evaluated: 'numpy' composes
+    the grid operators, 'numba' uses the fused kernels in `kernels.py`
+    and falls back to 'numpy' if Numba is not installed.
+
+    With an `ensemble_size` the model holds that many independent members
+    stepped together.  The parameters f0, beta, nu, nu_phi and r (and g, H
+    of the linear model) may then be given as one value per member.
+
+    Given `workers` > 1 the tendencies of the model and its tracers are
+    evaluated on that many threads, each handling a band of y-rows.  The
+    threads are shared by all models with as many workers (see `rowblocks`).
+
+    `dtype` is the precision of the state (see ArakawaCGrid): np.float32
+    or 'mixed', with float32 tendencies and float64 state, trade accuracy
+    for memory traffic.  `precision.drift_report` measures the cost.
+
+    `ygrid` stretches the rows in y (see ArakawaCGrid), e.g.
+    `equatorial_stretching(2.0)` to refine the grid near y=0.  The sponge
+    still covers the outer `sponge_ny` rows.
+
+    `order`=4 selects the fourth order stencils of the grid for the model
+    and its tracers, e.g. to reach the same wave phase speed errors on a
+    coarser grid (see `convergence.convergence_report`).
+
+    A land-sea `mask` (see ArakawaCGrid) gives the basin coastlines with no
+    flow through them, e.g. to model an irregular ocean basin.  The sparse
+    backend of the linear model then only evaluates the wet cells and faces.
+
+    The sponges are left out with boundaries open to radiation (see
+    `arakawac.RadiationBoundaries` and `OpenShallowWater`), so the domain
+    need not be extended by the rows they damp.
+
+    The model and its tracers are stepped by Adams-Bashforth.  A timestepper
+    mixin placed before the model in its bases, e.g.
+    `class Ocean(timesteppers.DormandPrince54, PeriodicShallowWater)`, steps
+    them instead, here with an adaptive dt, or `SSPRungeKutta3` in place
+    with one extra copy of the state rather than a tendency history.
+    """
+    backends = ('numpy', 'numba')
+    equations = None   # an expressions.Equations set replacing the built-in dynamics
+    sponges = True     # Rayleigh sponges in the outer `sponge_ny` rows, unless the boundaries are open
+    phi_rest = None    # resting geopotential of open boundaries, by default the mean initial phi
+
     def __init__(self, nx, ny, Lx=1.0e7, Ly=1.0e7, f0=0.0,
                     beta=0.0, nu=1.0e3, nu_phi=None,
-                    r=1.0e-5, dt=1000.0):
-        super(ShallowWater, self).__init__(nx, ny, Lx, Ly)
+                    r=1.0e-5, dt=1000.0, backend='numpy', ensemble_size=None,
+                    workers=None, dtype=np.float64, ygrid=None, order=2, mask=None):
+        super(ShallowWater, self).__init__(nx, ny, Lx, Ly, ensemble_size, dtype, ygrid, order, mask)
+
+        if backend not in self.backends:
+            raise ValueError('backend must be one of %s, not %r' % (', '.join(map(repr, self.backends)), backend))
+        if workers is not None and workers > 1:
+            if backend == 'sparse':
+                warnings.warn('the sparse backend is a single matrix product, ignoring workers')
+            else:
+                self._row_blocks = RowBlocks(self, workers)
+
+        if backend == 'numba' and kernels.numba is None:
+            warnings.warn('Numba is not installed, using the numpy backend')
+            backend = 'numpy'
+        if backend == 'numba' and self.stretched:
+            warnings.warn('the fused kernels assume evenly spaced rows, using the numpy backend')
+            backend = 'numpy'
+        if backend == 'numba' and self.order != 2:
+            warnings.warn('the fused kernels are second order, using the numpy backend')
+            backend = 'numpy'
+        if backend == 'numba' and self.mask is not None:
+            warnings.warn('the fused kernels have no land-sea mask, using the numpy backend')
+            backend = 'numpy'
+        self.backend = backend
 
         # Coriolis terms
         self.f0 = f0
         self.beta = beta
 
         # dissipation and friction
-        self.nu = nu                                    # u, v dissipation
-        self.nu_phi = nu if nu_phi is None else nu_phi  # phi dissipation
+        self.nu = self.ensemble_parameter(nu)             # u, v dissipation
+        self.nu_phi = self.ensemble_parameter(nu if nu_phi is None else nu_phi)  # phi dissipation
         self.r = r      # rayleigh damping at edges
-        self.sponge_ny = ny//7
-        self.sponge = np.exp(-np.linspace(0, 5, self.sponge_ny))
+        self.sponge_ny = ny//7 if self.sponges else 0
 
         # timestepping
         self.dt = dt
 
-    def damping(self, var):
+    # f0, beta, r and sponge_ny define the static coefficient fields:
+    # assigning to any of them causes the fields to be rebuilt
+    _coefficient_fields = None
+
+    @property
+    def f0(self):
+        return self._f0
+
+    @f0.setter
+    def f0(self, value):
+        self._f0 = self.ensemble_parameter(value)
+        self._coefficient_fields = None
+
+    @property
+    def beta(self):
+        return self._beta
+
+    @beta.setter
+    def beta(self, value):
+        self._beta = self.ensemble_parameter(value)
+        self._coefficient_fields = None
+
+    @property
+    def r(self):
+        return self._r
+
+    @r.setter
+    def r(self, value):
+        self._r = self.ensemble_parameter(value)
+        self._coefficient_fields = None
+
+    @property
+    def sponge_ny(self):
+        return self._sponge_ny
+
+    @sponge_ny.setter
+    def sponge_ny(self, value):
+        self._sponge_ny = value
+        self.sponge = np.exp(-np.linspace(0, 5, value))
+        self._coefficient_fields = None
+
+    @property
+    def coefficient_fields(self):
+        """Time-invariant coefficient fields, built on first use.
+
+        `f_u`, `f_v` are the Coriolis parameter and `damp_u`, `damp_v` the
+        sponge damping rate r * sponge at u (and phi) and v latitudes, with
+        the shape needed to multiply the fields.  The same profiles with one
+        row per ensemble member, as the fused kernels expect, are suffixed
+        with `_k`."""
+        if self._coefficient_fields is None:
+            ny, dtype = self.ny, self.tendency_dtype
+            coeffs = dict(f_u=self.coriolis(self.uy).astype(dtype),
+                          f_v=self.coriolis(self.vy).astype(dtype),
+                          damp_u=np.multiply(self.r, self.sponge_profile(ny)).astype(dtype),
+                          damp_v=np.multiply(self.r, self.sponge_profile(ny+1)).astype(dtype))
+            for name, n in (('f_u', ny), ('f_v', ny+1), ('damp_u', ny), ('damp_v', ny+1)):
+                coeffs[name + '_k'] = self._per_member(coeffs[name], n)
+            self._coefficient_fields = coeffs
+        return self._coefficient_fields
+
+    def _dstate(self, out=None, accumulate=False):
+        # on a masked grid nothing flows through the coast or changes on
+        # land between the boundary conditions, as in the sparse backend
+        # which leaves them out: their entries of `out` are zeroed
+        fstate = super(ShallowWater, self)._dstate(out, accumulate)
+        if self.mask is not None:
+            fstate[self._coast] = 0
+            fstate[self._land] = 0
+        return fstate
+
+    def sponge_profile(self, n, out=None):
+        """Returns the sponge strength at each of `n` latitudes: one at the
+        top and bottom of the domain, decaying exponentially to zero over
+        `sponge_ny` rows."""
+        if out is None:
+            out = np.zeros(n)
+        out[:] = 0
+        if self.sponge_ny:
+            out[:self.sponge_ny] = self.sponge
+            out[-self.sponge_ny:] = self.sponge[::-1]
+        return out
+
+    def damping(self, var, out=None):
         # sponges are active at the top and bottom of the domain by applying Rayleigh friction
         # with exponential decay towards the centre of the domain
-        var_sponge = np.zeros_like(var)
-        var_sponge[:, :self.sponge_ny] = self.sponge[np.newaxis, :]
-        var_sponge[:, -self.sponge_ny:] = self.sponge[::-1][np.newaxis, :]
-        return self.r*var_sponge*var
+        coeffs = self.coefficient_fields
+        damp = coeffs['damp_u'] if var.shape[-1] == self.ny else coeffs['damp_v']
+        out = np.multiply(damp, var, out=out)
+        return out
+
+    def _flather_coefficients(self):
+        # the resting geopotential and c/Φ of gravity waves on it, about
+        # which the open boundaries radiate
+        if self.phi_rest is None:
+            self.phi_rest = np.mean(self.phi, axis=(-2, -1), keepdims=True)
+        return self.phi_rest, 1.0 / np.sqrt(self.phi_rest)
+
+    def coriolis(self, y, out=None):
+        """Returns the Coriolis parameter f = f0 + βy at latitudes `y`."""
+        out = np.multiply(self.beta, y, out=out)
+        out += self.f0
+        return out
+
+    def _per_member(self, value, n=1):
+        """Broadcast a parameter, or a y-profile of length `n`, to an array
+        with one row per ensemble member as the fused kernels expect."""
+        return np.ascontiguousarray(
+            np.broadcast_to(value, self.ensemble_shape + (1, n)).reshape(-1, n))
+
+    def _as_members(self, field):
+        # view a field as (members, x, y), with a single member if there is no ensemble
+        return field.reshape((-1,) + field.shape[-2:])
+
+    def _kernel_coefficients(self):
+        # Coriolis parameter and r * sponge at u/phi and v latitudes, per member
+        coeffs = self.coefficient_fields
+        return coeffs['f_u_k'], coeffs['f_v_k'], coeffs['damp_u_k'], coeffs['damp_v_k']
+
+    def _fused_dynamics(self):
+        """Calculate the dynamics for the u, v and phi equations
+        with the fused kernels."""
+        nx, ny, ens = self.nx, self.ny, self.ensemble_shape
+        work, m = self.workspace, self._as_members
+        f_u, f_v, damp_u, damp_v = self._kernel_coefficients()
+        nu, nu_phi = self._per_member(self.nu), self._per_member(self.nu_phi)
+
+        u_rhs = work('u_rhs', ens + (nx+1, ny))
+        v_rhs = work('v_rhs', ens + (nx, ny+1))
+        phi_rhs = work('phi_rhs', ens + (nx, ny))
+        args = m(self._u), m(self._v), m(self._phi)
+        kernels.shallow_water_u(*args, f_u, damp_u, self.dx, self.dy, nu, m(u_rhs))
+        kernels.shallow_water_v(*args, f_v, damp_v, self.dx, self.dy, nu, m(v_rhs))
+        kernels.shallow_water_phi(*args, self.dx, self.dy, nu_phi, m(phi_rhs))
+        return u_rhs, v_rhs, phi_rhs
 
     def _dynamics(self):
-        """Calculate the dynamics for the u, v and phi equations."""
-        # ~~~ Nonlinear Dynamics ~~~
-        u_at_v, v_at_u = self.uvatuv()              # (nx, ny+1), (nx+1, ny)
-        ubarx = self.x_average(self._u)[:, 1:-1]    # u averaged to v lons
-        ubary = self.y_average(self._u)[1:-1, :]    # u averaged to v lats
+        """Calculate the dynamics for the u, v and phi equations.
 
-        vbary = self.y_average(self._v)[1:-1, :]
-        vbarx = self.x_average(self._v)[:, 1:-1]
+        Every intermediate is written into an array from the grid workspace,
+        so the tendencies are computed without allocating memory."""
+        if self.equations is not None:
+            return self.equations(self)
+        if self.backend == 'numba':
+            return self._fused_dynamics()
 
-        # the height equation
-        phi_at_u = self.x_average(self._phi)[:, 1:-1]  # (nx+1, ny)
-        phi_at_v = self.y_average(self._phi)[1:-1, :]  # (nx, ny+1)
+        nx, ny, ens = self.nx, self.ny, self.ensemble_shape
+        work, coeffs = self.workspace, self.coefficient_fields
+        ushape, vshape, phishape = ens + (nx+1, ny), ens + (nx, ny+1), ens + (nx, ny)
+        tmp_u, tmp_v, tmp_phi = work('tmp', ushape), work('tmp', vshape), work('tmp', phishape)
 
-        phi_rhs  = - self.diffx(phi_at_u * self.u) - self.diffy(phi_at_v * self.v)  # (nx, ny)
-        phi_rhs += self.nu_phi*self.del2(self._phi)       # diffusion
+        # ~~~ Nonlinear Dynamics ~~~
+        # interpolated velocities are cached for the step, see `derived`
+        u_at_v, v_at_u = self._uvatuv()  # (nx, ny+1), (nx+1, ny)
+        ubarx = self.derived('ubarx', ens + (nx+2, ny),
+                             lambda out: self.x_average(self._u[..., :, 1:-1], out=out))  # u averaged to v lons
+        ubary = self.derived('ubary', ens + (nx+1, ny+1),
+                             lambda out: self.y_average(self._u[..., 1:-1, :], out=out))  # u averaged to v lats
+
+        vbary = self.derived('vbary', ens + (nx, ny+2),
+                             lambda out: self.y_average(self._v[..., 1:-1, :], out=out))
+        vbarx = self.derived('vbarx', ens + (nx+1, ny+1),
+                             lambda out: self.x_average(self._v[..., :, 1:-1], out=out))
+
+        # the height equation
+        phi_at_u = self.x_average(self._phi[..., :, 1:-1], out=work('phi_at_u', ushape))  # (nx+1, ny)
+        phi_at_v = self.y_average(self._phi[..., 1:-1, :], out=work('phi_at_v', vshape))  # (nx, ny+1)
+        phi_at_u *= self.u
+        phi_at_v *= self.v
+
+        phi_rhs = self.diffx(phi_at_u, out=work('phi_rhs', phishape))  # (nx, ny)
+        np.negative(phi_rhs, out=phi_rhs)
+        phi_rhs -= self.diffy(phi_at_v, out=tmp_phi)
+        diffusion = self.del2(self._phi, out=tmp_phi)
+        diffusion *= self.nu_phi
+        phi_rhs += diffusion
         #phi_rhs -= self.damping(self.phi)               # damping at top and bottom boundaries
 
         # the u equation
-        dhdx = self.diffx(self._phi)[:, 1:-1]       # (nx+2, ny)
-        ududx = 0.5*self.diffx(ubarx**2)            # u*du/dx at u points
-        vdudy = v_at_u*self.diffy(ubary)            # v*du/dy at u points
-
-        u_rhs  = -dhdx + (self.f0 + self.beta*self.uy)*v_at_u
-        u_rhs += self.nu*self.del2(self._u)
-        u_rhs += - ududx - vdudy               # nonlin u advection terms
-        u_rhs -= self.damping(self.u)
+        u_rhs = self.diffx(self._phi[..., :, 1:-1], out=work('u_rhs', ushape))  # dhdx (nx+1, ny)
+        np.negative(u_rhs, out=u_rhs)
+        u_rhs += np.multiply(coeffs['f_u'], v_at_u, out=tmp_u)
+        diffusion = self.del2(self._u, out=tmp_u)
+        diffusion *= self.nu
+        u_rhs += diffusion
+
+        ubarx2 = np.square(ubarx, out=work('ubarx2', ubarx.shape))
+        ududx = self.diffx(ubarx2, out=work('ududx', ushape))  # u*du/dx at u points
+        ududx *= 0.5
+        vdudy = self.diffy(ubary, out=tmp_u)                  # v*du/dy at u points
+        vdudy *= v_at_u
+        np.negative(ududx, out=ududx)
+        ududx -= vdudy
+        u_rhs += ududx                          # nonlin u advection terms
+        u_rhs -= np.multiply(coeffs['damp_u'], self.u, out=tmp_u)
 
         # the v equation
-        dhdy  = self.diffy(self._phi)[1:-1, :]
-        udvdx = u_at_v*self.diffx(vbarx)
-        vdvdy = 0.5*self.diffy(vbary**2)            # v*dv/dy at v points
-
-        v_rhs  = -dhdy -(self.f0 + self.beta*self.vy)*u_at_v
-        v_rhs += self.nu*self.del2(self._v)
-        v_rhs += - udvdx - vdvdy
-        v_rhs -= self.damping(self.v)
+        v_rhs = self.diffy(self._phi[..., 1:-1, :], out=work('v_rhs', vshape))  # dhdy (nx, ny+1)
+        np.negative(v_rhs, out=v_rhs)
+        v_rhs -= np.multiply(coeffs['f_v'], u_at_v, out=tmp_v)
+        diffusion = self.del2(self._v, out=tmp_v)
+        diffusion *= self.nu
+        v_rhs += diffusion
 
-        dstate = np.array([u_rhs, v_rhs, phi_rhs])
+        udvdx = self.diffx(vbarx, out=work('udvdx', vshape))
+        udvdx *= u_at_v
+        vbary2 = np.square(vbary, out=work('vbary2', vbary.shape))
+        vdvdy = self.diffy(vbary2, out=tmp_v)             # v*dv/dy at v points
+        vdvdy *= 0.5
+        np.negative(udvdx, out=udvdx)
+        udvdx -= vdvdy
+        v_rhs += udvdx
+        v_rhs -= np.multiply(coeffs['damp_v'], self.v, out=tmp_v)
 
-        return dstate
+        return u_rhs, v_rhs, phi_rhs
 
 
 
 class LinearShallowWater(ShallowWater):
-    def __init__(self, nx, ny, Lx=1.0e7, Ly=1.0e7, f0=0.0, beta=0.0, g=9.8, H=10.0, nu=1.0e3, nu_phi=None, r=1.0e-5, dt=1000.0):
-        super(LinearShallowWater, self).__init__(nx, ny, Lx, Ly, f0, beta, nu, nu_phi, r, dt)
+    """The linearised Shallow Water Equations on the Arakawa-C grid.
+
+    As ShallowWater, with the additional `backend`='sparse' computing the
+    tendencies as a single product with the `linear_operator` matrix.
+
+    Setting `gravity_waves` = 'semi-implicit' steps the pressure gradient
+    and divergence terms with the trapezoidal rule (see `semiimplicit`),
+    so the timestep is no longer limited by the gravity wave speed.  On a
+    domain periodic in x, `zonal_modes.ZonalModes` steps the model exactly,
+    one zonal wavenumber at a time.
+    """
+    backends = ('numpy', 'numba', 'sparse')
+    gravity_waves = 'explicit'   # or 'semi-implicit', see semiimplicit.py
+    implicit_weight = 0.5        # weight of the new state in the semi-implicit terms
 
-        self.g = g
-        self.H = H
+    def __init__(self, nx, ny, Lx=1.0e7, Ly=1.0e7, f0=0.0, beta=0.0, g=9.8, H=10.0, nu=1.0e3, nu_phi=None, r=1.0e-5, dt=1000.0, backend='numpy', ensemble_size=None, workers=None, dtype=np.float64, ygrid=None, order=2, mask=None):
+        super(LinearShallowWater, self).__init__(nx, ny, Lx, Ly, f0, beta, nu, nu_phi, r, dt, backend, ensemble_size, workers, dtype, ygrid, order, mask)
+
+        self.g = self.ensemble_parameter(g)
+        self.H = self.ensemble_parameter(H)
 
         self.hx = self.phix
         self.hy = self.phiy
@@ -181,41 +464,352 @@ class LinearShallowWater(ShallowWater):
     def _h(self):
         return self._phi
 
+    def _flather_coefficients(self):
+        # h is the perturbation of the resting depth H, with c/H = sqrt(g/H)
+        return 0.0, np.sqrt(np.divide(self.g, self.H))
+
+    def linear_operator(self, boundaries=True):
+        """Returns the tendency of the model as a scipy.sparse CSR matrix on
+        the packed (u, v, h) `state_vector`, boundary cells included:
+
+            dstate = model.linear_operator() @ model.state_vector
+
+        Coriolis, diffusion and the sponge are built in, and so are the
+        boundary conditions unless `boundaries` is False.  Forcings are not.
+        The matrix is assembled once for each set of parameter values (see
+        `sparse_operator.assemble`), so it is rebuilt only when f0, beta, r,
+        sponge_ny, nu, nu_phi, g or H are changed to new values."""
+        key = tuple(np.asarray(getattr(self, name)).tobytes()
+                    for name in ('f0', 'beta', 'r', 'sponge_ny', 'nu', 'nu_phi', 'g', 'H'))
+        operators = self.__dict__.setdefault('_linear_operators', {})
+        if (key, boundaries) not in operators:
+            operators[key, boundaries] = sparse_operator.assemble(self, boundaries)
+        return operators[key, boundaries]
+
+    def _semi_implicit(self):
+        if self.gravity_waves not in ('explicit', 'semi-implicit'):
+            raise ValueError("gravity_waves must be 'explicit' or 'semi-implicit', not %r" % self.gravity_waves)
+        if self.gravity_waves == 'semi-implicit' and self.multistage:
+            raise ValueError('the semi-implicit step needs the Adams-Bashforth timestepper')
+        return self.gravity_waves == 'semi-implicit'
+
+    def _dstate(self, out=None, accumulate=False):
+        # Adams-Bashforth steps only the explicit terms of a semi-implicit model
+        fstate = super(LinearShallowWater, self)._dstate(out, accumulate)
+        if self._semi_implicit():
+            fstate -= semiimplicit.gravity_tendency(self)
+        return fstate
+
+    def _advance(self):
+        if not self._semi_implicit():
+            return super(LinearShallowWater, self)._advance()
+        gravity = semiimplicit.gravity_tendency(self)   # of the state before the step
+        super(LinearShallowWater, self)._advance()
+        semiimplicit.complete_step(self, gravity)
+
+    def _sparse_dynamics(self):
+        """Calculate the dynamics of the u, v and h equations
+        as a sparse matrix-vector product."""
+        # the boundary conditions have already been applied to the state
+        rhs = self.linear_operator(boundaries=False) @ self.state_vector
+        return self._packed._wrap(rhs).fields
+
+    def _fused_dynamics(self):
+        """Calculate the dynamics of the u, v and h equations
+        with the fused kernels."""
+        nx, ny, ens = self.nx, self.ny, self.ensemble_shape
+        work, m, p = self.workspace, self._as_members, self._per_member
+        f_u, f_v, damp_u, damp_v = self._kernel_coefficients()
+        g, H, nu, nu_phi = p(self.g), p(self.H), p(self.nu), p(self.nu_phi)
+
+        u_rhs = work('u_rhs', ens + (nx+1, ny))
+        v_rhs = work('v_rhs', ens + (nx, ny+1))
+        h_rhs = work('h_rhs', ens + (nx, ny))
+        args = m(self._u), m(self._v), m(self._h)
+        kernels.linear_u(*args, f_u, damp_u, self.dx, self.dy, g, nu, m(u_rhs))
+        kernels.linear_v(*args, f_v, damp_v, self.dx, self.dy, g, nu, m(v_rhs))
+        kernels.linear_h(*args, damp_u, self.dx, self.dy, H, nu_phi, m(h_rhs))
+        return u_rhs, v_rhs, h_rhs
+
     def _dynamics(self):
         """Calculate the dynamics of the u, v and h equations."""
+        if self.equations is not None:
+            return self.equations(self)
+        if self.backend == 'numba':
+            return self._fused_dynamics()
+        elif self.backend == 'sparse':
+            return self._sparse_dynamics()
+
         # ~~~ Linear dynamics ~~~
-        f0, beta, g, H, nu = self.f0, self.beta, self.g, self.H, self.nu
+        g, H, nu = self.g, self.H, self.nu
+        nx, ny, ens = self.nx, self.ny, self.ensemble_shape
+        work, coeffs = self.workspace, self.coefficient_fields
+        ushape, vshape, hshape = ens + (nx+1, ny), ens + (nx, ny+1), ens + (nx, ny)
+        tmp_u, tmp_v, tmp_h = work('tmp', ushape), work('tmp', vshape), work('tmp', hshape)
 
-        uu, vv = self.uvatuv()
+        uu, vv = self._uvatuv()
 
         # the height equation
-        h_rhs = -H*self.divergence() + self.nu_phi*self.del2(self._h) - self.damping(self.h)
+        h_rhs = self.divergence(out=work('h_rhs', hshape))
+        h_rhs *= -H
+        diffusion = self.del2(self._h, out=tmp_h)
+        diffusion *= self.nu_phi
+        h_rhs += diffusion
+        h_rhs -= np.multiply(coeffs['damp_u'], self.h, out=tmp_h)
 
         # the u equation
-        dhdx = self.diffx(self._h)[:, 1:-1]
-        u_rhs = (f0 + beta*self.uy)*vv - g*dhdx + nu*self.del2(self._u) - self.damping(self.u)
+        u_rhs = np.multiply(coeffs['f_u'], vv, out=work('u_rhs', ushape))
+        dhdx = self.diffx(self._h[..., :, 1:-1], out=tmp_u)
+        dhdx *= g
+        u_rhs -= dhdx
+        diffusion = self.del2(self._u, out=tmp_u)
+        diffusion *= nu
+        u_rhs += diffusion
+        u_rhs -= np.multiply(coeffs['damp_u'], self.u, out=tmp_u)
 
         # the v equation
-        dhdy  = self.diffy(self._h)[1:-1, :]
-        v_rhs = -(f0 + beta*self.vy)*uu - g*dhdy + nu*self.del2(self._v) - self.damping(self.v)
+        v_rhs = np.multiply(coeffs['f_v'], uu, out=work('v_rhs', vshape))
+        np.negative(v_rhs, out=v_rhs)
+        dhdy = self.diffy(self._h[..., 1:-1, :], out=tmp_v)
+        dhdy *= g
+        v_rhs -= dhdy
+        diffusion = self.del2(self._v, out=tmp_v)
+        diffusion *= nu
+        v_rhs += diffusion
+        v_rhs -= np.multiply(coeffs['damp_v'], self.v, out=tmp_v)
+
+        return u_rhs, v_rhs, h_rhs
+
+
+class TracerStack(Dynamic):
+    """The tracers of a model, stored as one (ntracers, nx+2, ny+2) array
+    and stepped together.
+
+    The diffusion, with a `kappa` per tracer, and the advection of every
+    tracer are computed in one pass over the stack.  Any ensemble axis
+    follows the tracer axis.  Each tracer is accessed through the `Tracer`
+    view of its row returned by `add`; adding a tracer reallocates the
+    stack, so arrays taken from the tracers before are no longer views.
+
+    The tracers are advected as set by `tracer_advection` of the grid: by
+    the flux-form `grid.advect` or semi-Lagrangian, interpolated at the
+    departure points of the cell centres (see `semilagrangian`).  They are
+    stepped once every `tracer_steps` steps of the grid with a timestep that
+    many times longer.
+    """
+    def __init__(self, grid):
+        super(TracerStack, self).__init__()
+        self.grid = grid
+        self.tracers = []
+        self._added_at = []   # stack timestep at which each tracer was added
+        self._resize()
 
-        dstate = np.array([u_rhs, v_rhs, h_rhs])
+    _velocities = None   # cell-centre velocities of the last semi-Lagrangian step
 
-        return dstate
+    @property
+    def dt(self):
+        return self.grid.dt * getattr(self.grid, 'tracer_steps', 1)
+
+    @property
+    def tendency_dtype(self):
+        return self.grid.tendency_dtype
+
+    @property
+    def semi_lagrangian(self):
+        advection = getattr(self.grid, 'tracer_advection', 'flux')
+        if advection not in ('flux', 'semi-lagrangian'):
+            raise ValueError("tracer_advection must be 'flux' or 'semi-lagrangian', not %r" % advection)
+        return advection == 'semi-lagrangian'
+
+    @property
+    def ntracers(self):
+        return len(self.tracers)
+
+    def add(self, name, initial_state=0.0, kappa=0.0):
+        """Add a tracer to the stack and return its `Tracer`."""
+        tracer = Tracer(name, self, self.ntracers)
+        self.tracers.append(tracer)
+        self._added_at.append(self.tc)
+        self._resize()
+        tracer.kappa = kappa
+        tracer.state = initial_state
+        return tracer
+
+    def _resize(self):
+        # allocate the stack for the current tracers, keeping the state and
+        # tendency history of those already there
+        n, grid = self.ntracers, self.grid
+        spatial_ndim = len(grid._shape) - len(grid.ensemble_shape)
+        packed = PackedState([(n,) + grid._shape], spatial_ndim=spatial_ndim,
+                             dtype=grid.dtype)  # store tracers on cell centres
+        kappa = np.zeros((n,) + (1,)*len(grid._shape))
+        if n > 1:
+            packed.vector[:self.state_vector.size] = self.state_vector
+            kappa[:n-1] = self.kappa
+            if self._history is not None:
+                # add a row of zero tendency for the new tracer
+                history = np.zeros((3, n, packed.vector.size // n), dtype=self._history.dtype)
+                history[:, :-1] = self._history.reshape(3, n-1, -1)
+                self._history = history.reshape(3, -1)
+        self._packed, self.kappa = packed, kappa
+        self._state, = self._packed.padded
 
+    @property
+    def state(self):
+        # view without boundary conditions
+        return self._state[self.grid.true_slice]
 
-class Tracer(Dynamic):
-    def __init__(self, name, grid, kappa=0.0, initial_state=0.0):
-        super(Tracer, self).__init__()
+    @state.setter
+    def state(self, value):
+        self._state[self.grid.true_slice] = value
+
+    @property
+    def state_vector(self):
+        return self._packed.vector
+
+    def _set_state_buffer(self, vector):
+        vector[:] = self._packed.vector
+        self._packed = self._packed._wrap(vector)
+        self._state, = self._packed.padded
+
+    def step_coefficients(self):
+        """Adams-Bashforth weights of each tracer, shaped to broadcast against
+        the stack.  A tracer added after the others starts with an Euler
+        step, as if it was stepped on its own."""
+        coeffs = np.zeros((3, self.ntracers), dtype=self.state_vector.dtype)
+        for k, added_at in enumerate(self._added_at):
+            weights = self.coefficients(self.tc - added_at, self.dt)
+            coeffs[:len(weights), k] = weights
+        return tuple(coeffs.reshape((3, self.ntracers) + (1,)*(self._state.ndim-1)))
+
+    def _history_rows(self):
+        # each tracer has its own Adams-Bashforth weights
+        return self.ntracers
+
+    def _evaluate(self):
+        super(TracerStack, self)._evaluate()
+        if self.semi_lagrangian:
+            # the change of the tracers moved to the departure points
+            moved = self._departures()(self._state, out=self.grid.workspace('tracer_moved', self.state.shape))
+            moved -= self.state
+            self._moved = moved
+
+    def _advance(self):
+        super(TracerStack, self)._advance()
+        if self.semi_lagrangian:
+            state = self.state
+            state += self._moved
+            del self._moved
+
+    def _departures(self):
+        # the interpolation stencil at the departure points of this step,
+        # shared by all tracers, from the velocities extrapolated to the
+        # middle of the step
+        grid = self.grid
+        if grid.mask is not None:
+            raise ValueError('semi-Lagrangian tracers need a grid without a land-sea mask')
+        current = grid._uvath()
+        if self._velocities is None:
+            self._velocities = [c.copy() for c in current]
+        u, v = [grid.workspace('departure ' + name, c.shape, c.dtype) for name, c in zip('uv', current)]
+        for mid, c, p in zip((u, v), current, self._velocities):
+            np.multiply(c, 1.5, out=mid)
+            p *= 0.5
+            mid -= p
+            p[...] = c
+        x, y = semilagrangian.departure_points(grid, u, v, self.dt)
+        return semilagrangian.stencil(grid, x, y, grid.tracer_interpolation)
+
+    def _accumulate(self, dstate, term):
+        q, = dstate
+        q += term
+
+    def _forcing_terms(self):
+        # forcings of the whole stack, then those of each tracer on its row
+        terms = super(TracerStack, self)._forcing_terms()
+        for tracer in self.tracers:
+            for f in tracer.forcings:
+                term = np.zeros_like(self.state)
+                term[tracer.index] = f(tracer)
+                terms.append(term)
+        return terms
+
+    @property
+    def _row_blocks(self):
+        # tracers are evaluated on the same row blocks as their grid
+        return getattr(self.grid, '_row_blocks', None)
+
+    # tracers are evaluated in chunks of about this many bytes, so that the
+    # intermediate arrays of each pass stay in cache
+    chunk_bytes = 1 << 18
+
+    def _diffusion(self, field, kappa, out=None):
+        out = self.grid.del2(field, out=out)
+        out *= kappa
+        return out
+
+    def _dynamics(self):
+        work = self.grid.workspace
+        shape = self.state.shape
+        rhs = work('tracer_rhs', shape)
+        nchunk = max(1, self.chunk_bytes // (rhs[:1].nbytes or 1))
+        for k in range(0, len(rhs), nchunk):
+            chunk = slice(k, k+nchunk)
+            out = rhs[chunk]
+            self._diffusion(self._state[chunk], self.kappa[chunk], out=out)
+            if not self.semi_lagrangian:
+                out -= self.grid.advect(self._state[chunk], out=work('tracer_advect', out.shape))
+        return rhs
+
+    def step(self):
+        self.apply_boundary_conditions()
+        sync_step(self)
+
+    def apply_boundary_conditions(self):
+        self.grid.apply_boundary_conditions_to(self._state)
+
+
+class Tracer(object):
+    """A tracer advected by a model: a view of one row of its TracerStack.
+
+    The tracer can be read and written like the array of its state, e.g.
+    `model.q[10:20] = 1.0`.
+    """
+    def __init__(self, name, stack, index):
         self.name = name
-        self.grid = grid
+        self.stack = stack
+        self.index = index
+        self.forcings = []
+
+    add_forcing = Dynamic.add_forcing
+
+    @property
+    def grid(self):
+        return self.stack.grid
+
+    @property
+    def dt(self):
+        return self.stack.dt
 
-        self._state = np.zeros(grid._shape)  # store tracer on cell centres
-        self.kappa = kappa # diffusion
+    @property
+    def tc(self):
+        return self.stack.tc - self.stack._added_at[self.index]
+
+    @property
+    def t(self):
+        return self.tc*self.dt
+
+    @property
+    def kappa(self):
+        return self.stack.kappa[self.index].item()
 
-        self.state = initial_state
+    @kappa.setter
+    def kappa(self, value):
+        self.stack.kappa[self.index] = value  # diffusion
 
-        self.dt = grid.dt
+    @property
+    def _state(self):
+        return self.stack._state[self.index]
 
     @property
     def state(self):
@@ -226,11 +820,9 @@ class Tracer(Dynamic):
     def state(self, value):
         self._state[self.grid.true_slice] = value
 
-    def _diffusion(self):
-        return self.kappa*self.grid.del2(self._state)
-
-    def _dynamics(self):
-        return self._diffusion() - self.grid.advect(self._state)
+    @property
+    def state_vector(self):
+        return self._state.reshape(-1)
 
     def rhs(self):
         """Set a right-hand side term for the equation.
@@ -238,14 +830,15 @@ class Tracer(Dynamic):
         return 0.0
 
     def step(self):
-        self.apply_boundary_conditions()
-        self.state = self.state + self.dstate()
-        self._incr_timestep()
+        # the tracers of a model are stepped together
+        self.stack.step()
 
     def apply_boundary_conditions(self):
         self.grid.apply_boundary_conditions_to(self._state)
 
     def __getattr__(self, attr):
+        if attr.startswith('_') or attr == 'stack':
+            raise AttributeError(attr)
         return getattr(self.state, attr)
 
     def __getitem__(self, slice):
@@ -258,6 +851,12 @@ class PeriodicShallowWater(PeriodicBoundaries, ShallowWater): pass
 class WalledShallowWater(WallBoundaries, ShallowWater): pass
 class PeriodicLinearShallowWater(PeriodicBoundaries, LinearShallowWater): pass
 class WalledLinearShallowWater(WallBoundaries, LinearShallowWater): pass
+class DoublyPeriodicShallowWater(DoublyPeriodicBoundaries, ShallowWater): pass
+class ClosedShallowWater(ClosedBoundaries, ShallowWater): pass
+class DoublyPeriodicLinearShallowWater(DoublyPeriodicBoundaries, LinearShallowWater): pass
+class ClosedLinearShallowWater(ClosedBoundaries, LinearShallowWater): pass
+class OpenShallowWater(RadiationBoundaries, ShallowWater): pass
+class OpenLinearShallowWater(RadiationBoundaries, LinearShallowWater): pass
 
 
 if __name__ == '__main__':
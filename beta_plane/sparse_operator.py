@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Sparse matrices of the linear shallow water models.
+
+The tendency of `LinearShallowWater` is a linear function of its packed
+(u, v, h) state vector, so it is a sparse matrix
+
+    dstate = A @ state_vector
+
+`assemble` builds A by probing the model's own `_dynamics`: every column
+whose stencils cannot overlap is set to one in the same probe state, so the
+whole matrix is recovered from a few hundred evaluations of the tendency
+whatever the grid size.  Coriolis, diffusion and the sponge come with the
+dynamics and the boundary conditions are a second sparse matrix built from
+the model's compiled boundary map (see `arakawac.compile_boundary_map`).
+
+On a grid with a land-sea mask the rows and columns of the land cells and
+of the faces of the coast are dropped, so the product only evaluates the
+wet cells and faces.
+"""
+
+import numpy as np
+import scipy.sparse
+
+from arakawac import PackedState, Workspace
+from rowblocks import _view
+
+
+def boundary_matrix(model):
+    """Returns the sparse matrix applying the boundary conditions of
+    `model` to its packed state vector."""
+    if not hasattr(model, '_boundary_rules'):
+        raise ValueError('%s has no boundary conditions' % type(model).__name__)
+    n = model.state_vector.size
+    dst, src, weight = model.boundary_map(model._packed.shapes, model._boundary_rules)
+
+    # rows of the boundary cells are replaced by the weights of their sources
+    keep = np.ones(n, dtype=bool)
+    keep[dst] = False
+    interior = np.flatnonzero(keep)
+    rows = np.concatenate([interior, dst, dst])
+    cols = np.concatenate([interior, src[0], src[1]])
+    vals = np.concatenate([np.ones(len(interior)), weight, weight])
+    matrix = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(n, n))
+    if model.mask is not None:
+        # the flow through the coast is zeroed before the boundary rules
+        matrix = matrix @ _keep(n, model._coast)
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _keep(n, dropped):
+    # diagonal matrix zeroing the `dropped` entries of a vector of length n
+    keep = np.ones(n)
+    keep[dropped] = 0
+    return scipy.sparse.diags(keep, format='csr')
+
+
+def assemble(model, boundaries=True):
+    """Returns the tendency of `model._dynamics` as a sparse matrix on the
+    packed state vector, boundary cells included, in CSR format.
+
+    With `boundaries` the boundary conditions are applied to the state
+    first, as when the model is stepped, otherwise the matrix acts on the
+    padded state as it is.  Forcings are not included.
+    """
+    packed = PackedState(model._packed.shapes, spatial_ndim=2, dtype=model.dtype)
+    view = _view(model, _packed=packed, workspace=Workspace(model.tendency_dtype),
+                 backend='numpy', _row_blocks=None, _state_changes=0)
+    view._u, view._v, view._phi = packed.padded
+
+    def tendency(vector):
+        packed.vector[:] = vector
+        view.state_changed()
+        dstate = np.zeros_like(packed, dtype=model.tendency_dtype)
+        view._accumulate(dstate, view._dynamics())
+        return dstate.vector
+
+    # the field, ensemble member and padded (i, j) position of every cell
+    n = packed.vector.size
+    cell = [np.empty(n, dtype=np.intp) for _ in range(4)]
+    offset = 0
+    for k, field in enumerate(packed.padded):
+        members = int(np.prod(field.shape[:-2]))
+        where = np.unravel_index(np.arange(field.size), (members,) + field.shape[-2:])
+        for c, w in zip(cell, (k,) + where):
+            c[offset:offset+field.size] = w
+        offset += field.size
+    field_of, member_of, i_of, j_of = cell
+    offsets = np.cumsum([0] + [field.size for field in packed.padded])
+
+    # cells further apart than `reach` in x or y do not interact, so the
+    # columns of one field that are `period` apart are probed together
+    reach = 2*model.halo + 2
+    period = 2*reach + 1
+
+    rows, cols, vals = [], [], []
+    for k, field in enumerate(packed.padded):
+        nx, ny = field.shape[-2:]
+        for pi in range(period):
+            for pj in range(period):
+                probe = (field_of == k) & (i_of % period == pi) & (j_of % period == pj)
+                if not probe.any():
+                    continue
+                out = tendency(probe)
+                row = np.flatnonzero(out)
+                # the probed cell within reach of each row
+                i = i_of[row] + (pi - i_of[row] + reach) % period - reach
+                j = j_of[row] + (pj - j_of[row] + reach) % period - reach
+                valid = (i >= 0) & (i < nx) & (j >= 0) & (j < ny)
+                rows.append(row[valid])
+                cols.append(offsets[k] + (member_of[row[valid]]*nx + i[valid])*ny + j[valid])
+                vals.append(out[row[valid]])
+
+    matrix = scipy.sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                                     shape=(n, n), dtype=model.tendency_dtype)
+
+    # a stencil reaching further than `reach` would show up here
+    x = np.random.default_rng(0).standard_normal(n)
+    expected = tendency(x)
+    if not np.allclose(matrix @ x, expected, rtol=1e-4, atol=1e-4*np.abs(expected).max()):
+        raise ValueError('the tendencies of %s are not linear or not local' % type(model).__name__)
+
+    if model.mask is not None:
+        # neither the land nor the coast is evaluated, nor read by the sea
+        keep = _keep(n, np.concatenate([model._coast, model._land]))
+        matrix = keep @ matrix @ keep
+        matrix.eliminate_zeros()
+    if boundaries:
+        matrix = (matrix @ boundary_matrix(model)).tocsr()
+    return matrix.tocsr()
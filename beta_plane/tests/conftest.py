@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""The modules of the beta plane models import each other by name, as when
+run from their directory: put it on the path for the tests.
+
+    python -m pytest beta_plane/tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from shallowwater import PeriodicShallowWater
+
+
+def test_interpolated_velocities_are_new_arrays_of_the_current_state():
+    model = PeriodicShallowWater(16, 17, beta=2.0e-11, dt=600.0)
+    model.phi[:] = 10.0
+    model.phi[4:8, 4:8] += 1.0
+    model.step()
+
+    u_at_h, v_at_h = model.uvath()
+    u_at_v, v_at_u = model.uvatuv()
+    kept = [a.copy() for a in (u_at_h, v_at_h, u_at_v, v_at_u)]
+    model.step()
+    # taken before the step, they are not overwritten by it
+    for a, b in zip((u_at_h, v_at_h, u_at_v, v_at_u), kept):
+        assert np.array_equal(a, b)
+    u_at_h *= 2.0    # and may be modified
+
+    # a direct write into the state is seen once it is reported
+    model.u[:] = 1.0
+    model.v[:] = 0.0
+    model.state_changed()
+    u_at_h, v_at_h = model.uvath()
+    assert np.all(u_at_h == 1.0) and np.all(v_at_h == 0.0)
+
+
+def test_interpolated_velocities_are_computed_once_per_state():
+    model = PeriodicShallowWater(16, 17, beta=2.0e-11, dt=600.0)
+    model.phi[:] = 10.0
+    model.phi[4:8, 4:8] += 1.0
+    model.step()
+
+    cached = model._uvath()
+    assert all(a is b for a, b in zip(model._uvath(), cached))
+    assert all(np.array_equal(a, b) for a, b in zip(model.uvath(), cached))
+    assert np.array_equal(cached[0], model.x_average(model.u))
+    assert not cached[0].flags.writeable
+
+    model.step()
+    fresh = model._uvath()
+    assert np.array_equal(fresh[1], model.y_average(model.v))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import warnings
+
+import numpy as np
+import pytest
+
+import kernels
+from arakawac import equatorial_stretching
+from shallowwater import PeriodicLinearShallowWater, PeriodicShallowWater, WalledLinearShallowWater
+
+needs_numba = pytest.mark.skipif(kernels.numba is None, reason='Numba is not installed')
+
+
+def initial_state(model):
+    x, y = np.meshgrid(np.linspace(-1, 1, model.nx), np.linspace(-1, 1, model.ny), indexing='ij')
+    bump = np.exp(-8*((x - 0.2)**2 + y**2))
+    if isinstance(model, PeriodicShallowWater):
+        model.phi[:] = 10.0 + bump
+    else:
+        model.h[:] = bump
+    model.u[:] = 0.05
+    return model
+
+
+def run(cls, nsteps=20, **kwargs):
+    params = dict(beta=2.0e-11, f0=1.0e-5, nu=1.0e3, dt=600.0)
+    params.update(kwargs)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model = initial_state(cls(32, 33, **params))
+    for _ in range(nsteps):
+        model.step()
+    return model
+
+
+@needs_numba
+@pytest.mark.parametrize('cls', [PeriodicShallowWater, PeriodicLinearShallowWater, WalledLinearShallowWater])
+@pytest.mark.parametrize('ensemble', [{}, dict(ensemble_size=3, nu=[5.0e2, 1.0e3, 2.0e3])])
+def test_fused_kernels_match_numpy(cls, ensemble):
+    numpy_model = run(cls, backend='numpy', **ensemble)
+    numba_model = run(cls, backend='numba', **ensemble)
+    assert numba_model.backend == 'numba'
+    assert np.allclose(numba_model.state_vector, numpy_model.state_vector, rtol=1e-10, atol=1e-12)
+
+
+def test_fused_kernels_fall_back_to_numpy_on_a_masked_grid():
+    mask = np.ones((32, 33), dtype=bool)
+    mask[10:14, 5:20] = False
+    numpy_model = run(WalledLinearShallowWater, backend='numpy', mask=mask)
+    with pytest.warns(UserWarning):
+        WalledLinearShallowWater(32, 33, backend='numba', mask=mask)
+    fallback = run(WalledLinearShallowWater, backend='numba', mask=mask)
+    assert fallback.backend == 'numpy'
+    assert np.allclose(fallback.state_vector, numpy_model.state_vector)
+
+
+@pytest.mark.parametrize('cls', [PeriodicLinearShallowWater, WalledLinearShallowWater])
+@pytest.mark.parametrize('options', [{}, dict(ensemble_size=2, g=[9.8, 4.9]),
+                                     dict(ygrid=equatorial_stretching(2.0)),
+                                     dict(order=4)])
+def test_sparse_operator_matches_numpy(cls, options):
+    numpy_model = run(cls, backend='numpy', **options)
+    sparse_model = run(cls, backend='sparse', **options)
+    assert np.allclose(sparse_model.state_vector, numpy_model.state_vector, rtol=1e-10, atol=1e-12)
+
+
+def test_sparse_operator_matches_numpy_on_a_masked_grid():
+    mask = np.ones((32, 33), dtype=bool)
+    mask[10:14, 5:20] = False
+    mask[20:, 25:] = False
+    numpy_model = run(WalledLinearShallowWater, nsteps=300, backend='numpy', mask=mask)
+    sparse_model = run(WalledLinearShallowWater, nsteps=300, backend='sparse', mask=mask)
+    # no flow through the coast after a step, and nothing changes on land
+    for model in numpy_model, sparse_model:
+        assert np.all(model.state_vector[model._coast] == 0)
+    assert np.allclose(sparse_model.state_vector, numpy_model.state_vector, rtol=1e-10, atol=1e-12)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from shallowwater import (PeriodicShallowWater, WalledShallowWater, DoublyPeriodicShallowWater,
+                          ClosedShallowWater, DoublyPeriodicLinearShallowWater, ClosedLinearShallowWater)
+
+
+CLASSES = [PeriodicShallowWater, WalledShallowWater, DoublyPeriodicShallowWater, ClosedShallowWater,
+           DoublyPeriodicLinearShallowWater, ClosedLinearShallowWater]
+
+
+@pytest.mark.parametrize('cls', CLASSES)
+def test_compiled_boundary_map_applies_the_rules(cls):
+    model = cls(12, 13, ensemble_size=2)
+    model.state_vector[:] = np.random.default_rng(0).standard_normal(model.state_vector.size)
+    expected = model._packed.copy()
+    model._boundary_rules(*expected.padded)
+    model.apply_boundary_conditions()
+    assert np.array_equal(model.state_vector, expected.vector)
+
+    field = np.random.default_rng(1).standard_normal(model._phi.shape)
+    expected = field.copy()
+    model._field_boundary_rules(expected)
+    model.apply_boundary_conditions_to(field)
+    assert np.array_equal(field, expected)
+
+
+def bump(model):
+    x, y = np.meshgrid(np.linspace(-1, 1, model.nx), np.linspace(-1, 1, model.ny), indexing='ij')
+    return np.exp(-8*((x - 0.3)**2 + y**2))
+
+
+@pytest.mark.parametrize('cls', [DoublyPeriodicShallowWater, ClosedShallowWater,
+                                 DoublyPeriodicLinearShallowWater, ClosedLinearShallowWater])
+def test_mass_is_conserved(cls):
+    model = cls(24, 25, Lx=1.0e6, Ly=1.0e6, f0=1.0e-4, beta=2.0e-11, nu=1.0e3, r=0.0, dt=600.0)
+    mass = model.h if hasattr(model, 'h') else model.phi
+    mass[:] = bump(model) + (0.0 if hasattr(model, 'h') else 10.0)
+    initial = mass.sum()
+    for _ in range(200):
+        model.step()
+    assert abs(mass.sum() - initial) < 1e-12*np.abs(mass).sum()
+    assert np.abs(mass - mass.mean()).max() < 0.9*np.abs(bump(model)).max()   # the bump has spread out
+
+
+@pytest.mark.parametrize('cls', [ClosedShallowWater, ClosedLinearShallowWater])
+def test_no_flow_through_closed_walls(cls):
+    model = cls(16, 17, Lx=1.0e6, Ly=1.0e6, f0=1.0e-4, dt=600.0)
+    (model.h if hasattr(model, 'h') else model.phi)[:] += bump(model)
+    for _ in range(20):
+        model.step()
+    model.apply_boundary_conditions()
+    assert np.all(model.u[..., [0, -1], :] == 0)
+    assert np.all(model.v[..., :, [0, -1]] == 0)
+
+
+def test_doubly_periodic_points_coincide():
+    model = DoublyPeriodicShallowWater(16, 17, Lx=1.0e6, Ly=1.0e6, f0=1.0e-4, r=0.0, dt=600.0)
+    model.phi[:] = 10.0 + bump(model)
+    for _ in range(20):
+        model.step()
+    model.apply_boundary_conditions()
+    assert np.array_equal(model.u[0], model.u[-1])
+    assert np.array_equal(model.v[:, 0], model.v[:, -1])
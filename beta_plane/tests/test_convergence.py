@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from convergence import gravity_wave_error
+
+
+@pytest.mark.parametrize('axis', [0, 1])
+@pytest.mark.parametrize('order', [2, 4])
+def test_gravity_wave_error_falls_at_the_order_of_the_stencils(order, axis):
+    coarse, fine = [gravity_wave_error(n, order, axis) for n in (16, 32)]
+    rate = np.log(coarse / fine) / np.log(2)
+    assert rate == pytest.approx(order, abs=0.5)
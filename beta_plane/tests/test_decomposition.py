@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+import kernels
+from decomposition import DomainDecomposition
+from shallowwater import PeriodicShallowWater, WalledLinearShallowWater
+
+
+def forced_model(cls, dtype):
+    model = cls(24, 17, beta=2.0e-11, f0=1.0e-5, dt=600.0, dtype=dtype, ensemble_size=2)
+    if cls is PeriodicShallowWater:
+        model.phi[:] = 10.0
+    model.phi[:, 5:10, 5:9] += 1.0
+    model.add_tracer('q', 1.0)
+    model.add_tracer('p', 0.0)
+    model.q[:, 3:8, 3:8] = 2.0
+
+    @model.add_forcing
+    def relax(m):
+        dstate = np.zeros_like(m.state)
+        dstate[2] = -m.phi*1.0e-6
+        return dstate
+    return model
+
+
+@pytest.mark.parametrize('fused', [False, True])
+@pytest.mark.parametrize('dtype', [np.float64, 'mixed', np.float32])
+@pytest.mark.parametrize('cls', [PeriodicShallowWater, WalledLinearShallowWater])
+def test_tiles_are_bit_identical_to_serial_stepping(cls, dtype, fused, monkeypatch):
+    if fused and kernels.numba is None:
+        pytest.skip('Numba is not installed')
+    if not fused:
+        monkeypatch.setattr(kernels, 'numba', None)
+    serial, tiled = forced_model(cls, dtype), forced_model(cls, dtype)
+    # a history of serial steps is carried into and out of the tiles
+    for _ in range(3):
+        serial.step()
+        tiled.step()
+    with DomainDecomposition(tiled, tiles=(2, 2)) as run:
+        run.step(10)
+    for _ in range(10):
+        serial.step()
+    for _ in range(3):
+        serial.step()
+        tiled.step()
+
+    assert tiled.tc == serial.tc
+    assert np.array_equal(tiled.state_vector, serial.state_vector)
+    assert np.array_equal(tiled._tracer_stack.state_vector, serial._tracer_stack.state_vector)
+
+
+def test_an_error_in_a_worker_is_raised_by_the_parent():
+    model = forced_model(WalledLinearShallowWater, np.float64)
+
+    @model.add_forcing
+    def fails(m):
+        if m.tc == 2:
+            raise ValueError('no forcing at step 2')
+        return np.zeros_like(m.state)
+
+    run = DomainDecomposition(model, tiles=(2, 1))
+    with pytest.raises(ValueError, match='no forcing at step 2'):
+        run.step(5)
+    assert not any(worker.is_alive() for worker in run._workers)
+    # the state is back in private memory, as the workers left it
+    assert model.tc == 2
+    assert np.all(np.isfinite(model.state_vector))
+    run.close()
+
+
+def test_tiles_of_a_masked_grid_are_bit_identical_to_serial_stepping():
+    mask = np.ones((24, 17), dtype=bool)
+    mask[8:14, 4:9] = False
+    models = [WalledLinearShallowWater(24, 17, beta=2.0e-11, f0=1.0e-5, dt=600.0, mask=mask) for _ in range(2)]
+    for model in models:
+        model.h[3:8, 3:8] = 1.0
+    serial, tiled = models
+    with DomainDecomposition(tiled, tiles=(2, 2)) as run:
+        run.step(20)
+    for _ in range(20):
+        serial.step()
+    assert np.array_equal(tiled.state_vector, serial.state_vector)
+    assert np.all(tiled.state_vector[tiled._coast] == 0)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from shallowwater import PeriodicShallowWater, WalledLinearShallowWater
+
+
+BETA, F0 = [1.0e-11, 2.0e-11, 3.0e-11], [0.0, 1.0e-5, 2.0e-5]
+
+
+def initialise(model, members):
+    # a bump in a different place for each member, and a tracer
+    height = model.h if hasattr(model, 'h') else model.phi
+    height[...] = 0.0 if hasattr(model, 'h') else 10.0
+    model.add_tracer('q', 1.0)
+    for k, member in enumerate(members):
+        index = (k,) if model.ensemble_size else ()
+        height[index + (slice(3 + 2*member, 8 + 2*member), slice(5, 9))] += 1.0
+        model.q.state[index + (slice(3, 8), slice(3 + member, 8 + member))] = 2.0
+
+
+@pytest.mark.parametrize('cls', [PeriodicShallowWater, WalledLinearShallowWater])
+def test_members_match_single_runs(cls):
+    ensemble = cls(16, 17, beta=BETA, f0=F0, dt=600.0, ensemble_size=3)
+    initialise(ensemble, range(3))
+    singles = [cls(16, 17, beta=beta, f0=f0, dt=600.0) for beta, f0 in zip(BETA, F0)]
+    for member, single in enumerate(singles):
+        initialise(single, [member])
+    for _ in range(20):
+        ensemble.step()
+        for single in singles:
+            single.step()
+
+    for member, single in enumerate(singles):
+        for field, expected in zip(ensemble.state, single.state):
+            assert np.array_equal(field[member], expected)
+        assert np.array_equal(ensemble.q.state[member], single.q.state)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+import expressions
+from shallowwater import PeriodicShallowWater, WalledShallowWater, PeriodicLinearShallowWater, \
+    WalledLinearShallowWater
+
+
+def stepped(cls, equations, nsteps=10, **kwargs):
+    model = cls(16, 17, beta=2.0e-11, f0=1.0e-5, dt=600.0, **kwargs)
+    model.equations = equations
+    height = model.h if hasattr(model, 'h') else model.phi
+    height[...] = 0.0 if hasattr(model, 'h') else 10.0
+    height[..., 5:10, 5:9] += 1.0
+    for _ in range(nsteps):
+        model.step()
+    return model
+
+
+@pytest.mark.parametrize('cls, equations', [
+    (PeriodicShallowWater, expressions.shallow_water),
+    (WalledShallowWater, expressions.shallow_water),
+    (PeriodicLinearShallowWater, expressions.linear_shallow_water),
+    (WalledLinearShallowWater, expressions.linear_shallow_water)])
+@pytest.mark.parametrize('kwargs', [{}, {'ensemble_size': 2}, {'workers': 3}])
+def test_equations_match_the_built_in_dynamics(cls, equations, kwargs):
+    built_in, compiled = stepped(cls, None, **kwargs), stepped(cls, equations(), **kwargs)
+    assert np.array_equal(built_in.state_vector, compiled.state_vector)
+
+    built_in.apply_boundary_conditions()
+    compiled.apply_boundary_conditions()
+    for expected, found in zip(built_in._dynamics(), compiled._dynamics()):
+        assert np.array_equal(expected, found)
+
+
+def test_mixing_points_is_an_error():
+    with pytest.raises(ValueError):
+        expressions.u + expressions.v
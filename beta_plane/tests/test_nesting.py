@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from nesting import NestedGrid
+from shallowwater import ClosedShallowWater, DoublyPeriodicShallowWater
+
+
+def test_child_matches_parent_on_uniform_field():
+    parent = DoublyPeriodicShallowWater(24, 25, Lx=1e6, Ly=1e6, f0=0.0, beta=0.0, r=0.0, dt=600.0)
+    parent.phi[:] = 10.0
+    parent.u[:] = 0.5
+    nest = NestedGrid(parent, ((8, 16), (8, 16)), ratio=3)
+    nest.step(20)
+
+    for field, value in ((nest.child.phi, 10.0), (nest.child.u, 0.5), (nest.child.v, 0.0)):
+        assert np.allclose(field, value, rtol=0, atol=1e-12)
+    for field, value in ((parent.phi, 10.0), (parent.u, 0.5), (parent.v, 0.0)):
+        assert np.allclose(field, value, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('cls, patch', [
+    (DoublyPeriodicShallowWater, ((8, 16), (8, 16))),
+    (ClosedShallowWater, ((8, 16), (8, 16))),
+    (DoublyPeriodicShallowWater, ((0, 24), (8, 16))),
+])
+def test_two_way_feedback_conserves_mass(cls, patch):
+    parent = cls(24, 25, Lx=1e6, Ly=1e6, f0=1e-4, beta=0.0, nu=1e3, r=0.0, dt=600.0)
+    x, y = np.meshgrid(np.linspace(-1, 1, parent.nx), np.linspace(-1, 1, parent.ny), indexing='ij')
+    parent.phi[:] = 10.0 + np.exp(-8*((x - 0.2)**2 + (y + 0.1)**2))
+    mass = parent.phi.sum()
+    nest = NestedGrid(parent, patch, ratio=3)
+    nest.step(100)
+
+    assert abs(parent.phi.sum() - mass) < 1e-12*mass
+    # and the feedback did reach the parent: the restricted cells are the
+    # averages of the child's
+    (i0, i1), (j0, j1) = patch
+    average = nest.child.phi.reshape(i1 - i0, 3, j1 - j0, 3).mean(axis=(1, 3))
+    assert np.allclose(parent.phi[i0+1:i1-1, j0+1:j1-1], average[1:-1, 1:-1], rtol=0, atol=1e-12)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from particles import Particles
+from shallowwater import OpenShallowWater, WalledShallowWater
+
+
+def basin():
+    # land in one corner of the domain
+    mask = np.ones((24, 25), dtype=bool)
+    mask[:6, :7] = False
+    return mask
+
+
+@pytest.mark.parametrize('cls, mask', [(OpenShallowWater, None), (WalledShallowWater, basin())])
+def test_particles_leave_the_model_unchanged(cls, mask):
+    models = [cls(24, 25, beta=2.0e-11, f0=1.0e-5, dt=600.0, mask=mask) for _ in range(2)]
+    for model in models:
+        model.phi[:] = 10.0
+        model.phi[10:16, 10:16] += 1.0
+    floats = Particles(models[1], np.linspace(-2.0e6, 2.0e6, 8), np.linspace(-3.0e6, 3.0e6, 8))
+    for _ in range(30):
+        for model in models:
+            model.step()
+        floats.step()
+    assert np.array_equal(models[0].state_vector, models[1].state_vector)
+    assert np.all(np.isfinite(floats.x)) and np.all(np.isfinite(floats.y))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from shallowwater import (OpenLinearShallowWater, OpenShallowWater,
+                          WalledLinearShallowWater, WalledShallowWater)
+
+
+AMPLITUDE = 0.1
+
+
+def bump(model, ny=50, Ly=1e6, rest=0.0):
+    # a zonally uniform bump in the middle, sending a gravity wave to the
+    # north and south boundaries, with dy = Ly/ny on any domain
+    kwargs = dict(Lx=1e6, f0=0.0, beta=0.0, nu=0.0, r=0.0, dt=200.0)
+    if rest == 0.0:
+        kwargs.update(g=9.8, H=10.0)
+    model = model(16, ny, Ly=Ly, **kwargs)
+    model.phi[:] = rest + AMPLITUDE*np.exp(-(model.phiy.ravel()/1e5)**2)
+    if rest:
+        model.phi_rest = rest
+    return model
+
+
+def energy(model, rest, weight):
+    # kinetic plus potential energy of the perturbation, per unit depth
+    return (model.u**2).sum() + (model.v**2).sum() + weight*((model.phi - rest)**2).sum()
+
+
+@pytest.mark.parametrize('cls, walled, rest, weight, speed', [
+    (OpenLinearShallowWater, WalledLinearShallowWater, 0.0, 9.8/10.0, np.sqrt(9.8*10.0)),
+    (OpenShallowWater, WalledShallowWater, 10.0, 1/10.0, np.sqrt(10.0)),
+])
+def test_outgoing_wave_leaves_the_domain(cls, walled, rest, weight, speed):
+    left = []
+    for model in (cls, walled):
+        model = bump(model, rest=rest)
+        initial = energy(model, rest, weight)
+        for _ in range(int(model.Ly / speed / model.dt)):
+            model.step()
+        left.append(energy(model, rest, weight) / initial)
+    # the walls keep the wave, the open boundaries let it out
+    assert left[1] > 0.99
+    assert left[0] < 1e-3
+
+
+def test_open_boundaries_match_a_larger_domain():
+    # until waves could come back from the walls of a domain three times as
+    # tall, its middle third is what the open domain should be
+    model = bump(OpenLinearShallowWater)
+    reference = bump(WalledLinearShallowWater, ny=150, Ly=3e6)
+    for _ in range(int(model.Ly / np.sqrt(9.8*10.0) / model.dt)):
+        model.step()
+        reference.step()
+    assert np.abs(model.phi - reference.phi[:, 50:100]).max() < 0.01*AMPLITUDE
+    assert np.abs(model.v - reference.v[:, 50:101]).max() < 0.01*AMPLITUDE
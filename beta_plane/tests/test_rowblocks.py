@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import threading
+
+import numpy as np
+
+from shallowwater import PeriodicShallowWater
+
+
+def stepped(workers, nsteps=5):
+    model = PeriodicShallowWater(16, 17, beta=2.0e-11, dt=600.0, workers=workers)
+    model.phi[:] = 10.0
+    model.phi[4:8, 4:8] += 1.0
+    model.add_tracer('q', 1.0)
+    for _ in range(nsteps):
+        model.step()
+    return model
+
+
+def test_threaded_steps_match_serial_steps():
+    serial, threaded = stepped(None), stepped(3)
+    assert np.array_equal(serial.state_vector, threaded.state_vector)
+    assert np.array_equal(serial._tracer_stack.state_vector, threaded._tracer_stack.state_vector)
+
+
+def test_models_share_their_threads():
+    stepped(2, 1)
+    threads = threading.active_count()
+    for _ in range(10):
+        stepped(2, 1)
+    assert threading.active_count() == threads
+
+
+def _step_in_child(queue):
+    queue.put(stepped(2, 2).state_vector.sum())
+
+
+def test_forked_child_starts_its_own_threads():
+    expected = stepped(2, 2).state_vector.sum()
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.SimpleQueue()
+    child = ctx.Process(target=_step_in_child, args=(queue,), daemon=True)
+    child.start()
+    child.join(30)
+    if child.is_alive():
+        child.terminate()
+    assert child.exitcode == 0
+    assert queue.get() == expected
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from shallowwater import PeriodicLinearShallowWater, WalledLinearShallowWater, ClosedLinearShallowWater
+
+
+def bump(model):
+    x, y = np.meshgrid(np.linspace(-1, 1, model.nx), np.linspace(-1, 1, model.ny), indexing='ij')
+    model.h[:] = np.exp(-8*(x**2 + y**2))
+
+
+def courant_dt(model, courant):
+    return courant * model.dx / np.sqrt(model.g*model.H)
+
+
+@pytest.mark.parametrize('cls', [PeriodicLinearShallowWater, WalledLinearShallowWater])
+def test_stable_beyond_the_gravity_wave_limit(cls):
+    # a weak beta and sponge, so that only the gravity waves limit dt
+    models = [cls(32, 33, beta=1.0e-13, g=9.8, H=10.0, nu=1.0e3, r=1.0e-6) for _ in range(2)]
+    for model in models:
+        model.dt = courant_dt(model, 5.0)
+        bump(model)
+    models[1].gravity_waves = 'semi-implicit'
+    for _ in range(40):
+        for model in models:
+            model.step()
+    explicit, implicit = models
+    assert implicit.tc == 40
+    assert np.all(np.isfinite(implicit.state_vector))
+    assert np.abs(implicit.h).max() < 1.0
+    assert not np.abs(explicit.h).max() < 1.0
+
+
+def test_matches_explicit_stepping_at_a_short_timestep():
+    models = [WalledLinearShallowWater(32, 33, beta=2.0e-11, g=9.8, H=10.0, nu=1.0e3) for _ in range(2)]
+    for model in models:
+        model.dt = courant_dt(model, 0.05)
+        bump(model)
+    models[1].gravity_waves = 'semi-implicit'
+    for _ in range(10):
+        for model in models:
+            model.step()
+    explicit, implicit = models
+    assert np.allclose(implicit.h, explicit.h, atol=1e-3*np.abs(explicit.h).max())
+
+
+def error_against_explicit(cls, dt, duration=3.0e4):
+    # a bump on an f-plane small enough for its waves to reach the walls
+    models = [cls(16, 17, f0=1.0e-4, beta=0.0, g=9.8, H=10.0, nu=0.0, r=0.0, dt=dt, Lx=5.0e5, Ly=5.0e5)
+              for _ in range(2)]
+    for model in models:
+        bump(model)
+    models[1].gravity_waves = 'semi-implicit'
+    for _ in range(int(round(duration / dt))):
+        for model in models:
+            model.step()
+    explicit, implicit = models
+    return np.abs(implicit.h - explicit.h).max() / np.abs(explicit.h).max()
+
+
+@pytest.mark.parametrize('cls', [WalledLinearShallowWater, ClosedLinearShallowWater])
+def test_second_order_with_waves_reflected_off_rotating_walls(cls):
+    coarse, fine = [error_against_explicit(cls, dt) for dt in (40.0, 20.0)]
+    assert np.log2(coarse / fine) > 1.8
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from shallowwater import DoublyPeriodicShallowWater, PeriodicShallowWater
+
+
+def advected(n, interpolation, courant=1.9, L=1.0e6, U=2.0, duration=2.5e5, tracer_steps=10):
+    # a smooth tracer carried by a uniform flow across a doubly periodic
+    # domain, with the tracers stepped at `courant` times the grid spacing
+    dt = courant * L / n / (U * tracer_steps)
+    model = DoublyPeriodicShallowWater(n, n, Lx=L, Ly=L, f0=0.0, beta=0.0, nu=0.0, r=0.0, dt=dt)
+    model.tracer_advection = 'semi-lagrangian'
+    model.tracer_interpolation = interpolation
+    model.tracer_steps = tracer_steps
+    model.phi[:] = 10.0
+    model.u[:] = U
+    x, y = np.broadcast_arrays(model.phix.reshape(-1, 1), model.phiy.reshape(1, -1))
+
+    def exact(t):
+        return 1 + 0.5*np.sin(2*np.pi*(x - U*t)/L)*np.cos(2*np.pi*y/L)
+
+    q = model.add_tracer('q')
+    q.state[:] = exact(0.0)
+    for _ in range(int(round(duration / model._tracer_stack.dt)) * tracer_steps):
+        model.step()
+    return np.abs(q.state - exact(model.t)).max()
+
+
+def test_smooth_tracer_is_advected_beyond_the_cfl_limit():
+    assert advected(32, 'cubic') < 1e-4
+
+
+@pytest.mark.parametrize('interpolation, order', [('linear', 1), ('cubic', 3)])
+def test_interpolations_converge_at_their_order(interpolation, order):
+    coarse, fine = [advected(n, interpolation) for n in (16, 32)]
+    assert np.log2(coarse / fine) == pytest.approx(order, abs=0.3)
+
+
+def test_steps_allocate_no_full_size_arrays():
+    model = PeriodicShallowWater(128, 129, beta=2.0e-11, dt=600.0)
+    model.tracer_advection = 'semi-lagrangian'
+    model.phi[:] = 10.0
+    model.phi[30:50, 30:50] += 1.0
+    model.add_tracer('q', 1.0)
+    for _ in range(3):
+        model.step()
+    tracemalloc.start()
+    model.step()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 0.5*model.state_vector.nbytes
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import timesteppers
+from shallowwater import PeriodicLinearShallowWater, PeriodicShallowWater
+
+
+class DormandPrinceShallowWater(timesteppers.DormandPrince54, PeriodicShallowWater): pass
+
+
+def dormand_prince_model(dt, rtol):
+    model = DormandPrinceShallowWater(24, 17, beta=2.0e-11, f0=1.0e-5, nu=1.0e3, dt=dt)
+    model.rtol = rtol
+    model.phi[:] = 10.0
+    model.phi[5:10, 5:9] += 1.0
+    model.add_tracer('q', 1.0)
+    model.q[3:8, 3:8] = 2.0
+    return model
+
+
+def test_rejected_steps_restart_from_the_start_of_the_step():
+    model = dormand_prince_model(4.0e5, 1.0e-7)
+    model.step()
+    assert model.rejected_steps > 0
+
+    # the same step taken at once with the dt finally accepted
+    reference = dormand_prince_model(model.t, 1.0e-7)
+    reference.dt_min = model.t
+    reference.step()
+    assert reference.rejected_steps == 0
+    assert reference.t == model.t
+    assert np.array_equal(reference.state_vector, model.state_vector)
+    assert np.array_equal(reference._tracer_stack.state_vector, model._tracer_stack.state_vector)
+
+
+@pytest.mark.parametrize('scheme', [timesteppers.SSPRungeKutta3, timesteppers.LowStorageRungeKutta4])
+@pytest.mark.parametrize('dtype', [np.float64, 'mixed'])
+def test_low_storage_steps_allocate_no_full_size_arrays(scheme, dtype):
+    cls = type('LowStorageShallowWater', (scheme, PeriodicLinearShallowWater), {})
+    model = cls(256, 257, beta=2.0e-11, dt=100.0, dtype=dtype)
+    model.add_tracer('q', 1.0)
+    for _ in range(2):
+        model.step()
+    tracemalloc.start()
+    model.step()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 0.25*model.state_vector.nbytes
+
+
+def test_particles_advance_by_the_step_taken():
+    from particles import Particles
+    model = DormandPrinceShallowWater(24, 17, beta=0.0, f0=0.0, nu=0.0, r=0.0,
+                                       dt=100.0, Lx=2.4e6, Ly=1.7e6)
+    model.phi[:] = 10.0
+    model.u[:] = 1.0
+    floats = Particles(model, np.array([1.0e5, 2.0e5]), np.array([2.0e5, 3.0e5]))
+    for _ in range(5):
+        model.step()
+        floats.step()
+    assert model.dt > model.last_dt > 100.0
+    assert np.allclose(floats.x, [1.0e5 + model.t, 2.0e5 + model.t])
+    assert np.allclose(floats.y, [2.0e5, 3.0e5])
+
+
+def low_storage_error(scheme, dt, reference_dt, duration=2.0e4):
+    cls = type('LowStorageShallowWater', (scheme, PeriodicLinearShallowWater), {})
+    states = []
+    for step in (dt, reference_dt):
+        model = cls(24, 25, beta=2.0e-11, f0=1.0e-4, nu=1.0e3, dt=step, Lx=1.0e6, Ly=1.0e6)
+        x, y = np.meshgrid(np.linspace(-1, 1, model.nx), np.linspace(-1, 1, model.ny), indexing='ij')
+        model.h[:] = np.exp(-8*(x**2 + y**2))
+        for _ in range(int(round(duration / step))):
+            model.step()
+        model.apply_boundary_conditions()
+        states.append(model.state_vector)
+    return np.abs(states[0] - states[1]).max()
+
+
+@pytest.mark.parametrize('scheme, order', [(timesteppers.SSPRungeKutta3, 3),
+                                           (timesteppers.LowStorageRungeKutta4, 4)])
+def test_low_storage_steps_converge_at_their_order(scheme, order):
+    coarse, fine = [low_storage_error(scheme, dt, 31.25) for dt in (500.0, 250.0)]
+    assert np.log2(coarse / fine) == pytest.approx(order, abs=0.3)
+
+
+def test_low_storage_rk4_keeps_one_register():
+    cls = type('LowStorageShallowWater', (timesteppers.LowStorageRungeKutta4, PeriodicLinearShallowWater), {})
+    model = cls(16, 17, beta=2.0e-11, dt=100.0)
+    model.add_tracer('q', 1.0)
+    model.step()
+    for obj in (model, model._tracer_stack):
+        assert [name for name in vars(obj) if name.startswith('_rk')] == ['_rk_register']
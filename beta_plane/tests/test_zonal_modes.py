@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from shallowwater import DoublyPeriodicLinearShallowWater, PeriodicLinearShallowWater
+from zonal_modes import ZonalModes
+
+
+DAYS = 2*86400.0
+
+
+def equatorial_model(cls, dt, forced):
+    model = cls(16, 17, Lx=4e6, Ly=4e6, f0=1e-5, beta=2e-11, nu=1e4, r=1e-5, dt=dt)
+    x, y = np.meshgrid(model.phix.ravel(), model.phiy.ravel(), indexing='ij')
+    model.h[:] = np.exp(-((x - 3e5)**2 + y**2) / 6e5**2)
+    if forced:
+        heat = 1e-5*np.exp(-((x + 5e5)**2 + (y - 2e5)**2) / 5e5**2)
+
+        @model.add_forcing
+        def heating(model):
+            dstate = np.zeros_like(model.state)
+            dstate[2] = heat
+            return dstate
+    return model
+
+
+@pytest.mark.parametrize('forced', [False, True])
+@pytest.mark.parametrize('cls', [PeriodicLinearShallowWater, DoublyPeriodicLinearShallowWater])
+def test_exact_step_matches_small_explicit_steps(cls, forced):
+    exact = equatorial_model(cls, DAYS, forced)
+    ZonalModes(exact, workers=2).step()
+
+    steps = 1000
+    explicit = equatorial_model(cls, DAYS / steps, forced)
+    for _ in range(steps):
+        explicit.step()
+    explicit.apply_boundary_conditions()
+
+    assert np.isclose(exact.t, explicit.t)
+    for field, expected in zip(exact.state, explicit.state):
+        assert np.abs(field - expected).max() < 1e-4*np.abs(expected).max()
@@ -1,55 +1,135 @@
 import itertools
 
+import numpy as np
+
+import kernels
+
 class Timestepper(object):
     """Calculate the time-tendencies and timestepping of the equation
         dstate/dt = _dstate()
+
+    The timestepper works on `state_vector`, a flat view of the state, and
+    `_dstate()` should return a flat tendency of the same size.
+
+    A step is taken in two phases, so that several timesteppers may be
+    stepped together (see `sync_step`): `_evaluate` computes what the step
+    needs from the current state, then `_advance` updates the state.
     """
     t = 0.0
     tc = 0
+    last_dt = None       # the length of the last step taken, which an adaptive dt may not equal
+    multistage = False   # steps by evaluating _dstate at several states, see sync_step
 
     def step(self):
-        self.state[:] = self.state + self.dstate()
-        self._incr_timestep()
+        sync_step(self)
 
     def _incr_timestep(self):
+        self.last_dt = self.dt
         self.t = self.t + self.dt
         self.tc = self.tc + 1
 
     def dstate(self):
         raise NotImplemented()
 
+    def _evaluate(self):
+        self._increment = self.dstate()
+
+    def _advance(self):
+        state = self.state_vector
+        state += self._increment
+        del self._increment
+
 class Euler(Timestepper):
     def dstate(self):
-        dstate =  self.dt*self._dstate()
+        dstate = np.multiply(self.dt, self._dstate(), dtype=self.state_vector.dtype)
         return dstate
 
 
-class AdamsBashforth3(Timestepper):
-    _pfstate, _ppfstate = 0.0, 0.0
+def adams_bashforth(state, coeffs, history, slots, chunk=1 << 15):
+    """Add the weighted tendencies to `state` in place,
 
-    def dstate(self):
-        dt = self.dt
-        fstate = self._dstate()
+        state[r] += sum(coeffs[n, r] * history[slots[n]][r] for n)
+
+    for each row r of the (rows, ...) `state`, given `history` of three
+    arrays of the same shape, e.g. the (3, rows, m) ring of the timestepper.
+    The terms are summed in float64 and added to the state with a single
+    rounding.  The fused kernel does it in one pass when Numba is installed
+    and the arrays are a flat ring, otherwise the terms are accumulated
+    about `chunk` values at a time through small scratch arrays, in the
+    same order: both give the same result on any part of the state."""
+    if kernels.numba is not None and state.ndim == 2 and isinstance(history, np.ndarray):
+        kernels.adams_bashforth(state, coeffs, history, np.asarray(slots))
+        return state
+    first, rest = slots[0], list(zip(coeffs[1:], slots[1:]))
+    n, inner = state.shape[1], state.shape[2:]
+    step = max(1, chunk // max(1, int(np.prod(inner))))
+    scratch = np.empty((2, min(step, n)) + inner)
+    for r, row in enumerate(state):
+        for start in range(0, n, step):
+            part = row[start:start+step]
+            index = (r, slice(start, start+step))
+            acc, term = scratch[:, :len(part)]
+            np.multiply(history[first][index], coeffs[0, r], out=acc, dtype=np.float64)
+            for c, slot in rest:
+                acc += np.multiply(history[slot][index], c[r], out=term, dtype=np.float64)
+            part += acc
+    return state
 
-        if self.tc == 0:
-            # first step Euler
-            dt1 = dt
-            dstate = dt1*fstate
 
-        elif self.tc == 1:
-            dt1 = 1.5*dt
-            dt2 = -0.5*dt
-            dstate = dt1*fstate + dt2*self._pfstate
+class AdamsBashforth3(Timestepper):
+    """Third order Adams-Bashforth, starting with an Euler and a second
+    order step.  The tendencies of the last three steps are kept in a ring
+    of preallocated slots, `history`: the tendency is written straight into
+    the slot of the current step and the state updated in place by
+    `adams_bashforth`, so a step allocates no full-size arrays."""
+    _history = None
 
+    @staticmethod
+    def coefficients(tc, dt):
+        """Weights of the current and previous tendencies at step `tc`."""
+        if tc == 0:
+            # first step Euler
+            return (dt,)
+        elif tc == 1:
+            return (1.5*dt, -0.5*dt)
         else:
-            dt1 = 23./12.*dt
-            dt2 = -16./12.*dt
-            dt3 = 5./12.*dt
-            dstate = dt1*fstate + dt2*self._pfstate + dt3*self._ppfstate
+            return (23./12.*dt, -16./12.*dt, 5./12.*dt)
 
-        # update the cached previous fstate values
-        self._ppfstate, self._pfstate = self._pfstate, fstate
-        return dstate
+    def step_coefficients(self):
+        """Weights of the current and previous tendencies for this step."""
+        return self.coefficients(self.tc, self.dt)
+
+    @property
+    def history(self):
+        """The (3, n) ring of flat tendencies: that of step tc is in row
+        tc % 3.  Allocated on first use, in the precision of the
+        tendencies."""
+        n = self.state_vector.size
+        if self._history is None or self._history.shape[1] != n:
+            dtype = getattr(self, 'tendency_dtype', self.state_vector.dtype)
+            self._history = np.zeros((3, n), dtype=dtype)
+        return self._history
+
+    def _history_rows(self):
+        # the number of rows of the state with their own weights
+        return 1
+
+    def _row_coefficients(self):
+        # the step coefficients as a (terms, rows) array
+        coeffs = self.step_coefficients()
+        return np.asarray(coeffs, dtype=np.float64).reshape(len(coeffs), -1) * np.ones((1, self._history_rows()))
+
+    def _evaluate(self):
+        self._dstate(out=self.history[self.tc % 3])
+
+    def _advance(self):
+        coeffs = self._row_coefficients()
+        rows = self._history_rows()
+        # accumulate in the precision of the state, which may be higher
+        # than that of the tendencies
+        adams_bashforth(self.state_vector.reshape(rows, -1), coeffs,
+                        self.history.reshape(3, rows, -1),
+                        [(self.tc - n) % 3 for n in range(len(coeffs))])
 
 
 def sync_step(*timesteppers):
@@ -57,8 +137,283 @@ def sync_step(*timesteppers):
     This is important if values of each at a given timestep depend on each
     other, e.g. if a tracer has a feedback onto other tracers or state variables.
     """
-    dstates = [obj.dstate() for obj in timesteppers]
-    for obj, dstate in zip(timesteppers, dstates):
-        obj.state = obj.state + dstate
+    if timesteppers[0].multistage:
+        # the first timestepper leads the stages of all of them
+        return timesteppers[0].multistage_step(timesteppers)
+    for obj in timesteppers:
+        obj._evaluate()
+    for obj in timesteppers:
+        obj._advance()
         obj._incr_timestep()
 
+
+def _refresh(obj):
+    # make the stage state of obj consistent: boundaries and derived fields
+    if hasattr(obj, 'apply_boundary_conditions'):
+        obj.apply_boundary_conditions()
+    if hasattr(obj, 'state_changed'):
+        obj.state_changed()
+
+
+def _check_stepped_together(leader, timesteppers):
+    # everything stepped with a multistage leader takes its stages and dt
+    for obj in timesteppers:
+        if obj.dt != leader.dt:
+            raise ValueError('the timesteppers stepped with %s must share its dt, e.g. tracer_steps = 1'
+                             % type(leader).__name__)
+        if getattr(obj, 'semi_lagrangian', False):
+            raise ValueError('semi-Lagrangian tracers need the Adams-Bashforth timestepper')
+
+
+class RungeKutta(Timestepper):
+    """Base of the Runge-Kutta timesteppers.  These evaluate `_dstate` at
+    the intermediate stages of a step, so a group of timesteppers stepped
+    together by `sync_step` is stepped stage by stage by the first of them,
+    in its `multistage_step`."""
+    multistage = True
+
+    def dstate(self):
+        raise TypeError('%s is stepped by sync_step, not by its dstate' % type(self).__name__)
+
+    def multistage_step(self, timesteppers):
+        raise NotImplementedError()
+
+
+class EmbeddedRungeKutta(RungeKutta):
+    """Explicit Runge-Kutta stepping with an embedded error estimate and an
+    adaptive timestep.  A mixin placed before the model in its bases:
+
+        class Ocean(DormandPrince54, PeriodicShallowWater): pass
+
+    The stages are given by the Butcher tableau `a`, `c`; `b` weights them
+    into the new state and `b_hat` into an embedded solution of order
+    `embedded_order`.  Their difference, measured as the RMS of
+
+        error / (atol + rtol*|state|)
+
+    over the model and the tracers stepped with it (see `sync_step`), must
+    be at most one for the step to be accepted, otherwise it is repeated
+    with a smaller dt.  A PI controller then sets `dt` for the next step
+    within `dt_min`, `dt_max`, so runs should loop on `t` rather than on
+    the number of steps.  Forcings see `t` at the time of each stage.
+    """
+    a, b, b_hat, c = (), (), (), ()
+    embedded_order = 1
+    rtol = 1e-3
+    atol = 1e-6
+    safety = 0.9
+    min_factor, max_factor = 0.2, 5.0   # limits on the change of dt in one step
+    dt_min, dt_max = 0.0, np.inf
+    max_rejections = 30
+    rejected_steps = 0     # steps repeated with a smaller dt, in total
+    _error_ratio = None    # the error of the last accepted step
+
+    def _stages(self, timesteppers, states, times, dt, first):
+        # the tendencies of every timestepper at every stage, the first
+        # being those at the start of the step, which do not depend on dt
+        tendencies = [[k0] for k0 in first]
+        for a_i, c_i in zip(self.a[1:], self.c[1:]):
+            for obj, state, t, k in zip(timesteppers, states, times, tendencies):
+                vector = obj.state_vector
+                np.copyto(vector, state)
+                for a_ij, k_j in zip(a_i, k):
+                    if a_ij:
+                        vector += (dt*a_ij)*k_j
+                obj.t = t + c_i*dt
+                _refresh(obj)
+            for obj, k in zip(timesteppers, tendencies):
+                k.append(obj._dstate())
+        return tendencies
+
+    def _combine(self, timesteppers, states, tendencies, dt):
+        # write the new states and return the error ratio of the step
+        total, n = 0.0, 0
+        for obj, state, k in zip(timesteppers, states, tendencies):
+            vector = obj.state_vector
+            np.copyto(vector, state)
+            error = np.zeros(vector.shape)
+            for b_j, bh_j, k_j in zip(self.b, self.b_hat, k):
+                if b_j:
+                    vector += (dt*b_j)*k_j
+                if b_j != bh_j:
+                    error += (dt*(b_j - bh_j))*k_j
+            error /= self.atol + self.rtol*np.maximum(np.abs(state), np.abs(vector))
+            total += np.dot(error, error)
+            n += error.size
+        ratio = np.sqrt(total / max(n, 1))
+        return ratio if np.isfinite(ratio) else np.inf
+
+    def multistage_step(self, timesteppers):
+        """Take one accepted step of the timesteppers together, led by this one."""
+        _check_stepped_together(self, timesteppers)
+        for obj in timesteppers:
+            _refresh(obj)
+        states = [obj.state_vector.copy() for obj in timesteppers]
+        times = [obj.t for obj in timesteppers]
+        # the tendencies at the start, reused by any repeated attempt
+        first = [obj._dstate() for obj in timesteppers]
+        q = self.embedded_order + 1
+        dt = min(max(self.dt, self.dt_min), self.dt_max)
+        for rejections in itertools.count():
+            tendencies = self._stages(timesteppers, states, times, dt, first)
+            ratio = self._combine(timesteppers, states, tendencies, dt)
+            if ratio <= 1.0 or dt <= self.dt_min:
+                break
+            if rejections == self.max_rejections:
+                raise RuntimeError('%s rejected %d steps in a row, down to dt=%g'
+                                   % (type(self).__name__, rejections+1, dt))
+            self.rejected_steps += 1
+            dt = max(dt * max(self.min_factor, self.safety*ratio**(-1.0/q)), self.dt_min)
+
+        self.dt = dt
+        for obj, t in zip(timesteppers, times):
+            obj.t = t
+            obj._incr_timestep()
+
+        # PI control of the next step
+        if ratio == 0:
+            factor = self.max_factor
+        else:
+            factor = self.safety * ratio**(-0.7/q) * (self._error_ratio or 1.0)**(0.4/q)
+            factor = min(max(factor, self.min_factor), self.max_factor)
+        if rejections:
+            factor = min(factor, 1.0)
+        self._error_ratio = max(ratio, 1e-4)
+        self.dt = min(max(dt*factor, self.dt_min), self.dt_max)
+
+
+class BogackiShampine32(EmbeddedRungeKutta):
+    """Third order Runge-Kutta with an embedded second order error estimate."""
+    c = (0.0, 1/2, 3/4, 1.0)
+    a = ((),
+         (1/2,),
+         (0.0, 3/4),
+         (2/9, 1/3, 4/9))
+    b = (2/9, 1/3, 4/9, 0.0)
+    b_hat = (7/24, 1/4, 1/3, 1/8)
+    embedded_order = 2
+
+
+class DormandPrince54(EmbeddedRungeKutta):
+    """Fifth order Runge-Kutta with an embedded fourth order error estimate."""
+    c = (0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0)
+    a = ((),
+         (1/5,),
+         (3/40, 9/40),
+         (44/45, -56/15, 32/9),
+         (19372/6561, -25360/2187, 64448/6561, -212/729),
+         (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+         (35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84))
+    b = (35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84, 0.0)
+    b_hat = (5179/57600, 0.0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40)
+    embedded_order = 4
+
+
+class LowStorageRungeKutta(RungeKutta):
+    """Runge-Kutta stepping in place with registers kept between steps, a
+    mixin placed before the model in its bases like `EmbeddedRungeKutta`.
+    No tendency history is kept and a step allocates no full-size arrays.
+    Forcings see `t` at the time of each stage, `c`.
+    """
+    c = ()
+
+    def _register(self, obj, name='_rk_register', dtype=None):
+        # an array of obj kept between steps, by default in the precision
+        # of its state
+        vector = obj.state_vector
+        dtype = vector.dtype if dtype is None else np.dtype(dtype)
+        register = obj.__dict__.get(name)
+        if register is None or register.shape != vector.shape or register.dtype != dtype:
+            register = np.empty(vector.shape, dtype=dtype)
+            setattr(obj, name, register)
+        return register
+
+    def _begin(self, state, register):
+        raise NotImplementedError()
+
+    def _stage_tendency(self, i, obj, register, dt):
+        # evaluate the tendency of stage i of obj, returns the array holding it
+        raise NotImplementedError()
+
+    def _update(self, i, state, register, tendency, dt):
+        raise NotImplementedError()
+
+    def multistage_step(self, timesteppers):
+        """Take one step of the timesteppers together, led by this one."""
+        _check_stepped_together(self, timesteppers)
+        dt = self.dt
+        times = [obj.t for obj in timesteppers]
+        registers = [self._register(obj) for obj in timesteppers]
+        for obj, register in zip(timesteppers, registers):
+            self._begin(obj.state_vector, register)
+
+        for i, c_i in enumerate(self.c):
+            for obj, t in zip(timesteppers, times):
+                obj.t = t + c_i*dt
+                if i > 0:
+                    _refresh(obj)
+            # every tendency is evaluated before any state is updated
+            tendencies = [self._stage_tendency(i, obj, register, dt)
+                          for obj, register in zip(timesteppers, registers)]
+            for obj, register, tendency in zip(timesteppers, registers, tendencies):
+                self._update(i, obj.state_vector, register, tendency, dt)
+
+        for obj, t in zip(timesteppers, times):
+            obj.t = t
+            obj._incr_timestep()
+
+
+class SSPRungeKutta3(LowStorageRungeKutta):
+    """Three stage, third order strong stability preserving Runge-Kutta of
+    Shu and Osher.  Each stage is a convex combination of an Euler step and
+    the state at the start of the step, which is kept in the register.  The
+    start of the step, the stage and its tendency are all needed at the last
+    stage, so the tendency has a register of its own (3N storage)."""
+    c = (0.0, 1.0, 0.5)
+    alpha = (0.0, 3/4, 1/3)   # weight of the start of the step in each stage
+
+    def _begin(self, state, register):
+        np.copyto(register, state)
+
+    def _stage_tendency(self, i, obj, register, dt):
+        tendency = self._register(obj, '_rk_tendency', getattr(obj, 'tendency_dtype', None))
+        return obj._dstate(out=tendency)
+
+    def _update(self, i, state, register, tendency, dt):
+        tendency *= dt
+        state += tendency
+        if self.alpha[i]:
+            # state = alpha*start + (1 - alpha)*state
+            state -= register
+            state *= 1 - self.alpha[i]
+            state += register
+
+
+class LowStorageRungeKutta4(LowStorageRungeKutta):
+    """Five stage, fourth order low-storage Runge-Kutta of Carpenter and
+    Kennedy (1994), in Williamson's form
+
+        dq = A[i] dq + dt f(q),   q = q + B[i] dq
+
+    with the register holding B[i] dq.  Each stage tendency is added straight
+    into the register, rescaled to dq/dt beforehand, so the state and the
+    register are all the storage it needs (2N)."""
+    A = (0.0, -567301805773/1357537059087, -2404267990393/2016746695238,
+         -3550918686646/2091501179385, -1275806237668/842570457699)
+    B = (1432997174477/9575080441755, 5161836677717/13612068292357,
+         1720146321549/2090206949498, 3134564353537/4481467310338,
+         2277821191437/14882151754819)
+    c = (0.0, 1432997174477/9575080441755, 2526269341429/6820363183890,
+         2006345519317/3224310063776, 2802321613138/2924317926251)
+
+    def _begin(self, state, register):
+        register.fill(0)
+
+    def _stage_tendency(self, i, obj, register, dt):
+        if i > 0:
+            register *= self.A[i]/(self.B[i-1]*dt)
+        return obj._dstate(out=register, accumulate=True)
+
+    def _update(self, i, state, register, tendency, dt):
+        register *= self.B[i]*dt
+        state += register
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Exact stepping of the periodic linear model one zonal wavenumber at a time.
+
+The coefficients of `PeriodicLinearShallowWater` (or of a doubly periodic
+linear model) only vary in y, so its `linear_operator` commutes with a
+shift in x.  An rfft in x splits the state into independent modes, each a
+column of u, v and h values in y evolving as
+
+    d/dt[s_k] = A_k s_k + F_k
+
+`ZonalModes` reads the small matrices A_k off the sparse operator of the
+model, boundary conditions included, and advances every mode exactly by
+its propagator exp(A_k dt), computed once for each dt and set of model
+parameters.  The forcings of the model are transformed the same way and
+held fixed over a step,
+
+    s_k(t + dt) = exp(A_k dt) s_k(t) + dt φ(A_k dt) F_k,   φ(z) = (e^z - 1)/z
+
+which is exact for a forcing that does not change in time, so the step is
+only limited by how fast the forcing does change, e.g. the relaxation
+time of a Matsuno-Gill heating.  Each propagator is a dense (3ny+1)^2
+complex matrix, nx/2+1 of them (twice as many with forcings): the memory
+and the one-off cost of the matrix exponentials grow as nx ny^2 and nx ny^3.
+"""
+
+import numpy as np
+import scipy.linalg
+
+from arakawac import PackedState, PeriodicBoundaries, DoublyPeriodicBoundaries, RadiationBoundaries
+from rowblocks import split, thread_pool
+
+
+class ZonalModes(object):
+    """Step the periodic linear shallow water `model` by `dt` (by default
+    its own timestep) with the exact propagator of each zonal wavenumber,
+    the wavenumbers spread over `workers` threads, shared with the models
+    and engines of as many workers.
+
+        engine = ZonalModes(model, dt=86400.0, workers=4)
+        engine.step(100)
+
+    Each step advances `model.t` by `dt` and `model.tc` by one.  Afterwards
+    the Adams-Bashforth history of the model holds its current tendency,
+    so `model.step` may carry on from the new state.
+    """
+    def __init__(self, model, dt=None, workers=None):
+        if not isinstance(model, (PeriodicBoundaries, DoublyPeriodicBoundaries)) \
+                or isinstance(model, RadiationBoundaries):
+            raise ValueError('the zonal modes need a domain periodic in x')
+        if not hasattr(model, 'linear_operator'):
+            raise ValueError('%s has no linear operator' % type(model).__name__)
+        if model.mask is not None:
+            raise ValueError('a land-sea mask couples the zonal modes')
+        if model._tracer_stack is not None:
+            raise ValueError('tracers cannot be stepped by the zonal modes')
+        self.model = model
+        self.dt = model.dt if dt is None else dt
+        self.nk = model.nx//2 + 1
+        self.blocks = split(self.nk, min(workers or 1, self.nk))
+        self.pool = thread_pool(len(self.blocks))
+        self._cells = self._mode_cells()
+        self._operator, self._propagators = None, {}
+
+    def _mode_cells(self):
+        # flat indices (members, N, nx) of the cells not set by the boundary
+        # conditions: the N points in y of every mode, at each x
+        model = self.model
+        n = model.state_vector.size
+        dst, _, _ = model.boundary_map(model._packed.shapes, model._boundary_rules)
+        keep = np.ones(n, dtype=bool)
+        keep[dst] = False
+
+        cells = []
+        for field in PackedState(model._packed.shapes, np.arange(n), spatial_ndim=2).padded:
+            field = field.reshape((-1,) + field.shape[-2:])
+            kept = keep[field]
+            xs, ys = np.flatnonzero(kept[0].any(axis=1)), np.flatnonzero(kept[0].any(axis=0))
+            if len(xs) != model.nx or kept.sum() != len(field)*len(xs)*len(ys):
+                raise ValueError('the boundary conditions of %s are not periodic in x' % type(model).__name__)
+            cells.append(field[:, xs][:, :, ys].transpose(0, 2, 1))
+        return np.concatenate(cells, axis=1)
+
+    def operators(self):
+        """Returns the matrices A_k of the modes, a (members, nx/2+1, N, N)
+        complex array, read off `model.linear_operator()`."""
+        model, cells = self.model, self._cells
+        members, N, nx = cells.shape
+        matrix = model.linear_operator()
+
+        slot, xi, member = [np.full(model.state_vector.size, -1) for _ in range(3)]
+        slot[cells] = np.arange(N)[:, np.newaxis]
+        xi[cells] = np.arange(nx)
+        member[cells] = np.arange(members)[:, np.newaxis, np.newaxis]
+
+        # the rows of the cells at x=0 hold every coupling, the other rows
+        # are shifted copies of them
+        rows = cells[..., 0].ravel()
+        coupling = matrix[rows].tocoo()
+        nonzero = coupling.data != 0
+        r, c, values = rows[coupling.row[nonzero]], coupling.col[nonzero], coupling.data[nonzero]
+        if np.any(slot[c] < 0) or np.any(member[c] != member[r]):
+            raise ValueError('the operator of %s reads cells outside its modes' % type(model).__name__)
+        phase = np.exp(2j*np.pi*np.outer(xi[c], np.arange(self.nk)) / nx)
+        ops = np.zeros((members, N, N, self.nk), dtype=np.complex128)
+        np.add.at(ops, (member[r], slot[r], slot[c]), values[:, np.newaxis]*phase)
+        ops = np.ascontiguousarray(np.moveaxis(ops, -1, 1))
+
+        # the operator must commute with a shift in x for the modes to be independent
+        x = np.random.default_rng(0).standard_normal(model.state_vector.size)
+        expected = (matrix @ x)[cells]
+        found = self._cells_of(ops @ self._modes_of(x[cells]))
+        if not np.allclose(found, expected, rtol=1e-4, atol=1e-4*np.abs(expected).max()):
+            raise ValueError('the coefficients of %s vary in x' % type(model).__name__)
+        return ops
+
+    def _modes_of(self, values):
+        # (members, N, nx) values at the cells -> (members, nk, N, 1) modes
+        return np.moveaxis(np.fft.rfft(values, axis=-1), -1, 1)[..., np.newaxis]
+
+    def _cells_of(self, modes):
+        return np.fft.irfft(np.moveaxis(modes[..., 0], 1, -1), n=self.model.nx, axis=-1)
+
+    def propagators(self, forced=False):
+        """Returns exp(A_k dt) and, if `forced`, dt φ(A_k dt) of every mode,
+        computed on first use for the current model parameters."""
+        operator = self.model.linear_operator()
+        if operator is not self._operator:
+            self._operator, self._propagators = operator, {}
+            self._ops = self.operators()
+        key = (self.dt, forced)
+        if key not in self._propagators:
+            ops, dt = self._ops, self.dt
+            members, nk, N, _ = ops.shape
+            P = np.empty_like(ops)
+            Phi = np.empty_like(ops) if forced else None
+
+            def compute(block):
+                ks = slice(*block)
+                if not forced:
+                    P[:, ks] = scipy.linalg.expm(ops[:, ks]*dt)
+                    return
+                # exp([[A, 1], [0, 0]] dt) = [[exp(A dt), dt φ(A dt)], [0, 1]]
+                augmented = np.zeros((members, ks.stop - ks.start, 2*N, 2*N), dtype=ops.dtype)
+                augmented[..., :N, :N] = ops[:, ks]*dt
+                augmented[..., :N, N:] = dt*np.eye(N)
+                exp = scipy.linalg.expm(augmented)
+                P[:, ks], Phi[:, ks] = exp[..., :N, :N], exp[..., :N, N:]
+
+            for future in [self.pool.submit(compute, block) for block in self.blocks]:
+                future.result()
+            self._propagators[key] = P, Phi
+        return self._propagators[key]
+
+    def _forcing(self):
+        # the summed forcings of the model at the cells of the modes
+        model = self.model
+        dstate = np.zeros_like(model._packed, dtype=model.tendency_dtype)
+        for term in model._forcing_terms():
+            model._accumulate(dstate, term)
+        return dstate.vector[self._cells]
+
+    def step(self, nsteps=1):
+        """Advance the model `nsteps` steps of `dt`."""
+        model = self.model
+        forced = bool(model.forcings)
+        P, Phi = self.propagators(forced)
+        for _ in range(nsteps):
+            model.apply_boundary_conditions()
+            modes = self._modes_of(model.state_vector[self._cells])
+            if forced:
+                forcing = self._modes_of(self._forcing())
+            new = np.empty_like(modes)
+
+            def advance(block):
+                ks = slice(*block)
+                np.matmul(P[:, ks], modes[:, ks], out=new[:, ks])
+                if forced:
+                    new[:, ks] += Phi[:, ks] @ forcing[:, ks]
+
+            for future in [self.pool.submit(advance, block) for block in self.blocks]:
+                future.result()
+            model.state_vector[self._cells] = self._cells_of(new)
+            model.last_dt = self.dt
+            model.t = model.t + self.dt
+            model.tc = model.tc + 1
+
+        model.apply_boundary_conditions()
+        if not model.multistage:
+            history = model.history
+            model._dstate(out=history[(model.tc - 1) % 3])
+            history[(model.tc - 2) % 3] = history[(model.tc - 1) % 3]